@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+#
+# Bootloader protocol simulator for exercising uploader.py without hardware
+#
+# Implements the serial protocol spoken by the uploader class (GET_SYNC,
+# GET_DEVICE, CHIP_ERASE/CHIP_FULL_ERASE, PROG_MULTI, GET_CRC, READ_MULTI,
+# the EXTF_* commands, SET_BAUD, REBOOT and the rev4/5 identification
+# commands) on the slave side of a Linux pseudo-terminal.
+#
+# Replies are delayed by a configurable link latency without stalling the
+# command parser, so that, as on a real USB link, several commands can be
+# in flight at once. Erase duration, per-group programming time, flash
+# size and injected faults are configurable.
+#
+# With app_mode the simulator starts out as a flight stack that ignores the
+# bootloader protocol until it receives a MAVLink reboot-to-bootloader
+# command, then "re-enumerates": its pty goes away and a new one appears
+# after reboot_time, optionally behind a /dev/serial/by-id style symlink.
+#
+# Run standalone to get a port for uploader.py --port:
+#
+#   ./bootloader_sim.py --latency 0.001
+#
+
+import argparse
+import heapq
+import os
+import pty
+import select
+import struct
+import sys
+import threading
+import time
+import tty
+
+
+def crc32_table(poly=0xEDB88320):
+    table = []
+    for i in range(256):
+        c = i
+        for bit in range(8):
+            c = (c >> 1) ^ poly if c & 1 else c >> 1
+        table.append(c)
+    return table
+
+
+CRC_TABLE = crc32_table()
+
+
+def crc32(data, state=0):
+    # the bootloader's byte-at-a-time CRC with a table built here from the
+    # polynomial, so a mistake in the uploader's zlib-based crc32() or its
+    # hard-coded table shows up as a CRC mismatch instead of being shared
+    for byte in memoryview(data).cast('B'):
+        state = CRC_TABLE[(state ^ byte) & 0xff] ^ (state >> 8)
+    return state
+
+
+class BootloaderSim(object):
+    '''Simulated bootloader on a pseudo-terminal'''
+
+    # protocol bytes
+    INSYNC          = b'\x12'
+    EOC             = 0x20
+
+    # reply bytes
+    OK              = b'\x10'
+    FAILED          = b'\x11'
+    INVALID         = b'\x13'
+
+    # command bytes
+    GET_SYNC        = 0x21
+    GET_DEVICE      = 0x22
+    CHIP_ERASE      = 0x23
+    CHIP_VERIFY     = 0x24
+    PROG_MULTI      = 0x27
+    READ_MULTI      = 0x28
+    GET_CRC         = 0x29
+    GET_OTP         = 0x2a
+    GET_SN          = 0x2b
+    GET_CHIP        = 0x2c
+    SET_BOOT_DELAY  = 0x2d
+    GET_CHIP_DES    = 0x2e
+    REBOOT          = 0x30
+    SET_BAUD        = 0x33
+    EXTF_ERASE      = 0x34
+    EXTF_PROG_MULTI = 0x35
+    EXTF_READ_MULTI = 0x36
+    EXTF_GET_CRC    = 0x37
+    CHIP_FULL_ERASE = 0x40
+
+    INFO_BL_REV     = 0x01
+    INFO_BOARD_ID   = 0x02
+    INFO_BOARD_REV  = 0x03
+    INFO_FLASH_SIZE = 0x04
+    INFO_EXTF_SIZE  = 0x06
+
+    def __init__(self,
+                 flash_size=1966080,
+                 extf_size=0,
+                 board_id=1063,
+                 board_rev=0,
+                 bl_rev=5,
+                 latency=0.0,
+                 erase_time=0.5,
+                 prog_time=0.0,
+                 serial_number=b'\x2d\x00\x36\x00\x08\x51\x32\x31\x38\x36\x31\x32',
+                 chip=0x20036450,
+                 chip_des="STM32H7[4|5]x,V",
+                 faults=None,
+                 app_mode=False,
+                 reboot_time=0.5,
+                 link=None,
+                 bl_link=None):
+        '''link and bl_link are symlinks kept pointing at the pty while it acts
+        as the flight stack and as the bootloader respectively; port is the
+        current symlink if given, otherwise the pty itself.
+
+        faults is a dict of injected failures:
+
+        prog_fail_at    reply FAILED to the Nth PROG_MULTI (0-based), once
+        prog_invalid_at reply INVALID to the Nth PROG_MULTI, once
+        corrupt_at      flip a bit in the data of the Nth PROG_MULTI
+        drop_reply_at   send no reply to the Nth command of any kind
+        erase_fail      reply FAILED to chip erase
+        '''
+        self.flash_size = flash_size
+        self.extf_size = extf_size
+        self.board_id = board_id
+        self.board_rev = board_rev
+        self.bl_rev = bl_rev
+        self.latency = latency
+        self.erase_time = erase_time
+        self.prog_time = prog_time
+        self.serial_number = serial_number
+        self.chip = chip
+        self.chip_des = chip_des
+        self.faults = dict(faults or {})
+
+        self.flash = bytearray(b'\xff' * flash_size)
+        self.extf = bytearray(b'\xff' * extf_size)
+        self.address = 0
+        self.extf_address = 0
+        self.boot_delay = None
+        self.rebooted = False
+        self.app_mode = app_mode
+        self.reboot_time = reboot_time
+        self.link = link
+        self.bl_link = bl_link
+        self.reenumerated_at = None
+
+        # statistics
+        self.commands = {}
+        self.prog_count = 0
+        self.command_count = 0
+
+        self.__open_pty()
+
+        self.__inbuf = bytearray()
+        self.__outq = []
+        self.__outseq = 0
+        self.__outlock = threading.Condition()
+        self.__running = True
+        self.__reader = threading.Thread(target=self.__run, name="bootloader-sim")
+        self.__writer = threading.Thread(target=self.__write_loop, name="bootloader-sim-tx")
+        self.__reader.daemon = True
+        self.__writer.daemon = True
+        self.__reader.start()
+        self.__writer.start()
+
+    def close(self):
+        self.__running = False
+        with self.__outlock:
+            self.__outlock.notify()
+        self.__reader.join(1.0)
+        self.__writer.join(1.0)
+        self.__close_pty()
+
+    def __open_pty(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        link = self.link if self.app_mode else self.bl_link
+        if link is not None:
+            os.symlink(self.port, link)
+            self.port = link
+
+    def __close_pty(self):
+        for link in (self.link, self.bl_link):
+            if link is not None and os.path.lexists(link):
+                os.unlink(link)
+        os.close(self.master)
+        os.close(self.slave)
+
+    # drop off the bus and come back as the bootloader
+    def __reenumerate(self):
+        self.__close_pty()
+        time.sleep(self.reboot_time)
+        self.app_mode = False
+        self.__inbuf = bytearray()
+        self.__open_pty()
+        self.reenumerated_at = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # deliver reply bytes after the configured link latency
+    def __reply(self, data):
+        with self.__outlock:
+            heapq.heappush(self.__outq, (time.time() + self.latency, self.__outseq, bytes(data)))
+            self.__outseq += 1
+            self.__outlock.notify()
+
+    def __write_loop(self):
+        while self.__running:
+            with self.__outlock:
+                if not self.__outq:
+                    self.__outlock.wait(0.1)
+                    continue
+                (due, seq, data) = self.__outq[0]
+                delay = due - time.time()
+                if delay > 0:
+                    self.__outlock.wait(delay)
+                    continue
+                heapq.heappop(self.__outq)
+            try:
+                os.write(self.master, data)
+            except OSError:
+                # the pty went away under a re-enumeration
+                continue
+
+    def __read(self, count):
+        while len(self.__inbuf) < count:
+            if not self.__running:
+                raise EOFError()
+            (r, w, x) = select.select([self.master], [], [], 0.1)
+            if not r:
+                continue
+            try:
+                self.__inbuf += os.read(self.master, 4096)
+            except OSError:
+                raise EOFError()
+        data = bytes(self.__inbuf[:count])
+        del self.__inbuf[:count]
+        return data
+
+    def __byte(self):
+        return self.__read(1)[0]
+
+    # read the rest of a command up to and including EOC; None if the
+    # framing is wrong, in which case the real bootloader stays silent
+    def __args(self, count):
+        data = self.__read(count + 1)
+        if data[-1] != self.EOC:
+            return None
+        return data[:-1]
+
+    def __sync(self, status=None):
+        self.__reply(self.INSYNC + (status or self.OK))
+
+    def __fault(self, name, index):
+        if self.faults.get(name) == index:
+            del self.faults[name]
+            return True
+        return False
+
+    def __run(self):
+        try:
+            while self.__running:
+                if self.app_mode:
+                    self.__run_app()
+                    continue
+                cmd = self.__byte()
+                self.__handle(cmd)
+        except EOFError:
+            pass
+
+    # flight stack: wait for a MAVLink v1 COMMAND_LONG carrying
+    # MAV_CMD_PREFLIGHT_REBOOT_SHUTDOWN with param1=3 (stay in bootloader)
+    def __run_app(self):
+        if self.__byte() != 0xfe:
+            return
+        header = self.__read(5)
+        (length, seq, sysid, compid, msgid) = struct.unpack("<BBBBB", header)
+        payload = self.__read(length + 2)[:length]
+        if msgid != 76 or length < 33:
+            return
+        param1 = struct.unpack("<f", payload[0:4])[0]
+        command = struct.unpack("<H", payload[28:30])[0]
+        if command == 246 and param1 == 3.0:
+            self.__reenumerate()
+
+    def __handle(self, cmd):
+        if cmd == self.GET_SYNC:
+            if self.__args(0) is None or not self.__count(cmd):
+                return
+            return self.__sync()
+
+        if cmd == self.GET_DEVICE:
+            arg = self.__args(1)
+            if arg is None:
+                return
+            values = {
+                self.INFO_BL_REV: self.bl_rev,
+                self.INFO_BOARD_ID: self.board_id,
+                self.INFO_BOARD_REV: self.board_rev,
+                self.INFO_FLASH_SIZE: self.flash_size,
+                self.INFO_EXTF_SIZE: self.extf_size,
+            }
+            if not self.__count(cmd):
+                return
+            if arg[0] not in values:
+                return self.__sync(self.INVALID)
+            self.__reply(struct.pack("<I", values[arg[0]]))
+            return self.__sync()
+
+        if cmd in (self.CHIP_ERASE, self.CHIP_FULL_ERASE):
+            if self.__args(0) is None or not self.__count(cmd):
+                return
+            time.sleep(self.erase_time)
+            if self.faults.pop('erase_fail', False):
+                return self.__sync(self.FAILED)
+            self.flash[:] = b'\xff' * self.flash_size
+            self.address = 0
+            return self.__sync()
+
+        if cmd == self.CHIP_VERIFY:
+            if self.__args(0) is None or not self.__count(cmd):
+                return
+            self.address = 0
+            return self.__sync()
+
+        if cmd in (self.PROG_MULTI, self.EXTF_PROG_MULTI):
+            length = self.__byte()
+            data = self.__args(length)
+            if data is None or not self.__count(cmd):
+                return
+            if cmd == self.EXTF_PROG_MULTI:
+                if length % 4 != 0 or self.extf_address + length > self.extf_size:
+                    return self.__sync(self.INVALID)
+                self.extf[self.extf_address:self.extf_address + length] = data
+                self.extf_address += length
+                return self.__sync()
+            index = self.prog_count
+            self.prog_count += 1
+            if self.__fault('prog_invalid_at', index):
+                return self.__sync(self.INVALID)
+            if length % 4 != 0 or self.address + length > self.flash_size:
+                return self.__sync(self.INVALID)
+            if self.prog_time:
+                time.sleep(self.prog_time)
+            if self.__fault('corrupt_at', index):
+                data = bytes([data[0] ^ 0x01]) + data[1:]
+            self.flash[self.address:self.address + length] = data
+            self.address += length
+            if self.__fault('prog_fail_at', index):
+                return self.__sync(self.FAILED)
+            return self.__sync()
+
+        if cmd in (self.READ_MULTI, self.EXTF_READ_MULTI):
+            length = self.__byte()
+            if self.__args(0) is None or not self.__count(cmd):
+                return
+            if cmd == self.EXTF_READ_MULTI:
+                data = self.extf[self.extf_address:self.extf_address + length]
+                self.extf_address += len(data)
+            else:
+                data = self.flash[self.address:self.address + length]
+                self.address += len(data)
+            self.__reply(data)
+            return self.__sync()
+
+        if cmd == self.GET_CRC:
+            if self.__args(0) is None or not self.__count(cmd):
+                return
+            self.__reply(struct.pack("<I", crc32(self.flash)))
+            return self.__sync()
+
+        if cmd == self.EXTF_GET_CRC:
+            arg = self.__args(4)
+            if arg is None or not self.__count(cmd):
+                return
+            size = struct.unpack("<I", arg)[0]
+            self.__reply(struct.pack("<I", crc32(self.extf[:size])))
+            return self.__sync()
+
+        if cmd == self.EXTF_ERASE:
+            arg = self.__args(4)
+            if arg is None or not self.__count(cmd):
+                return
+            size = struct.unpack("<I", arg)[0]
+            if size > self.extf_size:
+                return self.__sync(self.INVALID)
+            self.__sync()
+            for pct in range(0, 101, 10):
+                time.sleep(self.erase_time / 11.0)
+                self.__reply(struct.pack("B", pct))
+            self.extf[:size] = b'\xff' * size
+            self.extf_address = 0
+            return self.__sync()
+
+        if cmd in (self.GET_OTP, self.GET_SN):
+            arg = self.__args(4)
+            if arg is None or not self.__count(cmd):
+                return
+            if self.bl_rev < 4:
+                return self.__sync(self.INVALID)
+            offset = struct.unpack("<I", arg)[0]
+            if cmd == self.GET_SN:
+                word = self.serial_number[offset:offset + 4]
+            else:
+                word = b'\x00\x00\x00\x00'
+            self.__reply(word.ljust(4, b'\x00'))
+            return self.__sync()
+
+        if cmd == self.GET_CHIP:
+            if self.__args(0) is None or not self.__count(cmd):
+                return
+            self.__reply(struct.pack("<I", self.chip))
+            return self.__sync()
+
+        if cmd == self.GET_CHIP_DES:
+            if self.__args(0) is None or not self.__count(cmd):
+                return
+            des = self.chip_des.encode('ascii')
+            self.__reply(struct.pack("<I", len(des)) + des)
+            return self.__sync()
+
+        if cmd == self.SET_BOOT_DELAY:
+            arg = self.__args(1)
+            if arg is None or not self.__count(cmd):
+                return
+            self.boot_delay = struct.unpack("b", arg)[0]
+            return self.__sync()
+
+        if cmd == self.SET_BAUD:
+            if self.__args(4) is None or not self.__count(cmd):
+                return
+            # a pty has no line rate, accept anything
+            return self.__sync()
+
+        if cmd == self.REBOOT:
+            if self.__args(0) is None or not self.__count(cmd):
+                return
+            self.rebooted = True
+            return self.__sync()
+
+        # anything else (NOPs, MAVLink or NSH reboot attempts) is ignored
+
+    # count a command, False if its reply should be dropped
+    def __count(self, cmd):
+        index = self.command_count
+        self.command_count += 1
+        self.commands[cmd] = self.commands.get(cmd, 0) + 1
+        return not self.__fault('drop_reply_at', index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated PX4/ArduPilot bootloader on a pseudo-terminal.")
+    parser.add_argument('--flash-size', type=lambda x: int(x, 0), default=1966080, help="flash size in bytes")
+    parser.add_argument('--extf-size', type=lambda x: int(x, 0), default=0, help="external flash size in bytes")
+    parser.add_argument('--board-id', type=int, default=1063, help="board id to report")
+    parser.add_argument('--bl-rev', type=int, default=5, help="bootloader protocol revision to report")
+    parser.add_argument('--latency', type=float, default=0.0, help="reply latency in seconds")
+    parser.add_argument('--erase-time', type=float, default=0.5, help="chip erase duration in seconds")
+    parser.add_argument('--prog-time', type=float, default=0.0, help="time to program one PROG_MULTI group")
+    parser.add_argument('--prog-fail-at', type=int, default=None, help="reply FAILED to this PROG_MULTI group")
+    parser.add_argument('--corrupt-at', type=int, default=None, help="corrupt the data of this PROG_MULTI group")
+    args = parser.parse_args()
+
+    faults = {}
+    if args.prog_fail_at is not None:
+        faults['prog_fail_at'] = args.prog_fail_at
+    if args.corrupt_at is not None:
+        faults['corrupt_at'] = args.corrupt_at
+
+    sim = BootloaderSim(flash_size=args.flash_size,
+                        extf_size=args.extf_size,
+                        board_id=args.board_id,
+                        bl_rev=args.bl_rev,
+                        latency=args.latency,
+                        erase_time=args.erase_time,
+                        prog_time=args.prog_time,
+                        faults=faults)
+    print("Simulated bootloader on %s" % sim.port)
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+#
+# End-to-end flash benchmark against the simulated bootloader
+#
+# Flashes an APJ image into bootloader_sim.BootloaderSim over a pty for
+# each combination of simulated link latency and PROG_MULTI window, and
+# reports the total time, per-phase times and programming throughput.
+#
+
+import argparse
+import os
+import sys
+
+import bootloader_sim
+import uploader
+
+
+def run_one(fw, latency, window, erase_time):
+    sim = bootloader_sim.BootloaderSim(flash_size=fw.property('image_maxsize', 2 * 1024 * 1024),
+                                       board_id=fw.property('board_id'),
+                                       latency=latency,
+                                       erase_time=erase_time)
+    try:
+        result = uploader.flash(fw, port=sim.port, prog_window=window, timeout=30.0, quiet=True)
+    finally:
+        sim.close()
+    return result
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Benchmark uploader.py against a simulated bootloader.")
+    parser.add_argument('--latency', default="0,0.001,0.004",
+                        help="comma-separated simulated reply latencies in seconds")
+    parser.add_argument('--window', default="1,%u" % uploader.uploader.PROG_WINDOW,
+                        help="comma-separated PROG_MULTI in-flight windows to compare")
+    parser.add_argument('--erase-time', type=float, default=0.5, help="simulated chip erase duration in seconds")
+    parser.add_argument('firmware', nargs="?",
+                        default=os.path.join(here, "ArducopterTest4.6.0-dev_images", "arducopter.apj"),
+                        help="APJ file to flash")
+    args = parser.parse_args()
+
+    fw = uploader.firmware(args.firmware)
+    latencies = [float(x) for x in args.latency.split(',')]
+    windows = [int(x) for x in args.window.split(',')]
+
+    print("%u bytes from %s" % (len(fw.image), args.firmware))
+    print("%9s %6s %9s %9s %9s %9s %11s  %s" % (
+        "latency", "window", "total", "erase", "program", "verify", "KiB/s", "result"))
+    failed = False
+    for latency in latencies:
+        for window in windows:
+            r = run_one(fw, latency, window, args.erase_time)
+            program = r.phases.get('program', 0.0)
+            rate = (r.bytes_written / 1024.0 / program) if program > 0 else 0.0
+            print("%7.1fms %6u %8.2fs %8.2fs %8.2fs %8.2fs %11.1f  %s" % (
+                latency * 1000.0, window, r.phases.get('total', 0.0), r.phases.get('erase', 0.0),
+                program, r.phases.get('verify', 0.0), rate, r.status if r.success else "FAILED: %s" % r.error))
+            sys.stdout.flush()
+            failed = failed or not r.success
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#
+# flash() and --gang error reporting, against bootloader_sim.
+#
+# Run with: python3 -m pytest test_uploader_flash.py
+#
+
+import argparse
+import base64
+import json
+import struct
+import time
+import zlib
+
+import pytest
+
+import bootloader_sim
+import uploader
+
+FLASH_SIZE = 64 * 1024
+BOARD_ID = 1063
+
+
+@pytest.fixture
+def apj(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploader, 'fw_cache_dir', str(tmp_path / 'cache'))
+    data = bytes(range(256)) * 40
+    path = str(tmp_path / 'test.apj')
+    with open(path, 'w') as f:
+        json.dump({
+            'board_id': BOARD_ID,
+            'image_size': len(data),
+            'image_maxsize': FLASH_SIZE,
+            'image': base64.b64encode(zlib.compress(data)).decode('ascii'),
+        }, f)
+    return path
+
+
+@pytest.fixture
+def sims():
+    started = []
+
+    def start(count=1):
+        for i in range(count):
+            started.append(bootloader_sim.BootloaderSim(flash_size=FLASH_SIZE, board_id=BOARD_ID, erase_time=0.01))
+        return started[-count:]
+    yield start
+    for sim in started:
+        sim.close()
+
+
+def test_flash(apj, sims):
+    sim, = sims()
+    result = uploader.flash(apj, port=sim.port, timeout=10.0, quiet=True)
+    assert result.success, result.error
+    assert result.status == "flashed"
+
+
+def test_flash_reports_a_missing_image(tmp_path):
+    telemetry = str(tmp_path / 'telemetry.json')
+    result = uploader.flash(str(tmp_path / 'missing.apj'), timeout=1.0, telemetry=telemetry)
+    assert not result.success
+    assert 'FileNotFoundError' in result.error
+    with open(telemetry) as f:
+        assert json.load(f)['error'] == result.error
+
+
+def test_flash_reports_a_malformed_image(tmp_path):
+    path = tmp_path / 'bad.apj'
+    path.write_text('{"image": "!!"}')
+    result = uploader.flash(str(path), timeout=1.0)
+    assert not result.success
+    assert result.error
+
+
+def test_flash_reports_unexpected_errors(apj, sims, monkeypatch):
+    sim, = sims()
+
+    def garbled(self):
+        raise struct.error("unpack requires a buffer of 4 bytes")
+    monkeypatch.setattr(uploader.uploader, 'identity', garbled)
+    result = uploader.flash(apj, port=sim.port, timeout=10.0, quiet=True)
+    assert not result.success
+    assert 'unpack requires' in result.error
+
+
+def gang_args(ports, **overrides):
+    args = argparse.Namespace(port=",".join(ports), baud_bootloader=115200, baud_bootloader_flash=None,
+                              target_system=None, target_component=None, source_system=None,
+                              source_component=None, no_extf=False, force_erase=False,
+                              prog_window=uploader.uploader.PROG_WINDOW, no_skip_erased=False,
+                              gang_wait=10.0, gang_count=None, use_async=False, force=False,
+                              boot_delay=None, skip_identical=False)
+    for name, value in overrides.items():
+        setattr(args, name, value)
+    return args
+
+
+def test_gang_keeps_other_ports_when_one_raises(apj, sims, monkeypatch):
+    bad, good = sims(2)
+    ping = uploader.uploader.ping
+
+    def flaky_ping(self, *args, **kwargs):
+        if self.port.port == bad.port:
+            raise ValueError("garbled reply")
+        return ping(self, *args, **kwargs)
+    monkeypatch.setattr(uploader.uploader, 'ping', flaky_ping)
+
+    results = uploader.gang_upload(gang_args([bad.port, good.port], gang_count=2), uploader.firmware(apj), [57600])
+    assert sorted(results) == sorted([bad.port, good.port])
+    assert not results[bad.port].success
+    assert 'garbled reply' in results[bad.port].error
+    assert results[good.port].success, results[good.port].error
+
+
+@pytest.mark.parametrize('gang_count', [None, 2])
+def test_gang_stops_looking_early(apj, sims, gang_count):
+    ports = [sim.port for sim in sims(2)]
+    start = time.time()
+    found = uploader.find_all_bootloaders(gang_args(ports, gang_count=gang_count), [57600], 10.0, gang_count)
+    elapsed = time.time() - start
+    try:
+        assert sorted(found) == sorted(ports)
+        assert elapsed < uploader.GANG_SETTLE + 2.0
+        if gang_count is not None:
+            assert elapsed < 2.0
+    finally:
+        for up in found.values():
+            up.close()
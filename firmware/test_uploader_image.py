@@ -0,0 +1,103 @@
+#
+# Firmware image handling in uploader.py: 0xFF padding, the programmed
+# length, PROG_MULTI chunking and the padded CRC, for image sizes that are
+# not multiples of 4, with the decoded-image cache both cold and warm.
+#
+# Run with: python3 -m pytest test_uploader_image.py
+#
+
+import base64
+import json
+import zlib
+
+import pytest
+
+import uploader
+
+PADLEN = 8192
+SIZES = [0, 1, 3, 5, 4 * 1024 + 1]
+
+
+def make_image(size, erased_tail=0):
+    # no 0xFF in the payload, so padding and erased runs are unambiguous
+    return bytes((i * 7 + 1) % 255 for i in range(size)) + b'\xff' * erased_tail
+
+
+def write_apj(path, data):
+    with open(path, 'w') as f:
+        json.dump({
+            'board_id': 140,
+            'image_size': len(data),
+            'image_maxsize': PADLEN,
+            'image': base64.b64encode(zlib.compress(data)).decode('ascii'),
+        }, f)
+
+
+def padded(data):
+    return data + b'\xff' * (-len(data) % 4)
+
+
+def expected_program_len(image):
+    # up to the PROG_MULTI group holding the last byte that isn't erased flash
+    used = len(image.rstrip(b'\xff'))
+    group = uploader.uploader.PROG_MULTI_MAX
+    return min(len(image), (used + group - 1) // group * group)
+
+
+def reference_crc(image, padlen):
+    state = uploader.crc32_bytewise(image, 0)
+    for i in range(len(image), padlen - 1, 4):
+        state = uploader.crc32_bytewise(b'\xff\xff\xff\xff', state)
+    return state
+
+
+def make_uploader(skip_erased=True):
+    # only the image helpers are exercised, so no serial port is opened
+    up = uploader.uploader.__new__(uploader.uploader)
+    up.skip_erased = skip_erased
+    return up
+
+
+@pytest.fixture
+def load(tmp_path, monkeypatch):
+    '''load(data) -> (cold, warm) firmware objects for an APJ holding data'''
+    monkeypatch.setattr(uploader, 'fw_cache_dir', str(tmp_path / 'cache'))
+
+    def load(data):
+        path = str(tmp_path / 'test.apj')
+        write_apj(path, data)
+        cold = uploader.firmware(path)
+        warm = uploader.firmware(path)
+        assert not isinstance(warm.image, bytes) or len(data) == 0, "second load did not come from the cache"
+        return cold, warm
+    return load
+
+
+@pytest.mark.parametrize('erased_tail', [0, 300])
+@pytest.mark.parametrize('size', SIZES)
+def test_image(load, size, erased_tail):
+    data = make_image(size, erased_tail)
+    expect = padded(data)
+    for fw in load(data):
+        assert len(fw.image) == len(expect)
+        assert bytes(fw.image) == expect
+        assert list(fw.image) == list(expect)
+        assert fw.crc(PADLEN) == reference_crc(expect, PADLEN)
+        assert fw.crc(0) == uploader.crc32_bytewise(fw.image)
+
+
+@pytest.mark.parametrize('skip_erased', [True, False])
+@pytest.mark.parametrize('erased_tail', [0, 300])
+@pytest.mark.parametrize('size', SIZES)
+def test_program_chunks(load, size, erased_tail, skip_erased):
+    data = make_image(size, erased_tail)
+    expect = padded(data)
+    up = make_uploader(skip_erased)
+    group = uploader.uploader.PROG_MULTI_MAX
+    for fw in load(data):
+        end = up._uploader__program_len(fw.image)
+        assert end == (expected_program_len(expect) if skip_erased else len(expect))
+        chunks = [bytes(chunk) for chunk in up._uploader__split_len(fw.image, group, end)]
+        assert b''.join(chunks) == expect[:end]
+        assert all(len(chunk) == group for chunk in chunks[:-1])
+        assert all(len(chunk) % 4 == 0 and 0 < len(chunk) <= group for chunk in chunks)
@@ -57,17 +57,24 @@ from __future__ import print_function
 
 import sys
 import argparse
+import asyncio
 import binascii
 import serial
 import struct
 import json
 import zlib
 import base64
+import bisect
+import collections
 import time
 import array
+import hashlib
+import mmap
 import os
 import platform
 import re
+import shutil
+import threading
 from termcolor import colored  # for color output
 
 from sys import platform as _platform
@@ -107,6 +114,27 @@ if sys.version_info[0] < 3:
 else:
     runningPython3 = True
 
+cache_root = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+                          'px4_uploader')
+
+# decoded firmware images are cached here, keyed by the SHA-256 of the APJ file
+fw_cache_dir = os.path.join(cache_root, 'firmware')
+FW_CACHE_VERSION = 2            # 2: images are padded with 0xFF, not zeros
+
+# board_id index built from the hwdef tree and APJ files, see BoardRegistry
+board_index_path = os.path.join(cache_root, 'board_ids.json')
+BOARD_INDEX_VERSION = 1
+
+# BoardIdentity records, one JSON file per MCU serial number
+identity_cache_dir = os.path.join(cache_root, 'boards')
+
+# upper edges (ms) of the round-trip latency histogram buckets in the flash telemetry
+RTT_BUCKETS_MS = (0.25, 0.5, 1, 2, 4, 8, 16, 32)
+
+# --gang stops looking once no new board turned up for this long; a board
+# rebooted out of the flight stack needs about 2 s to come back as a bootloader
+GANG_SETTLE = 3.0
+
 # dictionary of bootloader {boardID: (firmware boardID, boardname), ...}
 # designating firmware builds compatible with multiple boardIDs
 compatible_IDs = {33: (9, 'AUAVX2.1')}
@@ -148,14 +176,81 @@ crctab = array.array('I', [
     0xb3667a2e, 0xc4614ab8, 0x5d681b02, 0x2a6f2b94, 0xb40bbe37, 0xc30c8ea1, 0x5a05df1b, 0x2d02ef8d])
 
 
-def crc32(bytes, state=0):
-    '''crc32 exposed for use by chibios.py'''
+def crc32_bytewise(bytes, state=0):
+    '''reference table-driven crc32, one byte per iteration'''
     for byte in bytes:
         index = (state ^ byte) & 0xff
         state = crctab[index] ^ (state >> 8)
     return state
 
 
+def crc32(bytes, state=0):
+    '''crc32 exposed for use by chibios.py'''
+    # zlib uses the same reflected 0xEDB88320 polynomial but pre- and
+    # post-inverts the register; undo both so the result matches crctab
+    return zlib.crc32(bytes, state ^ 0xFFFFFFFF) ^ 0xFFFFFFFF
+
+
+def _crc_multmodp(a, b):
+    # multiply a and b modulo the CRC polynomial (reflected bit order)
+    m = 1 << 31
+    p = 0
+    while True:
+        if a & m:
+            p ^= b
+            if (a & (m - 1)) == 0:
+                break
+        m >>= 1
+        b = (b >> 1) ^ 0xEDB88320 if b & 1 else b >> 1
+    return p
+
+
+def _crc_x2n_table():
+    # x^(2^n) modulo the CRC polynomial for n = 0..31
+    table = []
+    p = 1 << 30  # x^1
+    for n in range(32):
+        table.append(p)
+        p = _crc_multmodp(p, p)
+    return table
+
+
+_crc_x2n = _crc_x2n_table()
+
+
+def crc32_shift(state, length):
+    '''advance a crc32 state over length zero bytes in O(log(length))'''
+    p = 1 << 31  # x^0
+    k = 3        # 8 bits per byte
+    while length:
+        if length & 1:
+            p = _crc_multmodp(_crc_x2n[k & 31], p)
+        length >>= 1
+        k += 1
+    return _crc_multmodp(p, state)
+
+
+def crc32_combine(state, crc_b, len_b):
+    '''crc32 of A + B given the crc32 state after A and crc32(B) from zero'''
+    return crc32_shift(state, len_b) ^ crc_b
+
+
+def crc32_repeat(pattern, count, state=0):
+    '''crc32 of pattern repeated count times, without building the buffer'''
+    total_len = len(pattern) * count
+    block_crc = crc32(pattern)
+    block_len = len(pattern)
+    run_crc = 0
+    while count:
+        if count & 1:
+            # every block is identical, so the order they are folded in is irrelevant
+            run_crc = crc32_combine(run_crc, block_crc, block_len)
+        block_crc = crc32_combine(block_crc, block_crc, block_len)
+        block_len *= 2
+        count >>= 1
+    return crc32_combine(state, run_crc, total_len)
+
+
 class firmware(object):
     '''Loads a firmware file'''
 
@@ -163,25 +258,116 @@ class firmware(object):
     image = bytes()
     crcpad = bytearray(b'\xff\xff\xff\xff')
 
-    def __init__(self, path):
+    def __init__(self, path, use_cache=True):
+
+        self._image_crc = None
+        self._crc_cache = {}
+        self._extf_crc_cache = {}
 
         # read the file
-        f = open(path, "r")
-        self.desc = json.load(f)
+        f = open(path, "rb")
+        raw = f.read()
         f.close()
 
-        self.image = bytearray(zlib.decompress(base64.b64decode(self.desc['image'])))
+        cache_path = None
+        if use_cache:
+            cache_path = os.path.join(fw_cache_dir, hashlib.sha256(raw).hexdigest())
+            if self.__load_cache(cache_path):
+                return
+
+        self.desc = json.loads(raw.decode('utf-8'))
+        raw = None
+
+        # the base64 payloads are not needed once decoded, don't keep them around
+        self.image = self.__decode(self.desc.pop('image'))
         if 'extf_image' in self.desc:
-            self.extf_image = bytearray(zlib.decompress(base64.b64decode(self.desc['extf_image'])))
+            self.extf_image = self.__decode(self.desc.pop('extf_image'))
         else:
             self.extf_image = None
-        # pad image to 4-byte length
-        while ((len(self.image) % 4) != 0):
-            self.image += bytes(0xFF)
-        # pad image to 4-byte length
-        if self.extf_image is not None:
-            while ((len(self.extf_image) % 4) != 0):
-                self.extf_image += bytes(0xFF)
+
+        if cache_path is not None:
+            self.__save_cache(cache_path)
+
+    # decompress a base64 payload and pad it to a 4-byte length with 0xFF,
+    # the value of erased flash, in a single copy
+    def __decode(self, encoded):
+        image = zlib.decompress(base64.b64decode(encoded))
+        padding = -len(image) % 4
+        if padding != 0:
+            image += b'\xff' * padding
+        return image
+
+    # map a previously decoded image, returns False if there is no usable entry
+    def __load_cache(self, cache_path):
+        try:
+            f = open(os.path.join(cache_path, "meta.json"), "r")
+            meta = json.load(f)
+            f.close()
+            if meta.get('version') != FW_CACHE_VERSION:
+                return False
+            image = self.__map_file(os.path.join(cache_path, "image.bin"))
+            if len(image) != meta['padded_size']:
+                return False
+            extf_image = None
+            if meta['has_extf']:
+                extf_image = self.__map_file(os.path.join(cache_path, "extf_image.bin"))
+        except (IOError, OSError, ValueError, KeyError):
+            return False
+
+        self.desc = meta['desc']
+        self.image = image
+        self.extf_image = extf_image
+        self._image_crc = meta['image_crc']
+        self._crc_cache = dict((int(k), v) for (k, v) in meta['crc'].items())
+        return True
+
+    def __map_file(self, filepath):
+        f = open(filepath, "rb")
+        try:
+            if os.fstat(f.fileno()).st_size == 0:
+                # zero-length files can't be mapped
+                return bytearray()
+            # a memoryview indexes and iterates as ints, like the decoded
+            # bytes, where the mmap itself would yield 1-byte strings
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        finally:
+            f.close()
+
+    # write the decoded image, its padded size and CRCs to the cache; the
+    # entry is built in a temporary directory and renamed into place so
+    # a concurrent reader never sees a partial entry
+    def __save_cache(self, cache_path):
+        padlen = self.property('image_maxsize')
+        crcs = {}
+        if padlen is not None:
+            crcs[str(padlen)] = self.crc(padlen)
+        meta = {
+            'version': FW_CACHE_VERSION,
+            'desc': self.desc,
+            'padded_size': len(self.image),
+            'has_extf': self.extf_image is not None,
+            'image_crc': self.crc(0),
+            'crc': crcs,
+        }
+        tmp_path = "%s.%u.tmp" % (cache_path, os.getpid())
+        try:
+            if not os.path.isdir(tmp_path):
+                os.makedirs(tmp_path)
+            f = open(os.path.join(tmp_path, "image.bin"), "wb")
+            f.write(self.image)
+            f.close()
+            if self.extf_image is not None:
+                f = open(os.path.join(tmp_path, "extf_image.bin"), "wb")
+                f.write(self.extf_image)
+                f.close()
+            f = open(os.path.join(tmp_path, "meta.json"), "w")
+            json.dump(meta, f)
+            f.close()
+            os.rename(tmp_path, cache_path)
+        except (IOError, OSError):
+            # the cache is only an optimisation; a read-only home directory
+            # or a racing writer that got there first is not an error
+            shutil.rmtree(tmp_path, ignore_errors=True)
 
     def property(self, propname, default=None):
         if propname in self.desc:
@@ -189,14 +375,277 @@ class firmware(object):
         return default
 
     def extf_crc(self, size):
-        state = crc32(self.extf_image[:size], int(0))
-        return state
+        if size not in self._extf_crc_cache:
+            self._extf_crc_cache[size] = crc32(memoryview(self.extf_image)[:size], int(0))
+        return self._extf_crc_cache[size]
 
     def crc(self, padlen):
-        state = crc32(self.image, int(0))
-        for i in range(len(self.image), (padlen - 1), 4):
-            state = crc32(self.crcpad, state)
-        return state
+        if padlen not in self._crc_cache:
+            if self._image_crc is None:
+                self._image_crc = crc32(self.image, int(0))
+            # the bootloader CRCs the whole flash, so extend with one pad
+            # word per 4 bytes of erased flash beyond the image
+            padwords = len(range(len(self.image), (padlen - 1), 4))
+            self._crc_cache[padlen] = crc32_repeat(self.crcpad, padwords, self._image_crc)
+        return self._crc_cache[padlen]
+
+
+class BoardRegistry(object):
+    '''Maps board_id to board names, compatible firmware IDs and APJ images
+
+    The index is built from the hwdef.dat files of the ArduPilot tree (when
+    uploader.py sits in one) and from any APJ files given, and is kept as
+    a JSON file next to the firmware cache. Only sources whose mtime or
+    size changed are parsed again.
+    '''
+
+    shared_ids = {
+        9: "fmuv3",
+        50: "fmuv5",
+    }
+
+    def __init__(self, apj_paths=(), hwdef_dir=None, index_path=None):
+        if hwdef_dir is None:
+            hwdef_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                     "..", "..", "libraries", "AP_HAL_ChibiOS", "hwdef")
+        if index_path is None:
+            index_path = board_index_path
+        self.index_path = index_path
+
+        self.entries = self.__refresh(self.__sources(hwdef_dir, apj_paths))
+        self.names = {}         # board_id -> [board name, ...]
+        self.images = {}        # board_id -> [APJ path, ...]
+        for path in sorted(self.entries.keys()):
+            entry = self.entries[path]
+            if entry['board_id'] is None:
+                continue
+            names = self.names.setdefault(entry['board_id'], [])
+            if entry['name'] is not None and entry['name'] not in names:
+                names.append(entry['name'])
+            if entry['kind'] == 'apj':
+                self.images.setdefault(entry['board_id'], []).append(path)
+
+    # {path: (kind, [mtime, size])} for every file the index is built from;
+    # uploader.py is swiped into other places, so a missing hwdef tree is fine
+    def __sources(self, hwdef_dir, apj_paths):
+        sources = {}
+        if os.path.isdir(hwdef_dir):
+            for adir in os.listdir(hwdef_dir):
+                if adir in ["scripts", "common", "STM32CubeConf"]:
+                    continue
+                filepath = os.path.join(hwdef_dir, adir, "hwdef.dat")
+                try:
+                    st = os.stat(filepath)
+                except OSError:
+                    continue
+                sources[os.path.realpath(filepath)] = ('hwdef', [st.st_mtime, st.st_size])
+        for filepath in apj_paths:
+            try:
+                st = os.stat(filepath)
+            except OSError:
+                continue
+            sources[os.path.realpath(filepath)] = ('apj', [st.st_mtime, st.st_size])
+        return sources
+
+    # reuse index entries that are still current, parse the rest and save
+    # the index if anything changed
+    def __refresh(self, sources):
+        index = {}
+        try:
+            f = open(self.index_path, "r")
+            meta = json.load(f)
+            f.close()
+            if meta.get('version') == BOARD_INDEX_VERSION:
+                index = meta['entries']
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+        entries = {}
+        changed = False
+        for (path, (kind, stamp)) in sources.items():
+            entry = index.get(path)
+            if entry is None or entry['stamp'] != stamp or entry['kind'] != kind:
+                entry = self.__parse(path, kind)
+                entry['stamp'] = stamp
+                index[path] = entry
+                changed = True
+            entries[path] = entry
+
+        if changed:
+            self.__save(index)
+        return entries
+
+    def __parse(self, path, kind):
+        entry = {'kind': kind, 'board_id': None, 'name': None}
+        try:
+            if kind == 'hwdef':
+                entry['name'] = os.path.basename(os.path.dirname(path))
+                f = open(path)
+                for line in f:
+                    m = re.match(r"^\s*APJ_BOARD_ID\s+(\d+)\s*$", line)
+                    if m is not None:
+                        entry['board_id'] = int(m.group(1))
+                        break
+                f.close()
+            else:
+                f = open(path, "rb")
+                desc = json.loads(f.read().decode('utf-8'))
+                f.close()
+                entry['board_id'] = desc.get('board_id')
+                entry['name'] = desc.get('summary')
+        except (IOError, OSError, ValueError):
+            pass
+        return entry
+
+    def __save(self, index):
+        tmp_path = "%s.%u.tmp" % (self.index_path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(self.index_path)):
+                os.makedirs(os.path.dirname(self.index_path))
+            f = open(tmp_path, "w")
+            json.dump({'version': BOARD_INDEX_VERSION, 'entries': index}, f)
+            f.close()
+            os.rename(tmp_path, self.index_path)
+        except (IOError, OSError):
+            # the index is only an optimisation, like the firmware cache
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def name(self, board_id):
+        '''return name for board_id, None if it can't be found'''
+        if board_id in self.shared_ids:
+            return self.shared_ids[board_id]
+        names = self.names.get(board_id)
+        if not names:
+            return None
+        return " or ".join(names)
+
+    def compatible(self, board_id):
+        '''(firmware board_id, board name) a board takes firmware for, or None'''
+        return compatible_IDs.get(board_id)
+
+    def accepts(self, board_id, fw_board_id):
+        '''True if a board reporting board_id can run firmware built for fw_board_id'''
+        if board_id == fw_board_id:
+            return True
+        comp = self.compatible(board_id)
+        return comp is not None and comp[0] == fw_board_id
+
+    def apj_board_id(self, path):
+        '''board_id of an indexed APJ file, None if it is not indexed'''
+        entry = self.entries.get(os.path.realpath(path))
+        if entry is None:
+            return None
+        return entry['board_id']
+
+    def firmware_for(self, board_id):
+        '''indexed APJ files built for board_id or firmware it is compatible with'''
+        images = list(self.images.get(board_id, []))
+        comp = self.compatible(board_id)
+        if comp is not None:
+            images.extend(self.images.get(comp[0], []))
+        return images
+
+
+_board_registry = None
+_board_registry_lock = threading.Lock()
+
+
+def board_registry():
+    '''the BoardRegistry for the hwdef tree, built on first use'''
+    global _board_registry
+    with _board_registry_lock:
+        if _board_registry is None:
+            _board_registry = BoardRegistry()
+        return _board_registry
+
+
+class BoardIdentity(object):
+    '''What the bootloader can tell about one physical board
+
+    serial is the MCU unique ID as hex (bootloader rev4+), otp the decoded
+    OTP block (rev4+) and chip/chip_des the MCU ID code and description
+    (rev5+); fields the bootloader can't report are None.
+    '''
+
+    fields = ('serial', 'bl_rev', 'board_type', 'board_rev', 'board_name', 'fw_maxsize', 'extf_maxsize',
+              'otp', 'chip', 'chip_name', 'chip_rev', 'chip_flawed', 'chip_des')
+
+    def __init__(self, **values):
+        for field in self.fields:
+            setattr(self, field, values.get(field))
+
+    def as_dict(self):
+        return dict((field, getattr(self, field)) for field in self.fields)
+
+    # True if the bootloader on up still reports what this record was read from
+    def matches(self, up):
+        return (self.bl_rev == up.bl_rev and self.board_type == up.board_type and
+                self.board_rev == up.board_rev and self.fw_maxsize == up.fw_maxsize and
+                self.extf_maxsize == up.extf_maxsize)
+
+    @staticmethod
+    def load(serial):
+        '''the cached identity for an MCU serial number, None if there is none'''
+        try:
+            f = open(os.path.join(identity_cache_dir, serial + ".json"), "r")
+            values = json.load(f)
+            f.close()
+        except (IOError, OSError, ValueError):
+            return None
+        return BoardIdentity(**values)
+
+    def save(self):
+        path = os.path.join(identity_cache_dir, self.serial + ".json")
+        tmp_path = "%s.%u.tmp" % (path, os.getpid())
+        try:
+            if not os.path.isdir(identity_cache_dir):
+                os.makedirs(identity_cache_dir)
+            f = open(tmp_path, "w")
+            json.dump(self.as_dict(), f, indent=4, sort_keys=True)
+            f.close()
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            # only a cache, see firmware.__save_cache()
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def describe(self):
+        '''human readable summary, as printed by --identify'''
+        lines = ["Bootloader Protocol: %u" % self.bl_rev]
+        if self.otp is not None:
+            lines.append("OTP:")
+            for key in ('type', 'idtype', 'vid', 'pid', 'coa'):
+                lines.append("  %s: %s" % (key, self.otp[key]))
+        if self.serial is not None:
+            lines.append("  sn: %s" % self.serial)
+        if self.chip_des is not None:
+            lines.append("ChipDes:")
+            lines.append("  family: %s" % self.chip_des[0])
+            lines.append("  revision: %s" % self.chip_des[1])
+        lines.append("Chip:")
+        if self.chip is None:
+            lines.append("  [unavailable; bootloader too old]")
+        elif self.chip_rev is not None:
+            note = ""
+            if self.chip_flawed:
+                note = " (flawed; 1M limit, see STM32F42XX Errata sheet sec. 2.1.10)"
+            lines.append("  %x %s rev%s%s" % (self.chip, self.chip_name, self.chip_rev, note))
+        else:
+            lines.append("  %s %08x" % (self.chip_name or "unknown", self.chip))
+        lines.append("Info:")
+        lines.append("  flash size: %u" % self.fw_maxsize)
+        lines.append("  ext flash size: %u" % self.extf_maxsize)
+        if self.board_name is not None:
+            lines.append("  board_type: %u (%s)" % (self.board_type, self.board_name))
+        else:
+            lines.append("  board_type: %u" % self.board_type)
+        lines.append("  board_rev: %u" % self.board_rev)
+        return "\n".join(lines)
 
 
 class uploader(object):
@@ -248,6 +697,10 @@ class uploader(object):
 
     PROG_MULTI_MAX  = 252            # protocol max is 255, must be multiple of 4
     READ_MULTI_MAX  = 252            # protocol max is 255
+    ERASED          = b'\xff' * PROG_MULTI_MAX  # a PROG_MULTI group of erased flash
+    PROG_WINDOW     = 4              # default PROG_MULTI/READ_MULTI commands kept in flight
+    RTT_PINGS       = 16             # GET_SYNC round trips timed for the flash telemetry
+    BENCHMARK_READ  = 256 * 1024     # bytes read back by benchmark_link()
 
     NSH_INIT        = bytearray(b'\x0d\x0d\x0d')
     NSH_REBOOT_BL   = b"reboot -b\n"
@@ -263,7 +716,9 @@ class uploader(object):
                  source_system=None,
                  source_component=None,
                  no_extf=False,
-                 force_erase=False):
+                 force_erase=False,
+                 prog_window=None,
+                 skip_erased=True):
         self.MAVLINK_REBOOT_ID1 = bytearray(b'\xfe\x21\x72\xff\x00\x4c\x00\x00\x40\x40\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xf6\x00\x01\x00\x00\x53\x6b')  # NOQA
         self.MAVLINK_REBOOT_ID0 = bytearray(b'\xfe\x21\x45\xff\x00\x4c\x00\x00\x40\x40\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xf6\x00\x00\x00\x00\xcc\x37')  # NOQA
         if target_component is None:
@@ -274,6 +729,24 @@ class uploader(object):
             source_component = 1
         self.no_extf = no_extf
         self.force_erase = force_erase
+        if prog_window is None:
+            prog_window = uploader.PROG_WINDOW
+        self.prog_window = max(1, prog_window)
+        self.skip_erased = skip_erased
+
+        # per-phase timing and progress reporting for library users
+        self.on_progress = None
+        self.quiet = False
+        self.phase = None
+        self.phase_times = {}
+        self.bytes_written = 0         # unique bytes the bootloader acknowledged
+        self.bytes_resent = 0          # bytes written again after a rejected pipelined attempt
+        self.__attempt_start = 0
+        self.verified = None
+        self.reboot_latency = None
+        self.rtt_samples = []
+        self.__serial = None
+        self.__identity = None
 
         # open the port, keep the default timeout short so we can poll quickly
         self.port = serial.Serial(portname, baudrate_bootloader, timeout=2.0, write_timeout=2.0)
@@ -443,13 +916,36 @@ class uploader(object):
             progress = maxVal
 
         percent = (float(progress) / float(maxVal)) * 100.0
+        if self.on_progress is not None:
+            self.on_progress(self.phase, percent)
 
-        sys.stdout.write("\r%s: [%-20s] %.1f%%" % (label, '='*int(percent/5.0), percent))
+        self.__write("\r%s: [%-20s] %.1f%%" % (label, '='*int(percent/5.0), percent))
+
+    # console output, suppressed when several boards are flashed at once
+    def __write(self, text):
+        if self.quiet:
+            return
+        sys.stdout.write(text)
         sys.stdout.flush()
 
+    # start timing a named phase of the upload, closing the previous one
+    def __phase_start(self, name):
+        now = time.time()
+        self.__phase_end(now)
+        self.phase = name
+        self.__phase_t0 = now
+
+    def __phase_end(self, now=None):
+        if self.phase is None:
+            return
+        if now is None:
+            now = time.time()
+        self.phase_times[self.phase] = self.phase_times.get(self.phase, 0.0) + (now - self.__phase_t0)
+        self.phase = None
+
     # send the CHIP_ERASE command and wait for the bootloader to become ready
     def __erase(self, label):
-        print("\n", end='')
+        self.__write("\n")
         if self.force_erase:
             # print("Force erasing full chip\n")
             self.__send(uploader.CHIP_FULL_ERASE +
@@ -469,8 +965,7 @@ class uploader(object):
                 self.__drawProgressBar(label, timeout-estimatedTimeRemaining, 9.0)
             else:
                 self.__drawProgressBar(label, 10.0, 10.0)
-                sys.stdout.write(" (timeout: %d seconds) " % int(deadline-time.time()))
-                sys.stdout.flush()
+                self.__write(" (timeout: %d seconds) " % int(deadline-time.time()))
 
             if self.__trySync():
                 self.__drawProgressBar(label, 10.0, 10.0)
@@ -481,66 +976,106 @@ class uploader(object):
     # send a PROG_MULTI command to write a collection of bytes
     def __program_multi(self, data):
 
-        if runningPython3:
-            length = len(data).to_bytes(1, byteorder='big')
-        else:
-            length = chr(len(data))
-
-        self.__send(uploader.PROG_MULTI)
-        self.__send(length)
-        self.__send(data)
-        self.__send(uploader.EOC)
+        self.__send(self.__frame_multi(uploader.PROG_MULTI, data))
         self.__getSync()
+        self.bytes_written += len(data)
 
     # send a PROG_EXTF_MULTI command to write a collection of bytes to external flash
     def __program_multi_extf(self, data):
 
-        if runningPython3:
-            length = len(data).to_bytes(1, byteorder='big')
-        else:
-            length = chr(len(data))
-
-        self.__send(uploader.EXTF_PROG_MULTI)
-        self.__send(length)
-        self.__send(data)
-        self.__send(uploader.EOC)
+        self.__send(self.__frame_multi(uploader.EXTF_PROG_MULTI, data))
         self.__getSync()
+        self.bytes_written += len(data)
 
-    # verify multiple bytes in flash
-    def __verify_multi(self, data):
+    # frame a PROG_MULTI style command so it can go out in a single write
+    def __frame_multi(self, cmd, data):
+        return b''.join((cmd, struct.pack("B", len(data)), data, uploader.EOC))
 
-        if runningPython3:
-            length = len(data).to_bytes(1, byteorder='big')
-        else:
-            length = chr(len(data))
+    # frame every PROG_MULTI style packet needed to program data, up front
+    def __frame_all(self, cmd, data):
+        end = self.__program_len(data)
+        return [self.__frame_multi(cmd, group) for group in self.__split_len(data, uploader.PROG_MULTI_MAX, end)]
 
-        self.__send(uploader.READ_MULTI)
-        self.__send(length)
-        self.__send(uploader.EOC)
-        self.port.flush()
-        programmed = self.__recv(len(data))
-        if programmed != data:
-            print("got    " + binascii.hexlify(programmed))
-            print("expect " + binascii.hexlify(data))
+    # read the INSYNC/status reply to a pipelined command, False if the
+    # bootloader rejected it
+    def __ack_multi(self):
+        c = self.__recv()
+        if c != self.INSYNC:
+            raise RuntimeError("unexpected %s instead of INSYNC" % c)
+        c = self.__recv()
+        if c == self.INVALID or c == self.FAILED:
             return False
-        self.__getSync()
+        if c != self.OK:
+            raise RuntimeError("unexpected response 0x%x instead of OK" % ord(c))
         return True
 
-    # read multiple bytes from flash
-    def __read_multi(self, length):
+    # send framed packets with up to prog_window commands in flight,
+    # consuming the replies as they arrive; returns False if any packet was
+    # rejected
+    def __program_pipelined(self, label, frames, count, progress_every):
+        # only acknowledged bytes count as written; __retry_lockstep moves
+        # what this attempt wrote to bytes_resent if it has to start over
+        self.__attempt_start = self.bytes_written
+        in_flight = collections.deque()
+        acked = 0
+        ok = True
+        for frame in frames:
+            self.__send(frame)
+            in_flight.append(len(frame) - 3)
+            if len(in_flight) < self.prog_window:
+                continue
+            ok = self.__ack_multi()
+            written = in_flight.popleft()
+            acked += 1
+            if not ok:
+                break
+            self.bytes_written += written
+            # Print upload progress (throttled, so it does not delay upload progress)
+            if acked % progress_every == 0:
+                self.__drawProgressBar(label, acked, count)
+
+        # drain the remaining replies so the link is back in sync
+        while in_flight:
+            written = in_flight.popleft()
+            if self.__ack_multi() and ok:
+                self.bytes_written += written
+            else:
+                ok = False
 
-        if runningPython3:
-            clength = length.to_bytes(1, byteorder='big')
-        else:
-            clength = chr(length)
+        if ok:
+            self.__drawProgressBar(label, 100, 100)
+        return ok
 
-        self.__send(uploader.READ_MULTI)
-        self.__send(clength)
-        self.__send(uploader.EOC)
-        self.port.flush()
-        ret = self.__recv(length)
-        self.__getSync()
-        return ret
+    # stream length bytes from the current READ_MULTI address, keeping up
+    # to prog_window requests in flight; handle(offset, data) is called for
+    # each reply in order and may return False to stop early, in which case
+    # the replies already requested are drained so the link stays in sync
+    def __read_pipelined(self, label, length, handle, progress_every=256):
+        readsize = uploader.READ_MULTI_MAX
+        sizes = [min(readsize, length - offset) for offset in range(0, length, readsize)]
+        sent = 0
+        done = 0
+        offset = 0
+        ok = True
+        while done < len(sizes):
+            while ok and sent < len(sizes) and sent - done < self.prog_window:
+                self.__send(uploader.READ_MULTI + struct.pack("B", sizes[sent]) + uploader.EOC)
+                sent += 1
+            if done == sent:
+                break
+            data = self.__recv(sizes[done])
+            self.__getSync()
+            if ok:
+                ok = handle(offset, data)
+            offset += len(data)
+            done += 1
+            # Print progress (throttled, so it does not delay the transfer)
+            if done % progress_every == 0:
+                self.__drawProgressBar(label, offset, length)
+
+        if ok:
+            self.__drawProgressBar(label, 100, 100)
+        return ok
 
     # send the reboot command
     def __reboot(self):
@@ -552,15 +1087,42 @@ class uploader(object):
         if self.bl_rev >= 3:
             self.__getSync()
 
-    # split a sequence into a list of size-constrained pieces
-    def __split_len(self, seq, length):
-        return [seq[i:i+length] for i in range(0, len(seq), length)]
+    # iterate over size-constrained memoryview pieces of the first end
+    # bytes of data, without copying them
+    def __split_len(self, data, length, end=None):
+        view = memoryview(data)
+        if end is None:
+            end = len(view)
+        for i in range(0, end, length):
+            yield view[i:min(i + length, end)]
+
+    # number of bytes of data that need programming: trailing groups that
+    # are entirely 0xFF are left out, the flash already reads back 0xFF after
+    # an erase. PROG_MULTI writes at an address that only ever advances, so
+    # only a trailing run can be left out, and the CRC/readback verification
+    # still covers the skipped range
+    def __program_len(self, data):
+        end = len(data)
+        if not self.skip_erased:
+            return end
+        view = memoryview(data)
+        length = uploader.PROG_MULTI_MAX
+        start = (end - 1) // length * length
+        while end > 0 and view[start:end] == uploader.ERASED[:end - start]:
+            end = start
+            start -= length
+        return end
 
     # upload code
     def __program(self, label, fw):
-        print("\n", end='')
+        self.__write("\n")
         code = fw.image
-        groups = self.__split_len(code, uploader.PROG_MULTI_MAX)
+        end = self.__program_len(code)
+        groups = self.__split_len(code, uploader.PROG_MULTI_MAX, end)
+        count = (end + uploader.PROG_MULTI_MAX - 1) // uploader.PROG_MULTI_MAX
+        if self.prog_window > 1:
+            frames = (self.__frame_multi(uploader.PROG_MULTI, data) for data in groups)
+            return self.__program_pipelined(label, frames, count, 256)
 
         uploadProgress = 0
         for bytes in groups:
@@ -569,61 +1131,67 @@ class uploader(object):
             # Print upload progress (throttled, so it does not delay upload progress)
             uploadProgress += 1
             if uploadProgress % 256 == 0:
-                self.__drawProgressBar(label, uploadProgress, len(groups))
+                self.__drawProgressBar(label, uploadProgress, count)
         self.__drawProgressBar(label, 100, 100)
+        return True
 
-    # download code
+    # download code into a preallocated, memory-mapped file and return the
+    # SHA-256 of the dump
     def __download(self, label, fw):
-        print("\n", end='')
-        f = open(fw, 'wb')
-
-        downloadProgress = 0
-        readsize = uploader.READ_MULTI_MAX
-        total = 0
-        while True:
-            n = min(self.fw_maxsize - total, readsize)
-            bb = self.__read_multi(n)
-            f.write(bb)
-
-            total += len(bb)
-            # Print download progress (throttled, so it does not delay download progress)
-            downloadProgress += 1
-            if downloadProgress % 256 == 0:
-                self.__drawProgressBar(label, total, self.fw_maxsize)
-            if len(bb) < readsize:
-                break
-        f.close()
-        self.__drawProgressBar(label, total, self.fw_maxsize)
-        # print("\nReceived %u bytes to %s" % (total, fw))
-
-    # verify code
+        self.__write("\n")
+        length = self.fw_maxsize
+        with open(fw, 'w+b') as f:
+            f.truncate(length)
+            out = mmap.mmap(f.fileno(), length)
+            try:
+                def store(offset, data):
+                    out[offset:offset + len(data)] = data
+                    return True
+
+                self.__read_pipelined(label, length, store)
+                out.flush()
+                digest = hashlib.sha256(out).hexdigest()
+            finally:
+                out.close()
+        self.__write("\nReceived %u bytes to %s\n" % (length, fw))
+        self.__write("SHA-256: %s\n" % digest)
+        return digest
+
+    # verify code by reading it back and comparing in place against the image
     def __verify_v2(self, label, fw):
-        print("\n", end='')
+        self.__write("\n")
         self.__send(uploader.CHIP_VERIFY +
                     uploader.EOC)
         self.__getSync()
-        code = fw.image
-        groups = self.__split_len(code, uploader.READ_MULTI_MAX)
-        verifyProgress = 0
-        for bytes in groups:
-            verifyProgress += 1
-            if verifyProgress % 256 == 0:
-                self.__drawProgressBar(label, verifyProgress, len(groups))
-            if (not self.__verify_multi(bytes)):
-                raise RuntimeError("Verification failed")
-        self.__drawProgressBar(label, 100, 100)
+        code = memoryview(fw.image)
+
+        def compare(offset, data):
+            expect = code[offset:offset + len(data)]
+            if expect == data:
+                return True
+            self.__write("\ngot    %s\n" % binascii.hexlify(data).decode('Latin-1'))
+            self.__write("expect %s\n" % binascii.hexlify(expect.tobytes()).decode('Latin-1'))
+            return False
 
-    def __verify_v3(self, label, fw):
-        print("\n", end='')
-        self.__drawProgressBar(label, 1, 100)
-        expect_crc = fw.crc(self.fw_maxsize)
+        if not self.__read_pipelined(label, len(code), compare):
+            raise RuntimeError("Verification failed")
+
+    # ask the bootloader for the CRC of the whole flash
+    def __get_crc(self):
         self.__send(uploader.GET_CRC +
                     uploader.EOC)
         report_crc = self.__recv_int()
         self.__getSync()
+        return report_crc
+
+    def __verify_v3(self, label, fw):
+        self.__write("\n")
+        self.__drawProgressBar(label, 1, 100)
+        expect_crc = fw.crc(self.fw_maxsize)
+        report_crc = self.__get_crc()
         if report_crc != expect_crc:
-            print("Expected 0x%x" % expect_crc)
-            print("Got      0x%x" % report_crc)
+            self.__write("Expected 0x%x\n" % expect_crc)
+            self.__write("Got      0x%x\n" % report_crc)
             raise RuntimeError("Program CRC failed")
         self.__drawProgressBar(label, 100, 100)
 
@@ -658,9 +1226,14 @@ class uploader(object):
                 return
 
     def __program_extf(self, label, fw):
-        print("\n", end='')
+        self.__write("\n")
         code = fw.extf_image
-        groups = self.__split_len(code, uploader.PROG_MULTI_MAX)
+        end = self.__program_len(code)
+        groups = self.__split_len(code, uploader.PROG_MULTI_MAX, end)
+        count = (end + uploader.PROG_MULTI_MAX - 1) // uploader.PROG_MULTI_MAX
+        if self.prog_window > 1:
+            frames = (self.__frame_multi(uploader.EXTF_PROG_MULTI, data) for data in groups)
+            return self.__program_pipelined(label, frames, count, 32)
 
         uploadProgress = 0
         for bytes in groups:
@@ -669,15 +1242,16 @@ class uploader(object):
             # Print upload progress (throttled, so it does not delay upload progress)
             uploadProgress += 1
             if uploadProgress % 32 == 0:
-                self.__drawProgressBar(label, uploadProgress, len(groups))
+                self.__drawProgressBar(label, uploadProgress, count)
         self.__drawProgressBar(label, 100, 100)
+        return True
 
     def __verify_extf(self, label, fw, size):
         if runningPython3:
             size_bytes = size.to_bytes(4, byteorder='little')
         else:
             size_bytes = chr(size)
-        print("\n", end='')
+        self.__write("\n")
         self.__drawProgressBar(label, 1, 100)
 
         expect_crc = fw.extf_crc(size)
@@ -694,8 +1268,7 @@ class uploader(object):
                 self.__drawProgressBar(label, 10.0-estimatedTimeRemaining, 4.0)
             else:
                 self.__drawProgressBar(label, 5.0, 5.0)
-                sys.stdout.write(" (timeout: %d seconds) " % int(deadline-time.time()))
-                sys.stdout.flush()
+                self.__write(" (timeout: %d seconds) " % int(deadline-time.time()))
 
             try:
                 report_crc = self.__recv_int()
@@ -715,6 +1288,7 @@ class uploader(object):
 
     # get basic data about the board
     def identify(self):
+        start = time.time()
         # make sure we are in sync before starting
         self.__sync()
 
@@ -737,52 +1311,105 @@ class uploader(object):
         self.board_type = self.__getInfo(uploader.INFO_BOARD_ID)
         self.board_rev = self.__getInfo(uploader.INFO_BOARD_REV)
         self.fw_maxsize = self.__getInfo(uploader.INFO_FLASH_SIZE)
+        self.__serial = None
+        self.__identity = None
+        self.phase_times['identify'] = time.time() - start
+
+    # time count GET_SYNC round trips with the bootloader, in seconds
+    def ping(self, count=RTT_PINGS):
+        samples = []
+        for i in range(count):
+            start = time.time()
+            self.__send(uploader.GET_SYNC +
+                        uploader.EOC)
+            self.__getSync()
+            samples.append(time.time() - start)
+        self.rtt_samples.extend(samples)
+        return samples
+
+    # measure command round trip and bulk READ_MULTI throughput without
+    # writing anything; like download() this reads from the start of flash,
+    # so it must run straight after identify()
+    def benchmark_link(self, pings=64, size=BENCHMARK_READ):
+        rtt = self.ping(pings)
+        size = min(size, self.fw_maxsize)
+        self.__phase_start("benchmark_read")
+        start = time.time()
+        try:
+            self.__read_pipelined("Read   ", size, lambda offset, data: True)
+        finally:
+            self.__phase_end()
+        elapsed = time.time() - start
+        return {
+            'rtt': rtt_summary(rtt),
+            'read_bytes': size,
+            'read_seconds': elapsed,
+            'read_bytes_per_sec': size / elapsed if elapsed > 0 else None,
+            'prog_window': self.prog_window,
+        }
+
+    # the MCU serial number as hex, read once per connection; None before
+    # bootloader rev4
+    def serial_number(self):
+        if self.__serial is None and self.bl_rev > 3:
+            sn = b''
+            for byte in range(0, 12, 4):
+                x = self.__getSN(byte)
+                sn = sn + x[::-1]  # reverse the bytes
+            self.__serial = binascii.hexlify(sn).decode('Latin-1')
+        return self.__serial
+
+    # the BoardIdentity of the connected board. Only the serial number is
+    # read every time; the OTP and chip registers are read once per physical
+    # board and cached on disk under its serial number
+    def identity(self, use_cache=True):
+        if self.__identity is not None:
+            return self.__identity
+        serial = self.serial_number()
+        identity = None
+        if use_cache and serial is not None:
+            identity = BoardIdentity.load(serial)
+            if identity is not None and not identity.matches(self):
+                identity = None
+        if identity is None:
+            identity = self.__read_identity(serial)
+            if use_cache and serial is not None:
+                identity.save()
+        self.__identity = identity
+        return identity
+
+    def __read_identity(self, serial):
+        identity = BoardIdentity(serial=serial,
+                                 bl_rev=self.bl_rev,
+                                 board_type=self.board_type,
+                                 board_rev=self.board_rev,
+                                 board_name=self.board_name_for_board_id(self.board_type),
+                                 fw_maxsize=self.fw_maxsize,
+                                 extf_maxsize=self.extf_maxsize)
 
-    def dump_board_info(self):
         # OTP added in v4:
-        # print("Bootloader Protocol: %u" % self.bl_rev)
         if self.bl_rev > 3:
             otp = b''
             for byte in range(0, 32*6, 4):
                 x = self.__getOTP(byte)
                 otp = otp + x
-#                print(binascii.hexlify(x).decode('Latin-1') + ' ', end='')
             # see src/modules/systemlib/otp.h in px4 code:
-            otp_id = otp[0:4]
-            otp_idtype = otp[4:5]
-            otp_vid = otp[8:4:-1]
-            otp_pid = otp[12:8:-1]
-            otp_coa = otp[32:160]
-            # show user:
-            try:
-                # print("OTP:")
-                # print("  type: " + otp_id.decode('Latin-1'))
-                # print("  idtype: " + binascii.b2a_qp(otp_idtype).decode('Latin-1'))
-                # print("  vid: " + binascii.hexlify(otp_vid).decode('Latin-1'))
-                # print("  pid: " + binascii.hexlify(otp_pid).decode('Latin-1'))
-                # print("  coa: " + binascii.b2a_base64(otp_coa).decode('Latin-1'), end='')
-                # print("  sn: ", end='')
-                for byte in range(0, 12, 4):
-                    x = self.__getSN(byte)
-                    x = x[::-1]  # reverse the bytes
-                    # print(binascii.hexlify(x).decode('Latin-1'), end='')  # show user
-                # print('')
-            except Exception:
-                # ignore bad character encodings
-                pass
+            identity.otp = {
+                'type': otp[0:4].decode('Latin-1'),
+                'idtype': binascii.b2a_qp(otp[4:5]).decode('Latin-1'),
+                'vid': binascii.hexlify(otp[8:4:-1]).decode('Latin-1'),
+                'pid': binascii.hexlify(otp[12:8:-1]).decode('Latin-1'),
+                'coa': binascii.b2a_base64(otp[32:160]).decode('Latin-1').strip(),
+            }
 
         if self.bl_rev >= 5:
             des = self.__getCHIPDes()
             if (len(des) == 2):
-                # print("ChipDes:")
-                # print("  family: %s" % des[0])
-                # print("  revision: %s" % des[1])
-                pass
-        # print("Chip:")
+                identity.chip_des = des
+
         if self.bl_rev > 4:
             chip = self.__getCHIP()
-            mcu_id = chip & 0xfff
-            revs = {}
+            identity.chip = chip
 
             F4_IDS = {
                 0x413: "STM32F40x_41x",
@@ -797,10 +1424,10 @@ class uploader(object):
                 0x450: "STM32H74x_75x",
             }
 
-            family = mcu_id & 0xfff
+            family = chip & 0xfff
 
             if family in F4_IDS:
-                mcu = F4_IDS[family]
+                identity.chip_name = F4_IDS[family]
                 MCU_REV_STM32F4_REV_A = 0x1000
                 MCU_REV_STM32F4_REV_Z = 0x1001
                 MCU_REV_STM32F4_REV_Y = 0x1003
@@ -817,97 +1444,51 @@ class uploader(object):
 
                 if rev in revs:
                     (label, flawed) = revs[rev]
-                    if flawed and family == 0x419:
-                        # print("  %x %s rev%s (flawed; 1M limit, see STM32F42XX Errata sheet sec. 2.1.10)" %
-                        #       (chip, mcu, label,))
-                        pass
-                    elif family == 0x419:
-                        # print("  %x %s rev%s (no 1M flaw)" % (chip, mcu, label,))
-                        pass
-                    else:
-                        # print("  %x %s rev%s" % (chip, mcu, label,))
-                        pass
+                    identity.chip_rev = label
+                    # only the F42x/43x parts have the 1M flash flaw
+                    identity.chip_flawed = flawed and family == 0x419
             elif family in F7_IDS:
-                # print("  %s %08x" % (F7_IDS[family], chip))
-                pass
+                identity.chip_name = F7_IDS[family]
             elif family in H7_IDS:
-                # print("  %s %08x" % (H7_IDS[family], chip))
-                pass
-        else:
-            # print("  [unavailable; bootloader too old]")
-            pass
+                identity.chip_name = H7_IDS[family]
+        return identity
 
-        # print("Info:")
-        # print("  flash size: %u" % self.fw_maxsize)
-        # print("  ext flash size: %u" % self.extf_maxsize)
-        name = self.board_name_for_board_id(self.board_type)
-        if name is not None:
-            # print("  board_type: %u (%s)" % (self.board_type, name))
-            pass
-        else:
-            # print("  board_type: %u" % self.board_type)
-            pass
-        # print("  board_rev: %u" % self.board_rev)
-
-        # print("Identification complete")
+    # kept for callers of the old name; reads nothing the identity cache
+    # already has
+    def dump_board_info(self):
+        return self.identity()
 
     def board_name_for_board_id(self, board_id):
         '''return name for board_id, None if it can't be found'''
-        shared_ids = {
-            9: "fmuv3",
-            50: "fmuv5",
-        }
-        if board_id in shared_ids:
-            return shared_ids[board_id]
-
-        try:
-            ret = []
+        return board_registry().name(board_id)
 
-            hwdef_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)),
-                                     "..", "..", "libraries", "AP_HAL_ChibiOS", "hwdef")
-            # uploader.py is swiped into other places, so if the dir
-            # doesn't exist then fail silently
-            if os.path.exists(hwdef_dir):
-                dirs = [x if (x not in ["scripts", "common", "STM32CubeConf"] and os.path.isdir(os.path.join(hwdef_dir, x))) else None for x in os.listdir(hwdef_dir)]  # NOQA
-                for adir in dirs:
-                    if adir is None:
-                        continue
-                    filepath = os.path.join(hwdef_dir, adir, "hwdef.dat")
-                    if not os.path.exists(filepath):
-                        continue
-                    fh = open(filepath)
-                    if fh is None:
-                        continue
-                    text = fh.readlines()
-                    for line in text:
-                        m = re.match(r"^\s*APJ_BOARD_ID\s+(\d+)\s*$", line)
-                        if m is None:
-                            continue
-                        if int(m.group(1)) == board_id:
-                            ret.append(adir)
-            if len(ret) == 0:
-                return None
-            return " or ".join(ret)
-        except Exception as e:
-            # print("Failed to get name: %s" % str(e))
-            pass
-        return None
+    # check whether the flash already holds exactly this image; needs GET_CRC
+    # (rev3+) and can't see external flash, so images with extf never match
+    def is_identical(self, fw):
+        if self.bl_rev < 3 or fw.property('extf_image_size', 0) > 0:
+            return False
+        return self.__get_crc() == fw.crc(self.fw_maxsize)
 
-    # upload the firmware
-    def upload(self, fw, force=False, boot_delay=None):
+    # upload the firmware, returns "flashed" or "skipped (identical)"
+    def upload(self, fw, force=False, boot_delay=None, skip_identical=False):
+        try:
+            return self.__upload(fw, force, boot_delay, skip_identical)
+        finally:
+            # account for the time spent in a phase that raised
+            self.__phase_end()
+
+    # board compatibility and size checks, and the identical-firmware
+    # shortcut; returns True if the board was left as it is and rebooted
+    def __precheck(self, fw, force, boot_delay, skip_identical):
         # Make sure we are doing the right thing
         if self.board_type != fw.property('board_id'):
             # ID mismatch: check compatibility
-            incomp = True
-            if self.board_type in compatible_IDs:
-                comp_fw_id = compatible_IDs[self.board_type][0]
-                board_name = compatible_IDs[self.board_type][1]
-                if comp_fw_id == fw.property('board_id'):
-                    msg = "Target %s (board_id: %d) is compatible with firmware for board_id=%u)" % (
-                        board_name, self.board_type, fw.property('board_id'))
-                    # print("INFO: %s" % msg)
-                    incomp = False
-            if incomp:
+            registry = board_registry()
+            if registry.accepts(self.board_type, fw.property('board_id')):
+                msg = "Target %s (board_id: %d) is compatible with firmware for board_id=%u)" % (
+                    registry.compatible(self.board_type)[1], self.board_type, fw.property('board_id'))
+                # print("INFO: %s" % msg)
+            else:
                 msg = "Firmware not suitable for this board (board_type=%u (%s) board_id=%u (%s))" % (
                     self.board_type,
                     self.board_name_for_board_id(self.board_type),
@@ -921,37 +1502,151 @@ class uploader(object):
                 else:
                     raise IOError(msg)
 
-        self.dump_board_info()
-
         if self.fw_maxsize < fw.property('image_size') or self.extf_maxsize < fw.property('extf_image_size', 0):
             raise RuntimeError("Firmware image is too large for this board")
 
+        if skip_identical:
+            self.__phase_start('precheck')
+            identical = self.is_identical(fw)
+            self.__phase_end()
+            if identical:
+                if boot_delay is not None:
+                    self.__set_boot_delay(boot_delay)
+                self.__write(colored("\nFirmware already on board, skipped (identical).\nRebooting.\n", 'blue') + "\n")
+                self.__phase_start('reboot')
+                self.__reboot()
+                self.port.close()
+                self.__phase_end()
+                return True
+        return False
+
+    def __set_flash_baud(self):
         if self.baudrate_bootloader_flash != self.baudrate_bootloader:
             # print("Setting baudrate to %u" % self.baudrate_bootloader_flash)
             self.__setbaud(self.baudrate_bootloader_flash)
             self.port.baudrate = self.baudrate_bootloader_flash
             self.__sync()
 
-        if (fw.property('extf_image_size', 0) > 0):
+    # a pipelined write was rejected: erase again and program in lock-step
+    def __retry_lockstep(self, fw, extf):
+        # the rejected attempt's bytes are erased and written again
+        self.bytes_resent += self.bytes_written - self.__attempt_start
+        self.bytes_written = self.__attempt_start
+        self.prog_window = 1
+        self.__sync()
+        if extf:
             self.erase_extflash("Erase ExtF  ", fw.property('extf_image_size', 0))
             self.__program_extf("Program ExtF", fw)
-            self.__verify_extf("Verify ExtF ", fw, fw.property('extf_image_size', 0))
-
-        if (fw.property('image_size') > 0):
+        else:
             self.__erase(colored("Erase  ", 'blue'))
             self.__program(colored("Program", 'blue'), fw)
 
-            if self.bl_rev == 2:
-                self.__verify_v2(colored("Verify ", 'blue'), fw)
-            else:
-                self.__verify_v3(colored("Verify ", 'blue'), fw)
+    # verify the main image with whatever the bootloader revision supports
+    def __verify(self, fw):
+        self.verified = False
+        if self.bl_rev == 2:
+            self.__verify_v2(colored("Verify ", 'blue'), fw)
+        else:
+            self.__verify_v3(colored("Verify ", 'blue'), fw)
+        self.verified = True
 
+    def __finish(self, boot_delay):
         if boot_delay is not None:
             self.__set_boot_delay(boot_delay)
 
-        print(colored("\nRebooting.\n", 'blue'))
+        self.__write(colored("\nRebooting.\n", 'blue') + "\n")
+        self.__phase_start('reboot')
         self.__reboot()
         self.port.close()
+        self.__phase_end()
+
+    def __upload(self, fw, force, boot_delay, skip_identical):
+        if self.__precheck(fw, force, boot_delay, skip_identical):
+            return "skipped (identical)"
+        self.__set_flash_baud()
+
+        if (fw.property('extf_image_size', 0) > 0):
+            self.__phase_start('erase_extf')
+            self.erase_extflash("Erase ExtF  ", fw.property('extf_image_size', 0))
+            self.__phase_start('program_extf')
+            if not self.__program_extf("Program ExtF", fw):
+                self.__retry_lockstep(fw, True)
+            self.__phase_start('verify_extf')
+            self.verified = False
+            self.__verify_extf("Verify ExtF ", fw, fw.property('extf_image_size', 0))
+            self.verified = True
+
+        if (fw.property('image_size') > 0):
+            self.__phase_start('erase')
+            self.__erase(colored("Erase  ", 'blue'))
+            self.__phase_start('program')
+            if not self.__program(colored("Program", 'blue'), fw):
+                self.__retry_lockstep(fw, False)
+            self.__phase_start('verify')
+            self.__verify(fw)
+        self.__phase_end()
+
+        self.__finish(boot_delay)
+        return "flashed"
+
+    # upload() as an asyncio coroutine. The serial conversation runs in a
+    # worker thread so the event loop stays free; while the bootloader
+    # erases, other workers frame every PROG_MULTI packet and compute the
+    # CRCs to verify against, so programming starts as soon as the erase
+    # is acknowledged
+    async def upload_async(self, fw, force=False, boot_delay=None, skip_identical=False):
+        try:
+            return await self.__upload_async(fw, force, boot_delay, skip_identical)
+        finally:
+            self.__phase_end()
+
+    async def __upload_async(self, fw, force, boot_delay, skip_identical):
+        loop = asyncio.get_running_loop()
+
+        def run(func, *args):
+            return loop.run_in_executor(None, func, *args)
+
+        if await run(self.__precheck, fw, force, boot_delay, skip_identical):
+            return "skipped (identical)"
+        await run(self.__set_flash_baud)
+
+        extf_size = fw.property('extf_image_size', 0)
+        if extf_size > 0:
+            extf_frames = run(self.__frame_all, uploader.EXTF_PROG_MULTI, fw.extf_image)
+            extf_crc = run(fw.extf_crc, extf_size)
+        if fw.property('image_size') > 0:
+            frames = run(self.__frame_all, uploader.PROG_MULTI, fw.image)
+            crc = run(fw.crc, self.fw_maxsize)
+
+        if extf_size > 0:
+            self.__phase_start('erase_extf')
+            await run(self.erase_extflash, "Erase ExtF  ", extf_size)
+            self.__phase_start('program_extf')
+            self.__write("\n")
+            packets = await extf_frames
+            if not await run(self.__program_pipelined, "Program ExtF", packets, len(packets), 32):
+                await run(self.__retry_lockstep, fw, True)
+            await extf_crc
+            self.__phase_start('verify_extf')
+            self.verified = False
+            await run(self.__verify_extf, "Verify ExtF ", fw, extf_size)
+            self.verified = True
+
+        if fw.property('image_size') > 0:
+            self.__phase_start('erase')
+            await run(self.__erase, colored("Erase  ", 'blue'))
+            self.__phase_start('program')
+            self.__write("\n")
+            packets = await frames
+            if not await run(self.__program_pipelined, colored("Program", 'blue'), packets, len(packets), 256):
+                await run(self.__retry_lockstep, fw, False)
+            await crc
+            self.__phase_start('verify')
+            await run(self.__verify, fw)
+        self.__phase_end()
+
+        await run(self.__finish, boot_delay)
+        return "flashed"
 
     def __next_baud_flightstack(self):
         self.baudrate_flightstack_idx = self.baudrate_flightstack_idx + 1
@@ -965,6 +1660,18 @@ class uploader(object):
 
         return True
 
+    def send_reboot_bootloader(self):
+        '''send one MAVLink reboot-to-bootloader command at the first flight stack baud rate'''
+        try:
+            self.port.baudrate = self.baudrate_flightstack[0]
+            self.port.flush()
+            self.__send(self.MAVLINK_REBOOT_ID1)
+            self.port.flush()
+            self.port.baudrate = self.baudrate_bootloader
+        except Exception:
+            return False
+        return True
+
     def send_reboot(self):
         if (not self.__next_baud_flightstack()):
             return False
@@ -995,7 +1702,7 @@ class uploader(object):
 
         return True
 
-    # upload the firmware
+    # download the flash contents to a file, returns the SHA-256 of the dump
     def download(self, fw):
         if self.baudrate_bootloader_flash != self.baudrate_bootloader:
             # print("Setting baudrate to %u" % self.baudrate_bootloader_flash)
@@ -1003,16 +1710,25 @@ class uploader(object):
             self.port.baudrate = self.baudrate_bootloader_flash
             self.__sync()
 
-        self.__download("Download", fw)
-        self.port.close()
+        self.__phase_start("download")
+        try:
+            return self.__download("Download", fw)
+        finally:
+            self.__phase_end()
+            self.port.close()
 
 
 def ports_to_try(args):
+    return expand_ports(args.port)
+
+
+def expand_ports(port):
+    '''list the ports matching a comma-separated list of names/patterns, or default_ports if None'''
     portlist = []
-    if args.port is None:
+    if port is None:
         patterns = default_ports
     else:
-        patterns = args.port.split(",")
+        patterns = port.split(",")
     # use glob to support wildcard ports. This allows the use of
     # /dev/serial/by-id/usb-ArduPilot on Linux, which prevents the
     # upload from causing modem hangups etc
@@ -1082,6 +1798,398 @@ def find_bootloader(up, port):
             return False
 
 
+def find_bootloader_fast(up, port, patterns=None, timeout=10.0):
+    '''identify the bootloader on port, rebooting the flight stack into it if needed
+
+    Unlike find_bootloader() this sends a single MAVLink reboot-to-bootloader
+    command and then watches for the USB device to go away and for a port
+    matching patterns (as for --port) to come back, talking to it as soon as
+    it appears rather than sleeping for fixed intervals. Returns the port the
+    bootloader answered on (USB bootloaders usually have their own
+    /dev/serial/by-id name), or None. The time from sending the reboot to
+    bootloader sync is left in up.reboot_latency.
+    '''
+    up.open()
+    try:
+        # a bootloader answers GET_SYNC within a few ms, a flight stack never
+        # does, so don't wait out the full port timeout to find out
+        up.port.timeout = 0.25
+        up.identify()
+        up.reboot_latency = 0.0
+        return port
+    except Exception:
+        pass
+    finally:
+        up.port.timeout = 2.0
+
+    device = os.path.realpath(port)
+    # ports that belong to other boards are never candidates
+    others = set(p for p in expand_ports(patterns) if os.path.realpath(p) != device)
+
+    start = time.time()
+    if not up.send_reboot_bootloader():
+        return None
+    up.close()
+
+    # wait for the flight stack's USB device node to go away
+    while os.path.exists(device):
+        if time.time() - start > 1.5:
+            # it didn't take the MAVLink reboot, try NSH and the other baud rates
+            if find_bootloader(up, port):
+                up.reboot_latency = time.time() - start
+                return port
+            return None
+        time.sleep(0.005)
+
+    # then for the bootloader's port to appear
+    deadline = start + timeout
+    while time.time() < deadline:
+        for candidate in expand_ports(patterns):
+            if candidate in others:
+                continue
+            up.port.port = candidate
+            up.open()
+            try:
+                if up.port.is_open:
+                    up.identify()
+                    up.reboot_latency = time.time() - start
+                    return candidate
+            except Exception:
+                pass
+            up.close()
+        time.sleep(0.005)
+    return None
+
+
+def rtt_summary(samples):
+    '''min/median/p95/max and a histogram over RTT_BUCKETS_MS of round-trip times given in seconds'''
+    if len(samples) == 0:
+        return None
+    ms = sorted(x * 1000.0 for x in samples)
+    counts = [0] * (len(RTT_BUCKETS_MS) + 1)
+    for x in ms:
+        counts[bisect.bisect_left(RTT_BUCKETS_MS, x)] += 1
+    return {
+        'count': len(ms),
+        'min_ms': ms[0],
+        'median_ms': ms[len(ms) // 2],
+        'p95_ms': ms[int(round(0.95 * (len(ms) - 1)))],
+        'max_ms': ms[-1],
+        # the last bucket (max_ms None) counts everything above the final edge
+        'histogram': [{'max_ms': edge, 'count': n} for (edge, n) in zip(list(RTT_BUCKETS_MS) + [None], counts)],
+    }
+
+
+class FlashResult(object):
+    '''Outcome of a flash() call'''
+
+    def __init__(self):
+        self.success = False
+        self.status = None          # "flashed" or "skipped (identical)" on success
+        self.error = None
+        self.port = None
+        self.board_type = None
+        self.board_rev = None
+        self.bl_rev = None
+        self.bytes_written = 0
+        self.bytes_resent = 0
+        self.verified = None        # None if verification never ran
+        self.phases = {}            # phase name -> seconds
+        self.rtt = []               # GET_SYNC round trips in seconds
+        self.serial = None          # MCU serial number, bootloader rev4+
+        self.identity = None        # BoardIdentity.as_dict()
+
+    def update_from(self, up):
+        self.board_type = getattr(up, 'board_type', None)
+        self.board_rev = getattr(up, 'board_rev', None)
+        self.bl_rev = getattr(up, 'bl_rev', None)
+        self.bytes_written = up.bytes_written
+        self.bytes_resent = up.bytes_resent
+        self.verified = up.verified
+        self.phases.update(up.phase_times)
+        self.rtt = list(up.rtt_samples)
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def telemetry(self):
+        '''per-phase timing, achieved throughput and link latency as a JSON-friendly dict'''
+        t = self.as_dict()
+        t['timestamp'] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        programming = self.phases.get('program', 0.0) + self.phases.get('program_extf', 0.0)
+        t['bytes_per_sec'] = self.bytes_written / programming if programming > 0 else None
+        t['rtt'] = rtt_summary(self.rtt)
+        return t
+
+    def write_telemetry(self, path):
+        '''write telemetry() as a JSON sidecar file'''
+        with open(path, 'w') as f:
+            json.dump(self.telemetry(), f, indent=4, sort_keys=True)
+
+
+def flash(image,
+          port=None,
+          force=False,
+          on_progress=None,
+          skip_identical=False,
+          boot_delay=None,
+          baud_bootloader=115200,
+          baud_flightstack=(57600,),
+          timeout=60.0,
+          quiet=False,
+          fast_reboot=False,
+          rtt_pings=uploader.RTT_PINGS,
+          telemetry=None,
+          use_async=False,
+          **uploader_args):
+    '''flash image (an APJ path or a firmware object) onto the first board found
+
+    port is a comma-separated list of ports/patterns as for --port.
+    on_progress, if given, is called as on_progress(phase, percent).
+    quiet suppresses the console progress bars.
+    fast_reboot uses find_bootloader_fast() to get into the bootloader.
+    rtt_pings GET_SYNC round trips are timed before flashing.
+    telemetry, if given, is a path the FlashResult telemetry is written to as JSON.
+    use_async flashes with upload_async(), overlapping the erase with packet framing and CRCs.
+    Extra keyword arguments are passed to the uploader constructor.
+    Returns a FlashResult; errors are reported in it rather than raised.
+    '''
+    result = FlashResult()
+    start = time.time()
+    try:
+        if isinstance(image, firmware):
+            fw = image
+        else:
+            fw = firmware(image)
+        search_start = time.time()
+        result.phases['load'] = search_start - start
+
+        deadline = start + timeout
+        while time.time() < deadline:
+            for portname in expand_ports(port):
+                try:
+                    up = uploader(portname, baud_bootloader, list(baud_flightstack), **uploader_args)
+                except Exception:
+                    time.sleep(0.05)
+                    continue
+
+                if fast_reboot:
+                    portname = find_bootloader_fast(up, portname, port)
+                    if portname is None:
+                        continue
+                    if up.reboot_latency:
+                        result.phases['reboot_to_sync'] = up.reboot_latency
+                elif not find_bootloader(up, portname):
+                    continue
+                # includes any reboot from the flight stack into the bootloader
+                result.phases['find_bootloader'] = time.time() - search_start - up.phase_times.get('identify', 0.0)
+
+                up.on_progress = on_progress
+                up.quiet = quiet
+                result.port = portname
+                try:
+                    if rtt_pings:
+                        up.ping(rtt_pings)
+                    identity = up.identity()
+                    result.serial = identity.serial
+                    result.identity = identity.as_dict()
+                    if use_async:
+                        result.status = asyncio.run(up.upload_async(fw, force=force, boot_delay=boot_delay,
+                                                                    skip_identical=skip_identical))
+                    else:
+                        result.status = up.upload(fw, force=force, boot_delay=boot_delay, skip_identical=skip_identical)
+                    result.success = True
+                    result.error = None
+                except IOError as ex:
+                    # wrong board (or it went away); keep looking like main() does
+                    result.error = str(ex)
+                    continue
+                except RuntimeError as ex:
+                    result.error = str(ex)
+                except Exception as ex:
+                    # a garbled reply or malformed image; reported like any other failure
+                    result.error = repr(ex)
+                finally:
+                    up.close()
+                    result.update_from(up)
+                return result
+
+            # Delay retries to < 20 Hz to prevent spin-lock from hogging the CPU
+            time.sleep(0.05)
+
+        if result.error is None:
+            result.error = "timed out waiting for a bootloader"
+    except Exception as ex:
+        # e.g. an APJ that can't be read or parsed
+        result.error = repr(ex)
+    finally:
+        result.phases['total'] = time.time() - start
+        if telemetry is not None:
+            result.write_telemetry(telemetry)
+    return result
+
+
+class GangProgress(object):
+    '''One progress line per port, redrawn in place while boards flash in parallel'''
+
+    def __init__(self, ports):
+        self.ports = list(ports)
+        self.state = dict((port, ("waiting", 0.0)) for port in self.ports)
+        self.lock = threading.Lock()
+        self.drawn = False
+
+    def callback(self, port):
+        def on_progress(phase, percent):
+            with self.lock:
+                self.state[port] = (phase or "", percent)
+        return on_progress
+
+    def finish(self, port, text):
+        with self.lock:
+            self.state[port] = (text, 100.0)
+
+    def draw(self):
+        with self.lock:
+            lines = []
+            for port in self.ports:
+                (phase, percent) = self.state[port]
+                lines.append("%-40s %-22s [%-20s] %5.1f%%" % (
+                    os.path.basename(port)[-40:], phase, '='*int(percent/5.0), percent))
+        if self.drawn:
+            # move back up over the previous block
+            sys.stdout.write("\033[%uA" % len(lines))
+        sys.stdout.write("".join("\r\033[K%s\n" % line for line in lines))
+        sys.stdout.flush()
+        self.drawn = True
+
+
+def find_all_bootloaders(args, baud_flightstack, wait, count=None, settle=GANG_SETTLE):
+    '''return {port: uploader} for every board that reaches its bootloader within wait seconds
+
+    Returns early once count boards were found, or, without a count, once
+    boards were found and no new one turned up for settle seconds.
+    '''
+    found = {}
+    deadline = time.time() + wait
+    last_found = None
+    while time.time() < deadline:
+        if count is not None and len(found) >= count:
+            break
+        if count is None and last_found is not None and time.time() - last_found >= settle:
+            break
+        for port in ports_to_try(args):
+            if port in found:
+                continue
+            try:
+                up = uploader(port,
+                              args.baud_bootloader,
+                              baud_flightstack,
+                              args.baud_bootloader_flash,
+                              args.target_system,
+                              args.target_component,
+                              args.source_system,
+                              args.source_component,
+                              args.no_extf,
+                              args.force_erase,
+                              args.prog_window,
+                              not args.no_skip_erased)
+            except Exception:
+                continue
+            if find_bootloader(up, port):
+                print("Found board %x,%x bootloader rev %x on %s" % (up.board_type, up.board_rev, up.bl_rev, port))
+                found[port] = up
+                last_found = time.time()
+            else:
+                # a rebooted board comes back under its bootloader port name
+                up.close()
+
+        # Delay retries to < 20 Hz to prevent spin-lock from hogging the CPU
+        time.sleep(0.05)
+    return found
+
+
+def gang_upload(args, fw, baud_flightstack):
+    '''flash every board found in parallel, returns a {port: FlashResult} table'''
+    from concurrent.futures import ThreadPoolExecutor
+
+    print("Looking for bootloaders for up to %u seconds..." % args.gang_wait)
+    found = find_all_bootloaders(args, baud_flightstack, args.gang_wait, args.gang_count)
+    if len(found) == 0:
+        return {}
+
+    progress = GangProgress(sorted(found.keys()))
+
+    def flash_one(port):
+        up = found[port]
+        result = FlashResult()
+        result.port = port
+        up.quiet = True
+        up.on_progress = progress.callback(port)
+        start = time.time()
+        try:
+            up.ping()
+            result.serial = up.serial_number()
+            if args.use_async:
+                result.status = asyncio.run(up.upload_async(fw, force=args.force, boot_delay=args.boot_delay,
+                                                            skip_identical=args.skip_identical))
+            else:
+                result.status = up.upload(fw, force=args.force, boot_delay=args.boot_delay,
+                                          skip_identical=args.skip_identical)
+            result.success = True
+        except (RuntimeError, IOError) as ex:
+            result.error = str(ex)
+        except Exception as ex:
+            # this port's failure only; the other boards keep flashing
+            result.error = repr(ex)
+        finally:
+            up.close()
+            result.update_from(up)
+            result.phases['total'] = time.time() - start
+        progress.finish(port, result.status if result.success else "FAILED")
+        return result
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(found)) as pool:
+        futures = dict((port, pool.submit(flash_one, port)) for port in progress.ports)
+        while not all(f.done() for f in futures.values()):
+            progress.draw()
+            time.sleep(0.2)
+        progress.draw()
+        for (port, f) in futures.items():
+            results[port] = f.result()
+    return results
+
+
+def print_gang_results(results):
+    print("\n%-40s %-10s %-20s %8s  %s" % ("Port", "Board", "Result", "Time", "Error"))
+    for port in sorted(results.keys()):
+        r = results[port]
+        board = "-" if r.board_type is None else "%u,%u" % (r.board_type, r.board_rev)
+        status = r.status if r.success else "FAILED"
+        print("%-40s %-10s %-20s %7.1fs  %s" % (
+            os.path.basename(port)[-40:], board, status, r.phases.get('total', 0.0), r.error or ""))
+
+
+def write_gang_telemetry(results, path):
+    with open(path, 'w') as f:
+        json.dump(dict((port, r.telemetry()) for (port, r) in results.items()), f, indent=4, sort_keys=True)
+
+
+def print_link_benchmark(bench):
+    rtt = bench['rtt']
+    print("\nRound trip (%u GET_SYNC): min %.2f ms, median %.2f ms, p95 %.2f ms, max %.2f ms" % (
+        rtt['count'], rtt['min_ms'], rtt['median_ms'], rtt['p95_ms'], rtt['max_ms']))
+    tallest = max(bucket['count'] for bucket in rtt['histogram'])
+    for bucket in rtt['histogram']:
+        if bucket['max_ms'] is None:
+            label = "> %g ms" % RTT_BUCKETS_MS[-1]
+        else:
+            label = "<= %g ms" % bucket['max_ms']
+        print("  %-10s %5u %s" % (label, bucket['count'], '#' * (40 * bucket['count'] // tallest)))
+    print("Bulk read: %u bytes in %.2f s, %.1f KiB/s with %u READ_MULTI in flight" % (
+        bench['read_bytes'], bench['read_seconds'], (bench['read_bytes_per_sec'] or 0) / 1024.0, bench['prog_window']))
+
+
 def main():
 
     # Parse commandline arguments
@@ -1132,23 +2240,44 @@ def main():
     )
     parser.add_argument('--download', action='store_true', default=False, help='download firmware from board')
     parser.add_argument('--identify', action="store_true", help="Do not flash firmware; simply dump information about board")
+    parser.add_argument('--benchmark-link', action="store_true",
+                        help="Do not flash firmware; measure bootloader round-trip latency and bulk read throughput")
+    parser.add_argument('--telemetry', default=None,
+                        help="Write per-phase timing, throughput and round-trip latency to this JSON file")
     parser.add_argument('--no-extf', action="store_true", help="Do not attempt external flash operations")
     parser.add_argument('--erase-extflash', type=lambda x: int(x, 0), default=None,
                         help="Erase sectors containing specified amount of bytes from ext flash")
     parser.add_argument('--force-erase', action="store_true", help="Do not check for pre cleared flash, always erase the chip")
+    parser.add_argument('--fast-reboot', action="store_true",
+                        help="Reboot into the bootloader with a single MAVLink command and wait for the USB device to re-enumerate")  # NOQA
+    parser.add_argument('--gang', action="store_true",
+                        help="Flash every board found on the given ports in parallel instead of only the first one")
+    parser.add_argument('--gang-wait', type=float, default=10.0,
+                        help="Most seconds to spend collecting boards in --gang mode (default is 10); stops %g s after the last new board" % GANG_SETTLE)  # NOQA
+    parser.add_argument('--gang-count', type=int, default=None,
+                        help="Stop collecting boards in --gang mode as soon as this many were found")
+    parser.add_argument('--async', dest='use_async', action="store_true",
+                        help="Frame the packets and compute the CRCs while the chip erases instead of before/after it")
+    parser.add_argument('--skip-identical', action="store_true",
+                        help="Check the flash CRC first and skip erase/program/verify if the board already has this firmware")
+    parser.add_argument('--no-skip-erased', action="store_true",
+                        help="Program trailing all-0xFF groups too instead of relying on the erased flash")
+    parser.add_argument('--no-fw-cache', action="store_true", help="Always decode the firmware file, do not use the decoded image cache")  # NOQA
+    parser.add_argument('--prog-window', type=int, default=uploader.PROG_WINDOW,
+                        help="Number of PROG_MULTI/READ_MULTI commands kept in flight while programming, verifying and downloading, 1 for lock-step (default is %u)" % uploader.PROG_WINDOW)  # NOQA
     parser.add_argument('firmware', nargs="?", action="store", default=None, help="Firmware file to be uploaded")
     args = parser.parse_args()
 
     # warn people about ModemManager which interferes badly with Pixhawk
     modemmanager_check()
 
-    if args.firmware is None and not args.identify and not args.erase_extflash:
+    if args.firmware is None and not args.identify and not args.erase_extflash and not args.benchmark_link:
         parser.error("Firmware filename required for upload or download")
         sys.exit(1)
 
     # Load the firmware file
-    if not args.download and not args.identify and not args.erase_extflash:
-        fw = firmware(args.firmware)
+    if not args.download and not args.identify and not args.erase_extflash and not args.benchmark_link:
+        fw = firmware(args.firmware, use_cache=not args.no_fw_cache)
         print(colored("Searching for Cube Orange Plus", 'blue'))
         # print("Loaded firmware for %x,%x, size: %d bytes, waiting for the bootloader..." %
         #       (fw.property('board_id'), fw.property('board_revision'), fw.property('image_size')))
@@ -1156,6 +2285,21 @@ def main():
 
     baud_flightstack = [int(x) for x in args.baud_flightstack.split(',')]
 
+    if args.gang:
+        if args.download or args.identify or args.erase_extflash or args.benchmark_link:
+            parser.error("--gang only supports uploading firmware")
+        try:
+            results = gang_upload(args, fw, baud_flightstack)
+        except KeyboardInterrupt:
+            print("\n Upload aborted by user.")
+            sys.exit(1)
+        if len(results) == 0:
+            sys.exit("\nERROR: no boards found")
+        print_gang_results(results)
+        if args.telemetry:
+            write_gang_telemetry(results, args.telemetry)
+        sys.exit(0 if all(r.success for r in results.values()) else 1)
+
     # Spin waiting for a device to show up
     try:
         while True:
@@ -1175,7 +2319,9 @@ def main():
                                   args.source_system,
                                   args.source_component,
                                   args.no_extf,
-                                  args.force_erase)
+                                  args.force_erase,
+                                  args.prog_window,
+                                  not args.no_skip_erased)
 
                 except Exception as e:
                     if not is_WSL and not is_WSL2 and "win32" not in _platform:
@@ -1186,24 +2332,49 @@ def main():
                     # and loop to the next port
                     continue
 
-                if not find_bootloader(up, port):
+                if args.fast_reboot:
+                    found_port = find_bootloader_fast(up, port, args.port)
+                    if found_port is None:
+                        # Go to the next port
+                        continue
+                    port = found_port
+                    if up.reboot_latency:
+                        print("Bootloader in sync %.2f seconds after reboot" % up.reboot_latency)
+                elif not find_bootloader(up, port):
                     # Go to the next port
                     continue
 
+                result = FlashResult()
+                result.port = port
                 try:
                     # ok, we have a bootloader, try flashing it
                     if args.identify:
-                        up.dump_board_info()
+                        print(up.identity().describe())
+                    elif args.benchmark_link:
+                        bench = up.benchmark_link()
+                        print_link_benchmark(bench)
+                        if args.telemetry:
+                            with open(args.telemetry, 'w') as f:
+                                json.dump(bench, f, indent=4, sort_keys=True)
                     elif args.download:
                         up.download(args.firmware)
                     elif args.erase_extflash:
                         up.erase_extflash('Erase ExtF', args.erase_extflash)
                         print("\nExtF Erase Finished")
                     else:
-                        up.upload(fw, force=args.force, boot_delay=args.boot_delay)
+                        if args.telemetry:
+                            up.ping()
+                        if args.use_async:
+                            result.status = asyncio.run(up.upload_async(fw, force=args.force, boot_delay=args.boot_delay,
+                                                                        skip_identical=args.skip_identical))
+                        else:
+                            result.status = up.upload(fw, force=args.force, boot_delay=args.boot_delay,
+                                                      skip_identical=args.skip_identical)
+                        result.success = True
 
                 except RuntimeError as ex:
                     # print the error and exit as a failure
+                    result.error = str(ex)
                     sys.exit("\nERROR: %s" % ex.args)
 
                 except IOError:
@@ -1213,6 +2384,9 @@ def main():
                 finally:
                     # always close the port
                     up.close()
+                    if args.telemetry and (result.success or result.error is not None):
+                        result.update_from(up)
+                        result.write_telemetry(args.telemetry)
 
                 # we could loop here if we wanted to wait for more boards...
                 sys.exit(0)
@@ -0,0 +1,189 @@
+import collections
+import os
+import select
+import subprocess
+import time
+import uuid
+
+CommandResult = collections.namedtuple('CommandResult', ['code', 'output'])
+
+
+class AdbError(Exception):
+    """The ADB shell could not be (re)connected or a command did not complete."""
+
+
+class AdbTimeout(AdbError):
+    """A command did not finish in time; the shell was closed since it is still busy."""
+
+
+class AdbSession:
+    """One long-lived `adb shell` on a device, shared by all flight computer tests.
+
+    Every command is followed by a unique marker and its exit status on a line
+    of their own, so run() knows exactly where the command's output ends and
+    whether it worked. Commands read stdin from /dev/null, so they can't eat the
+    marker. A command is only sent again after a reconnect if the shell was gone
+    before it was written; one that dies under a command raises AdbError.
+    """
+
+    def __init__(self, serial=None, root=True, retries=3, retry_delay=5):
+        self.serial = serial
+        self.root = root
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.process = None
+        self._buffer = b''
+
+    def _adb(self, *args):
+        return ['adb'] + (['-s', self.serial] if self.serial else []) + list(args)
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def connect(self):
+        self.close()
+        for attempt in range(self.retries):
+            if attempt:
+                time.sleep(self.retry_delay)
+            subprocess.run(self._adb('start-server'), capture_output=True, text=True)
+            if self.root:
+                adb_root = subprocess.run(self._adb('root'), capture_output=True, text=True)
+                stderr = adb_root.stderr.lower()
+                if adb_root.returncode != 0 or 'cannot run as root' in stderr or 'no devices/emulators found' in stderr:
+                    continue
+            self.process = subprocess.Popen(self._adb('shell'), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT, bufsize=0)
+            self._buffer = b''
+            try:
+                self._write("exec 2>&1\n")
+                if self.root and self._execute("id -u", timeout=10).output.strip() != "0":
+                    # adbd didn't come up as root; su reads from the same stdin, so give it
+                    # time to start before anything else is written
+                    self._write("su\n")
+                    time.sleep(1)
+                    if self._execute("id -u", timeout=10).output.strip() != "0":
+                        raise AdbError("su failed")
+                else:
+                    self._execute("true", timeout=10)
+                return
+            except AdbError:
+                self.close()
+        raise AdbError("couldn't establish adb connection")
+
+    def _write(self, text):
+        try:
+            self.process.stdin.write(text.encode())
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError) as e:
+            raise AdbError(f"adb shell is not running: {e}")
+
+    def _readline(self, deadline):
+        """Next output line without its line ending, or None at deadline."""
+        fd = self.process.stdout.fileno()
+        while b'\n' not in self._buffer:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                self.close()
+                raise AdbError("adb shell closed")
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line.decode(errors='replace').rstrip('\r')
+
+    def _send(self, command):
+        """Write command and its end marker; returns the marker."""
+        marker = f"__ADB_DONE_{uuid.uuid4().hex}__"
+        # the newline before the marker ends output that doesn't end in one
+        self._write(f"{{ {command}\n}} </dev/null\nprintf '\\n%s %s\\n' \"{marker}\" \"$?\"\n")
+        return marker
+
+    def _execute(self, command, timeout):
+        return self._collect(command, self._send(command), timeout)
+
+    def _collect(self, command, marker, timeout):
+        deadline = time.time() + timeout
+        output = []
+        while True:
+            line = self._readline(deadline)
+            if line is None:
+                # the shell is still busy with the command; it can't be reused
+                self.close()
+                raise AdbTimeout(f"'{command}' did not complete within {timeout}s")
+            if line.startswith(marker):
+                if output and output[-1] == "":
+                    # the command's own trailing newline
+                    output.pop()
+                return CommandResult(int(line.split()[-1]), "\n".join(output))
+            output.append(line)
+
+    def run(self, command, timeout=10):
+        """Run command in the shell; returns CommandResult(code, output)."""
+        if not self.alive:
+            self.connect()
+        try:
+            marker = self._send(command)
+        except AdbError:
+            # the shell was gone before the command reached it, so sending it again is safe
+            self.connect()
+            marker = self._send(command)
+        return self._collect(command, marker, timeout)
+
+    def wait_for_device(self, timeout=60):
+        """Block until adb sees the device."""
+        try:
+            result = subprocess.run(self._adb('wait-for-device'), capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            raise AdbTimeout(f"no adb device within {timeout}s")
+        if result.returncode != 0:
+            raise AdbError(f"adb wait-for-device failed: {result.stderr.strip()}")
+
+    def push(self, local, remote, timeout=30):
+        """Copy a file to the device with adb push."""
+        try:
+            result = subprocess.run(self._adb('push', local, remote), capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            raise AdbTimeout(f"adb push {local} did not complete within {timeout}s")
+        if result.returncode != 0:
+            raise AdbError(f"adb push {local} failed: {result.stderr.strip() or result.stdout.strip()}")
+
+    def stream(self, command, timeout):
+        """Start command in the background and yield its output lines for up to timeout seconds.
+
+        The command is killed when the caller stops iterating or the timeout passes.
+        """
+        if not self.alive:
+            self.connect()
+        self._write(f"{command} &\n")
+        deadline = time.time() + timeout
+        try:
+            while True:
+                line = self._readline(deadline)
+                if line is None:
+                    return
+                yield line
+        finally:
+            if self.alive:
+                try:
+                    # output still in flight from the command is discarded up to the marker
+                    self._execute("kill $! 2>/dev/null; wait $! 2>/dev/null", timeout=5)
+                except AdbError:
+                    self.close()
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
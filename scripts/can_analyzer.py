@@ -0,0 +1,67 @@
+import re
+
+# candump -ta -e line: "(1697012345.123456)  can0  1E01F4A2   [8]  01 02 ... 08", error frames end in ERRORFRAME
+CANDUMP_LINE = re.compile(
+    r"^\((?P<ts>\d+\.\d+)\)\s+(?P<iface>\S+)\s+(?P<id>[0-9A-F]{3}|[0-9A-F]{8})\s+\[(?P<dlc>\d+)\]"
+    r"(?P<data>(?:\s+[0-9A-F]{2})*)\s*(?P<error>ERRORFRAME)?"
+)
+
+# linux/can/error.h
+CAN_ERR_BUSOFF = 0x00000040
+
+
+class CanStats:
+    """Counters for one CAN line, fed candump -ta -e output a line at a time."""
+
+    def __init__(self):
+        self.frames = 0
+        self.error_frames = 0
+        self.bus_off = 0
+        self.ids = set()
+        self.first_ts = None
+        self.last_ts = None
+
+    def feed(self, line):
+        """Account for one candump line; returns 'frame', 'error' or None."""
+        m = CANDUMP_LINE.match(line.strip())
+        if m is None:
+            return None
+        can_id = int(m.group('id'), 16)
+        if m.group('error'):
+            self.error_frames += 1
+            if can_id & CAN_ERR_BUSOFF:
+                self.bus_off += 1
+            return 'error'
+        ts = float(m.group('ts'))
+        if self.first_ts is None:
+            self.first_ts = ts
+        self.last_ts = ts
+        self.frames += 1
+        self.ids.add(can_id)
+        return 'frame'
+
+    def frames_per_sec(self):
+        if self.frames < 2 or self.last_ts <= self.first_ts:
+            return 0.0
+        return (self.frames - 1) / (self.last_ts - self.first_ts)
+
+    def as_dict(self):
+        return {
+            "frames": self.frames,
+            "frames_per_sec": round(self.frames_per_sec(), 1),
+            "unique_ids": len(self.ids),
+            "error_frames": self.error_frames,
+            "bus_off": self.bus_off,
+        }
+
+
+def analyze(lines, min_frames):
+    """Consume candump lines until min_frames valid frames were seen or lines ends.
+
+    Returns (verdict, stats); the caller bounds lines by its deadline.
+    """
+    stats = CanStats()
+    for line in lines:
+        if stats.feed(line) == 'frame' and stats.frames >= min_frames:
+            return "PASS", stats
+    return "FAIL", stats
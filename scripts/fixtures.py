@@ -0,0 +1,87 @@
+import collections
+import glob
+import json
+import os
+import re
+import subprocess
+
+# One test fixture: a Cube and the flight computer wired to it
+Fixture = collections.namedtuple('Fixture', ['name', 'cube_port', 'adb_serial'])
+
+# USB interface directory in sysfs, e.g. "1-2.1:1.0" (bus 1, port 2 -> hub port 1, config 1, interface 0)
+USB_INTERFACE = re.compile(r'^(\d+-[\d.]+):\d+\.\d+$')
+
+
+def usb_port_path(tty_device):
+    """USB port path ("1-2.1") a serial device is plugged into, or None."""
+    name = os.path.basename(os.path.realpath(tty_device))
+    path = os.path.realpath(f"/sys/class/tty/{name}/device")
+    while path not in ('/', ''):
+        m = USB_INTERFACE.match(os.path.basename(path))
+        if m:
+            return m.group(1)
+        path = os.path.dirname(path)
+    return None
+
+
+def hub_of(port_path):
+    """The hub a USB port path hangs off: "1-2.1" -> "1-2"."""
+    if '.' in port_path:
+        return port_path.rsplit('.', 1)[0]
+    return port_path.split('-', 1)[0]
+
+
+def stable_port(by_id):
+    """The /dev/serial/by-path link of a Cube, which, unlike by-id, survives the bootloader re-enumeration."""
+    target = os.path.realpath(by_id)
+    for path in sorted(glob.glob('/dev/serial/by-path/*')):
+        if os.path.realpath(path) == target:
+            return path
+    return by_id
+
+
+def cube_ports():
+    # the Cube's first interface carries MAVLink; the second one is SLCAN
+    return sorted(glob.glob('/dev/serial/by-id/*Cube*-if00'))
+
+
+def adb_devices():
+    """{serial: USB port path} of the flight computers adb sees."""
+    result = subprocess.run(['adb', 'devices', '-l'], capture_output=True, text=True)
+    devices = {}
+    for line in result.stdout.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) < 2 or fields[1] != 'device':
+            continue
+        usb = [field[len('usb:'):] for field in fields if field.startswith('usb:')]
+        if usb:
+            devices[fields[0]] = usb[0]
+    return devices
+
+
+def discover():
+    """Pair every Cube with the flight computer on the same USB hub.
+
+    Returns (fixtures, problems); a Cube without exactly one flight computer on its
+    hub is reported in problems rather than guessed.
+    """
+    adb = adb_devices()
+    fixtures, problems = [], []
+    for by_id in cube_ports():
+        port = usb_port_path(by_id)
+        if port is None:
+            problems.append(f"{by_id}: not a USB device")
+            continue
+        hub = hub_of(port)
+        serials = sorted(serial for serial, path in adb.items() if hub_of(path) == hub)
+        if len(serials) != 1:
+            problems.append(f"{by_id} on hub {hub}: {len(serials)} flight computers on the same hub")
+            continue
+        fixtures.append(Fixture(hub, stable_port(by_id), serials[0]))
+    return fixtures, problems
+
+
+def load(path):
+    """Fixtures listed in a JSON file: [{"name": ..., "cube_port": ..., "adb_serial": ...}, ...]."""
+    with open(path) as f:
+        return [Fixture(entry['name'], entry['cube_port'], entry['adb_serial']) for entry in json.load(f)]
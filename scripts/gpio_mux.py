@@ -0,0 +1,67 @@
+GPIO_ROOT = "/sys/class/gpio"
+
+# Select lines of the fixture's muxes and the value of each line per named position
+MUX_POSITIONS = {
+    # serial mux: routes Serial 1/3/4/5 of the Cube to /dev/ttyHS2
+    "serial1": {442: 0, 464: 0},
+    "serial3": {442: 0, 464: 1},
+    "serial4": {442: 1, 464: 0},
+    "serial5": {442: 1, 464: 1},
+    # CAN mux: routes CAN 1/2 of the Cube to can0
+    "can1": {370: 1, 371: 1},
+    "can2": {370: 0, 371: 0},
+}
+
+
+class MuxError(Exception):
+    """A mux transition failed or a select line did not read back as written."""
+
+
+class GpioMux:
+    """Drives the fixture's mux select lines over an AdbSession.
+
+    Exported pins and their last confirmed values are cached, so a transition
+    only writes the lines that change, in one shell round-trip that also reads
+    them back.
+    """
+
+    def __init__(self, adb, positions=MUX_POSITIONS):
+        self.adb = adb
+        self.positions = positions
+        self._exported = set()
+        self._values = {}
+
+    def reset(self):
+        """Forget cached state, e.g. after the flight computer rebooted."""
+        self._exported.clear()
+        self._values.clear()
+
+    def select(self, name):
+        """Switch the mux to a named position."""
+        if name not in self.positions:
+            raise MuxError(f"unknown mux position {name!r}")
+        self.write(self.positions[name])
+
+    def write(self, values):
+        changes = {pin: value for pin, value in values.items() if self._values.get(pin) != value}
+        if not changes:
+            return
+        commands = []
+        for pin, value in changes.items():
+            path = f"{GPIO_ROOT}/gpio{pin}"
+            if pin not in self._exported:
+                commands.append(f"[ -d {path} ] || echo {pin} > {GPIO_ROOT}/export")
+                commands.append(f"echo out > {path}/direction")
+            commands.append(f"echo {value} > {path}/value")
+        commands.append("cat " + " ".join(f"{GPIO_ROOT}/gpio{pin}/value" for pin in changes))
+        result = self.adb.run("; ".join(commands))
+
+        readback = result.output.split()[-len(changes):]
+        if result.code != 0 or readback != [str(value) for value in changes.values()]:
+            for pin in changes:
+                self._exported.discard(pin)
+                self._values.pop(pin, None)
+            raise MuxError(f"GPIO {', '.join(map(str, changes))}: wrote {list(changes.values())}, "
+                           f"read back {result.output!r}")
+        self._exported.update(changes)
+        self._values.update(changes)
@@ -1,15 +1,16 @@
 import subprocess
-import threading
+import sys
 import serial.tools.list_ports
 import os
 import datetime
+import fcntl
+import functools
 import time
 import json
-import re
-import select
+import multiprocessing
+import threading
 from colorama import init, Fore, Style
 from pymavlink import mavutil
-from pynput.keyboard import Controller
 from tabulate import tabulate
 import signal
 
@@ -30,78 +31,269 @@ FIRMWARE_DIR = os.path.join(BASE_DIR, 'firmware')
 IMAGES_DIR = os.path.join(BASE_DIR, 'images')
 SCRIPTS_DIR = os.path.join(BASE_DIR, 'scripts')
 REPORT_SCRIPT_PATH = os.path.join(SCRIPTS_DIR, 'generate_reports.py')
+PROBE_SCRIPT_PATH = os.path.join(SCRIPTS_DIR, 'mavlink_probe.py')
+PROBE_REMOTE_PATH = "/tmp/mavlink_probe.py"
 CUBE_IMAGE_PATH = os.path.join(IMAGES_DIR, 'cube.jpg')
 
 FIRMWARE_TEST_PATH = os.path.join(FIRMWARE_DIR, "ArducopterTest4.6.0-dev_images/arducopter.apj")
 FIRMWARE_FINAL_PATH = os.path.join(FIRMWARE_DIR, "ArducopterFinal4.5.2_images/arducopter.apj")
-UPLOADER_SCRIPT_PATH = os.path.join(FIRMWARE_DIR, "uploader.py")
+
+# QR code -> MCU serial number of every board seen by this station
+PAIRING_FILE = os.path.join(PRODUCTION_TEST_FOLDER, "board_pairing.json")
+
+# flash in-process through the uploader's library API
+sys.path.insert(0, FIRMWARE_DIR)
+import uploader  # noqa: E402
+from mavlink_session import MavlinkSession, STATUSTEXT, statustext_line  # noqa: E402
+import telemetry_rules  # noqa: E402
+from adb_session import AdbSession, AdbError  # noqa: E402
+from gpio_mux import GpioMux, MuxError  # noqa: E402
+import can_analyzer  # noqa: E402
+from stage_scheduler import Stage, run_stages  # noqa: E402
+import fixtures  # noqa: E402
+
+# root shells on the flight computer, one per stage lane so lanes can run concurrently
+# (an AdbSession is not thread-safe): the ttyHS2 serial mux, Serial 2 on ttyHS1, and CAN
+ADB = AdbSession()
+ADB_SERIAL_2 = AdbSession()
+ADB_CAN = AdbSession()
+# serial and CAN mux select lines on the fixture, each driven through its lane's shell
+MUX = GpioMux(ADB)
+CAN_MUX = GpioMux(ADB_CAN)
+probe_pushed = False
+can_configured = False
+
+# resources stages hold exclusively while they run
+CONSOLE = "operator console"
+MAVLINK_PORT = "host MAVLink port"
+TTYHS1 = "ttyHS1"
+TTYHS2_MUX = "ttyHS2 serial mux"
+CAN_MUX_LINES = "CAN mux"
+
+# a CAN line passes once this many valid frames arrive within CAN_TIMEOUT seconds
+CAN_MIN_FRAMES = 5
+CAN_TIMEOUT = 5
+
+# pass/fail limits and message patterns of the STATUSTEXT-reported components
+TELEMETRY_RULES_PATH = os.getenv('TELEMETRY_RULES', os.path.join(SCRIPTS_DIR, 'telemetry_rules.json'))
+RULES = telemetry_rules.load(TELEMETRY_RULES_PATH)
+
+# set in a fixture worker: the Cube's port and the shared operator console (lock, stdin fd, output, fixture name)
+cube_port = None
+console = None
+# fixtures driven by option 6; discovered by USB hub when this file doesn't exist
+FIXTURES_FILE = os.getenv('FIXTURES_FILE', os.path.join(PRODUCTION_TEST_FOLDER, 'fixtures.json'))
+
+# upper bound in seconds on a reboot or flash, from the reboot request until the autopilot is up
+READY_TIMEOUT = float(os.getenv('READY_TIMEOUT', '60'))
+# allowance for the SYSTEM_TIME round trip when telling the new boot from the old one
+BOOT_SLACK = 1.0
+
+# board_id/name index of the station's firmware images, persisted by the uploader
+BOARDS = uploader.BoardRegistry(apj_paths=[FIRMWARE_TEST_PATH, FIRMWARE_FINAL_PATH])
 
 def find_cube_orange_port():
+    if cube_port is not None:
+        # this process drives one fixture of several; the port may be missing while the board reboots
+        return cube_port if os.path.exists(cube_port) else None
     ports = serial.tools.list_ports.comports()
     for port in sorted(ports):
         if "ttyUSB" in port.device or "ttyACM" in port.device:
             return port.device
     return None
 
+# the one MAVLink connection to the board, shared by every test; concurrent
+# stages (re)connect it under the lock so only one of them opens the port
+mavlink_session = None
+session_lock = threading.RLock()
+
+def get_session(timeout=30):
+    """The open MAVLink session to the Cube, (re)connecting after a flash or reboot."""
+    global mavlink_session
+    with session_lock:
+        if mavlink_session is not None and not mavlink_session.closed.is_set():
+            return mavlink_session
+        close_session()
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            port = find_cube_orange_port()
+            if port is None:
+                time.sleep(0.5)
+                continue
+            try:
+                session = MavlinkSession(port)
+            except Exception:
+                time.sleep(0.5)
+                continue
+            if session.wait_heartbeat(timeout=max(0.1, deadline - time.time())) is not None:
+                mavlink_session = session
+                return session
+            session.close()
+        return None
+
+def close_session():
+    """Release the serial port, e.g. before the uploader needs it."""
+    global mavlink_session
+    with session_lock:
+        if mavlink_session is not None:
+            mavlink_session.close()
+            mavlink_session = None
+
+def wait_until_ready(since, booted_after=None, timeout=READY_TIMEOUT):
+    """Wait for the Cube to come back up after a reboot requested at time.time() == since.
+
+    Watches its USB serial device go away and come back, then waits for a MAVLink
+    session whose uptime shows it booted after booted_after (default since) and
+    an autopilot past initialisation. Returns {event: seconds after since} for
+    usb_gone, usb_back, heartbeat and ready; ready is missing if the board was
+    not up within timeout seconds.
+    """
+    if booted_after is None:
+        booted_after = since
+    close_session()
+    deadline = since + timeout
+    events = {}
+    while time.time() < deadline:
+        if find_cube_orange_port() is None:
+            events.setdefault("usb_gone", time.time() - since)
+            time.sleep(0.1)
+            continue
+        if "usb_gone" in events:
+            events.setdefault("usb_back", time.time() - since)
+        session = get_session(timeout=max(0.1, deadline - time.time()))
+        if session is None:
+            break
+        uptime = session.uptime(timeout=min(2.0, max(0.1, deadline - time.time())))
+        if uptime is None:
+            # no SYSTEM_TIME answer: only trust the session if the board was seen going away
+            fresh = "usb_gone" in events
+        else:
+            fresh = uptime <= time.time() - booted_after + BOOT_SLACK
+        if not fresh:
+            close_session()
+            time.sleep(0.2)
+            continue
+        events.setdefault("heartbeat", time.time() - since)
+        if session.wait_ready(max(0.0, deadline - time.time())) is not None:
+            events["ready"] = time.time() - since
+            break
+    return {event: round(seconds, 2) for event, seconds in events.items()}
+
+def print_boot(events):
+    if "ready" not in events:
+        print(f"{Fore.RED}Flight controller not up within {READY_TIMEOUT:.0f}s of the reboot.{Style.RESET_ALL}")
+        return
+    steps = ", ".join(f"{event} {seconds:.1f}s" for event, seconds in events.items() if event != "ready")
+    print(f"{Fore.CYAN}Flight controller up {events['ready']:.1f}s after the reboot ({steps}).{Style.RESET_ALL}")
+
 def reboot_flight_controller():
-    port = find_cube_orange_port()
-    if port is None:
+    session = get_session()
+    if session is None:
         print(f"{Fore.RED}Cube Orange Plus not found. Please check the connection.{Style.RESET_ALL}")
         return False
-    
+
     try:
-        mavlink_connection = mavutil.mavlink_connection(port, baud=115200)
-        mavlink_connection.wait_heartbeat()
         print(f"{Fore.CYAN}Heartbeat received from the flight controller.{Style.RESET_ALL}")
-        
-        mavlink_connection.mav.command_long_send(
-            mavlink_connection.target_system, 
-            mavlink_connection.target_component,
-            mavutil.mavlink.MAV_CMD_PREFLIGHT_REBOOT_SHUTDOWN,
-            0,  # Confirmation
-            1,  # Param1 (1 for reboot, 0 for shutdown)
-            0, 0, 0, 0, 0, 0
-        )
+        since = time.time()
+        session.reboot()
         print(f"{Fore.CYAN}Reboot command sent to the flight controller.{Style.RESET_ALL}")
-        mavlink_connection.close()
-        time.sleep(15)  # Wait for reboot to complete
-        return True
+        events = wait_until_ready(since)
+        print_boot(events)
+        return "ready" in events
     except Exception as e:
         print(f"{Fore.RED}An error occurred: {e}{Style.RESET_ALL}")
         return False
 
-def load_firmware(firmware_path, firmware_type):
+def running_board_id(timeout=3):
+    """board_id of the firmware running on the Cube, None without firmware or an answer."""
+    session = get_session(timeout=timeout)
+    if session is None:
+        return None
+    message = session.autopilot_version(timeout=timeout)
+    if message is None or message.board_version == 0:
+        return None
+    # ArduPilot puts APJ_BOARD_ID in the upper 16 bits
+    return message.board_version >> 16
+
+def load_firmware(firmware_path, firmware_type, log_dir=PRODUCTION_TEST_FOLDER):
+    fw_board_id = BOARDS.apj_board_id(firmware_path)
+    # the uploader is run with force=True, so the image is checked against the board here
+    board_id = running_board_id()
+    if board_id is not None and fw_board_id is not None and os.path.realpath(firmware_path) not in BOARDS.firmware_for(board_id):
+        images = ", ".join(os.path.relpath(path, FIRMWARE_DIR) for path in BOARDS.firmware_for(board_id)) or "none"
+        print(f"{Fore.RED}Board reports board_id {board_id} ({BOARDS.name(board_id)}), {firmware_type} firmware is built for "
+              f"board_id {fw_board_id}; not flashing. Images for this board: {images}.{Style.RESET_ALL}")
+        return None
+    # the uploader needs the port to itself
+    close_session()
+    print(f"\n\n{Fore.CYAN}Loading {firmware_type} firmware for {BOARDS.name(fw_board_id)} (board_id {fw_board_id})...{Style.RESET_ALL}\n")
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    telemetry_path = os.path.join(log_dir, f"flash_{firmware_type.lower()}_{timestamp}.json")
+    flash_started = time.time()
+    result = uploader.flash(firmware_path, port=cube_port, force=True, skip_identical=True, fast_reboot=True, telemetry=telemetry_path,
+                            use_async=True)
+    if not result.success:
+        print(f"{Fore.RED}Error loading firmware: {result.error}{Style.RESET_ALL}")
+        return result
+    if fw_board_id is not None and not BOARDS.accepts(result.board_type, fw_board_id):
+        print(f"{Fore.RED}Warning: board reports board_id {result.board_type} ({BOARDS.name(result.board_type)}), "
+              f"{firmware_type} firmware is built for board_id {fw_board_id}.{Style.RESET_ALL}")
+    events = wait_until_ready(time.time(), booted_after=flash_started)
+    print_boot(events)
+    if "ready" in events:
+        result.phases["boot"] = events["ready"]
+    result.write_telemetry(telemetry_path)
+    phases = ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in result.phases.items())
+    print(f"\n{Fore.GREEN}{firmware_type} Firmware loaded ({result.status}; {phases}).{Style.RESET_ALL}\n")
+    rtt = uploader.rtt_summary(result.rtt)
+    if rtt is not None:
+        print(f"{Fore.CYAN}USB round trip: median {rtt['median_ms']:.2f} ms, p95 {rtt['p95_ms']:.2f} ms; telemetry in {telemetry_path}{Style.RESET_ALL}")
+    return result
+
+def check_board_pairing(qr_code, result):
+    if result is None or result.serial is None:
+        return None
+    # fixture workers share the pairing file
+    with open(PAIRING_FILE + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return update_board_pairing(qr_code, result)
+
+def update_board_pairing(qr_code, result):
     try:
-        print(f"\n\n{Fore.CYAN}Loading {firmware_type} firmware...{Style.RESET_ALL}\n")
-        subprocess.run([UPLOADER_SCRIPT_PATH, "--force", firmware_path], check=True, cwd=FIRMWARE_DIR)
-        time.sleep(12)
-        print(f"\n{Fore.GREEN}{firmware_type} Firmware loaded.{Style.RESET_ALL}\n")
-    except subprocess.CalledProcessError as e:
-        print(f"{Fore.RED}Error loading firmware: {e}{Style.RESET_ALL}")
+        with open(PAIRING_FILE) as f:
+            pairs = json.load(f)
+    except (OSError, ValueError):
+        pairs = {}
+
+    known_serial = pairs.get(qr_code)
+    if known_serial is not None and known_serial != result.serial:
+        print(f"{Fore.RED}QR code {qr_code} was paired with MCU serial {known_serial}, but this board reports {result.serial}.{Style.RESET_ALL}")
+        return False
+    other_qr = [qr for qr, serial in pairs.items() if serial == result.serial and qr != qr_code]
+    if other_qr:
+        print(f"{Fore.RED}MCU serial {result.serial} is already paired with QR code {other_qr[0]}, not {qr_code}.{Style.RESET_ALL}")
+        return False
+
+    if known_serial is None:
+        pairs[qr_code] = result.serial
+        with open(PAIRING_FILE, "w") as f:
+            json.dump(pairs, f, indent=4, sort_keys=True)
+        print(f"{Fore.CYAN}Paired QR code {qr_code} with MCU serial {result.serial}.{Style.RESET_ALL}")
+    else:
+        print(f"{Fore.GREEN}QR code {qr_code} matches MCU serial {result.serial}.{Style.RESET_ALL}")
+    return True
 
 def get_firmware_version():
-    port = find_cube_orange_port()
-    if not port:
+    print(f"{Fore.CYAN}Searching for Firmware...{Style.RESET_ALL}")
+    session = get_session(timeout=5)
+    if session is None:
         return f"{Fore.RED}Cube Orange Plus not found. Please check the connection.{Style.RESET_ALL}"
 
     try:
-        master = mavutil.mavlink_connection(port, baud=115200)
-        print(f"{Fore.CYAN}Searching for Firmware...{Style.RESET_ALL}")
-        master.wait_heartbeat(timeout=5)
-
-        master.mav.command_long_send(
-            master.target_system,
-            master.target_component,
-            mavutil.mavlink.MAV_CMD_REQUEST_MESSAGE,
-            0,
-            mavutil.mavlink.MAVLINK_MSG_ID_AUTOPILOT_VERSION,
-            0, 0, 0, 0, 0, 0
-        )
-
-        message = master.recv_match(type='AUTOPILOT_VERSION', blocking=True, timeout=10)
+        message = session.autopilot_version(timeout=10)
         if message:
             firmware_version = decode_flight_sw_version(message.flight_sw_version)
-            vehicle_type = get_vehicle_type(master)
+            vehicle_type = get_vehicle_type(session)
             return f"{Fore.CYAN}Vehicle: {vehicle_type}, Firmware version: {firmware_version}{Style.RESET_ALL}"
         else:
             return f"{Fore.RED}Firmware not found Flashed, \nFlashing...{Style.RESET_ALL}"
@@ -125,9 +317,8 @@ def decode_flight_sw_version(flight_sw_version):
 
     return f"{fw_type}-{major}.{minor}.{patch}"
 
-def get_vehicle_type(master):
-    master.wait_heartbeat()
-    vehicle_type = master.messages['HEARTBEAT'].type
+def get_vehicle_type(session):
+    vehicle_type = session.wait_heartbeat().type
     vehicle_dict = {
         mavutil.mavlink.MAV_TYPE_FIXED_WING: "Plane",
         mavutil.mavlink.MAV_TYPE_QUADROTOR: "Copter",
@@ -137,68 +328,22 @@ def get_vehicle_type(master):
     }
     return vehicle_dict.get(vehicle_type, "Unknown")
 
-def connect_mavproxy(port):
-    mavproxy_command = f"mavproxy.py --master={port} --baudrate=921600 --aircraft MyCopter"
-    mavproxy_process = subprocess.Popen(mavproxy_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, bufsize=1)
-    return mavproxy_process
-
-def read_output(process, component_status, log_file_path, finished_event, parse_function, timeout=10):
-    try:
-        with open(log_file_path, 'w') as log_file:
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                line = process.stdout.readline()
-                if not line:
-                    break
-
-                log_file.write(line)
-                log_file.flush()
-                parse_function(line.strip(), component_status)
-    except Exception as e:
-        print(f"{Fore.RED}Error reading output: {e}{Style.RESET_ALL}")
-    finally:
-        finished_event.set()
-
-def parse_i2c_output(line, component_status):
-    if "AP: I2C1 GPS1:" in line:
-        status = "FAIL" if "ERROR" in line else "PASS"
-        update_status("I2C1 GPS1", status, component_status)
-    elif "AP: I2C0 GPS2:" in line:
-        status = "FAIL" if "ERROR" in line else "PASS"
-        update_status("I2C0 GPS2", status, component_status)
-    elif "AP: I2C2 PORT:" in line:
-        status = "FAIL" if "ERROR" in line else "PASS"
-        update_status("I2C2 PORT", status, component_status)
-
-def parse_psense_output(line, component_status):
-    if "AP: Psense Voltage:" in line:
-        value = float(line.split()[-2])
-        status = "PASS" if value > 5.0 else "FAIL"
-        update_status("Psense Voltage", status, component_status)
-    elif "AP: Psense Current:" in line:
-        value = float(line.split()[-2])
-        status = "PASS" if value > 2.0 else "FAIL"
-        update_status("Psense Current", status, component_status)
-    evaluate_psense_overall(component_status)
-
-def parse_adc_output(line, component_status):
-    if "AP: Rangefinder Distance:" in line:
-        value = float(line.split()[-2])
-        status = "PASS" if value > 11.5 else "FAIL"
-        update_status("ADC", status, component_status)
-
-def update_status(component, status, component_status):
-    if component_status.get(component) != status or component not in component_status:
-        component_status[component] = status
-        if "PSENSE" in component or "Voltage" in component or "Current" in component:
-            evaluate_psense_overall(component_status)
-
-def evaluate_psense_overall(component_status):
-    components = ["Psense Voltage", "Psense Current"]
-    if all(c in component_status for c in components):
-        overall = "PASS" if all(component_status[c] == "PASS" for c in components) else "FAIL"
-        if component_status.get("PSENSE Overall") != overall:
-            component_status["PSENSE Overall"] = overall
+def listen_statustext(session, component_status, log_file_path, parse_function, timeout=10, done=None, mode='w'):
+    """Feed STATUSTEXT lines to parse_function for up to timeout seconds; False if none arrived.
+
+    If done is given, the window closes as soon as done(component_status) is true.
+    """
+    received = False
+    with session.subscribe(STATUSTEXT) as subscription, open(log_file_path, mode) as log_file:
+        for msg in subscription.messages(timeout):
+            line = statustext_line(msg)
+            log_file.write(line + "\n")
+            log_file.flush()
+            parse_function(line, component_status)
+            received = True
+            if done is not None and done(component_status):
+                break
+    return received
 
 def print_status(status_dict):
     table = []
@@ -207,168 +352,83 @@ def print_status(status_dict):
         table.append([component, f"{color}{condition}{Style.RESET_ALL}"])
     print(tabulate(table, headers=["Test Cases", "Status"], tablefmt="grid"))
 
-def adb_connection():
-    retries = 3
-    for _ in range(retries):
-        subprocess.run(['adb', 'start-server'], capture_output=True, text=True)
-        adb_root = subprocess.run(['adb', 'root'], capture_output=True, text=True)
-        if adb_root.returncode == 0 and 'cannot run as root' not in adb_root.stderr.lower() and 'no devices/emulators found' not in adb_root.stderr.lower():
-            adb_shell = subprocess.Popen(['adb', 'shell'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1)
-            adb_shell.stdin.write("su\n")
-            adb_shell.stdin.flush()
-            time.sleep(1)
-            return adb_shell
-        time.sleep(5)
-    print(f"{Fore.RED}Couldn't Establish adb connection, please check.{Style.RESET_ALL}")
-    return None
+def push_probe(adb):
+    """Copy the HEARTBEAT probe to the flight computer once per run."""
+    global probe_pushed
+    if not probe_pushed:
+        adb.push(PROBE_SCRIPT_PATH, PROBE_REMOTE_PATH)
+        probe_pushed = True
+
+def detect_vehicle(adb, device, timeout):
+    push_probe(adb)
+    result = adb.run(f"python3 {PROBE_REMOTE_PATH} {device} --baud 921600 --timeout {timeout}", timeout=timeout + 5)
+    if result.code == 0:
+        return "PASS"
+    print(f"{Fore.RED}{result.output}{Style.RESET_ALL}")
+    return "FAIL"
 
-def configure_gpio(adb_shell, gpio, value):
-    try:
-        if adb_shell.poll() is not None:
-            raise BrokenPipeError("adb shell process is not running.")
-        
-        # Check if the GPIO is already exported
-        check_export_cmd = f"[ -d /sys/class/gpio/gpio{gpio} ] || echo {gpio} > /sys/class/gpio/export\n"
-        adb_shell.stdin.write(check_export_cmd)
-        adb_shell.stdin.flush()
-        
-        direction_cmd = f"echo out > /sys/class/gpio/gpio{gpio}/direction; echo {value} > /sys/class/gpio/gpio{gpio}/value\n"
-        adb_shell.stdin.write(direction_cmd)
-        adb_shell.stdin.flush()
-    except BrokenPipeError as e:
-        print(f"{Fore.RED}BrokenPipeError: {e}{Style.RESET_ALL}")
-        adb_shell = adb_connection()  # Reconnect to adb shell
-        if adb_shell:
-            adb_shell.stdin.write(check_export_cmd)
-            adb_shell.stdin.flush()
-            adb_shell.stdin.write(direction_cmd)
-            adb_shell.stdin.flush()
-        else:
-            print(f"{Fore.RED}Failed to reconnect adb shell process. Ensure the adb connection is stable and the device is properly connected.\n Ending test.{Style.RESET_ALL}")
-    except Exception as e:
-        print(f"{Fore.RED}An error occurred while configuring GPIO {gpio}: {e}{Style.RESET_ALL}")
+def test_serial_2(adb):
+    return detect_vehicle(adb, "/dev/ttyHS1", timeout=5)
 
-def test_serial_2():
+def integrate_serial_2_test(component_status, adb=ADB_SERIAL_2):
     try:
-        adb_shell = adb_connection()
-        if not adb_shell:
-            return "FAIL"
-
-        mav_command = "mavproxy.py --master=/dev/ttyHS1 --baudrate=921600 --aircraft MyCopter\n"
-        adb_shell.stdin.write(mav_command)
-        adb_shell.stdin.flush()
-
-        while True:
-            output = adb_shell.stdout.readline()
-            if "Detected vehicle" in output:
-                adb_shell.terminate()
-                return "PASS"
-            elif "link 1 down" in output or not output:
-                adb_shell.terminate()
-                return "FAIL"
-
-    except subprocess.SubprocessError as e:
+        status = test_serial_2(adb)
+    except AdbError as e:
         print(f"{Fore.RED}An error occurred during the Serial 2 test: {e}{Style.RESET_ALL}")
-        return "FAIL"
-
-def integrate_serial_2_test(component_status):
-    status = test_serial_2()
+        status = "FAIL"
     component_status["Serial 2"] = status
 
-def test_serial_line(adb_shell, gpio1, gpio2, serial_number):
-    configure_gpio(adb_shell, 442, gpio1)
-    configure_gpio(adb_shell, 464, gpio2)
-    
-    mav_command = "mavproxy.py --master=/dev/ttyHS2 --baudrate=921600 --aircraft MyCopter\n"
-    try:
-        adb_shell.stdin.write(mav_command)
-        adb_shell.stdin.flush()
+def test_serial_line(adb, serial_number):
+    MUX.select(f"serial{serial_number}")
+    return detect_vehicle(adb, "/dev/ttyHS2", timeout=5)
 
-        start_time = time.time()
-        while time.time() - start_time < 10:
-            output = adb_shell.stdout.readline()
-            if "Detected vehicle" in output:
-                return "PASS"
-            elif "link 1 down" in output or not output:
-                return "FAIL"
-    except BrokenPipeError as e:
-        print(f"{Fore.RED}BrokenPipeError: {e}{Style.RESET_ALL}")
-        adb_shell = adb_connection()  # Reconnect to adb shell
-        if adb_shell:
-            adb_shell.stdin.write(mav_command)
-            adb_shell.stdin.flush()
-        else:
-            print(f"{Fore.RED}Failed to reconnect adb shell process. Ensure the adb connection is stable and the device is properly connected and configured. Ending test.{Style.RESET_ALL}")
-            return "FAIL"
-    except Exception as e:
-        print(f"{Fore.RED}An error occurred during the Serial {serial_number} test: {e}{Style.RESET_ALL}")
-        return "FAIL"
-    
-def integrate_serial_test(component_status, line_number, line_config):
-    adb_shell = adb_connection()
-    if adb_shell:
-        status = test_serial_line(adb_shell, line_config[0], line_config[1], line_number)
-        component_status[f"Serial {line_number}"] = status
-        adb_shell.terminate()
-    else:
-        component_status[f"Serial {line_number}"] = "FAIL"
-
-def setup_can_interface(adb_shell):
-    setup_cmds = "ifconfig can0 down; ip link set can0 type can bitrate 1000000; ifconfig can0 up; ifconfig can0 txqueuelen 1000;\n"
-    adb_shell.stdin.write(setup_cmds)
-    adb_shell.stdin.flush()
-
-def configure_can_gpio(adb_shell, gpio_a, gpio_b):
+def integrate_serial_test(component_status, line_number):
     try:
-        if adb_shell.poll() is not None:
-            raise BrokenPipeError("adb shell process is not running.")
-        
-        for gpio in [370, 371]:
-            check_export_cmd = f"[ -d /sys/class/gpio/gpio{gpio} ] || echo {gpio} > /sys/class/gpio/export\n"
-            adb_shell.stdin.write(check_export_cmd)
-            adb_shell.stdin.flush()
-            
-            adb_shell.stdin.write(f"echo out > /sys/class/gpio/gpio{gpio}/direction; echo {gpio_a} > /sys/class/gpio/gpio{gpio}/value\n")
-            adb_shell.stdin.write(f"echo out > /sys/class/gpio/gpio{gpio}/direction; echo {gpio_b} > /sys/class/gpio/gpio{gpio}/value\n")
-            adb_shell.stdin.flush()
-    except Exception as e:
-        print(f"{Fore.RED}An error occurred while configuring CAN GPIO {gpio}: {e}{Style.RESET_ALL}")
-
-def test_can_line(adb_shell, can_number, gpio_a, gpio_b):
-    configure_can_gpio(adb_shell, gpio_a, gpio_b)
-    adb_shell.stdin.write("candump can0\n")
-    adb_shell.stdin.flush()
-
-    start_time = time.time()
-    timeout = 5
-    pattern = re.compile(r"can0\s+[0-9A-F]{3}[0-9A-F]{5}\s+\[\d\]\s+([0-9A-F]{2}\s+){1,8}")
-
-    valid_packets = []
-
-    while time.time() - start_time < timeout:
-        ready = select.select([adb_shell.stdout], [], [], 0.1)
-        if ready[0]:
-            line = adb_shell.stdout.readline()
-            if pattern.match(line.strip()):
-                valid_packets.append(line.strip())
-                return "PASS"
-
-    return "FAIL"
+        status = test_serial_line(ADB, line_number)
+    except (AdbError, MuxError) as e:
+        print(f"{Fore.RED}An error occurred during the Serial {line_number} test: {e}{Style.RESET_ALL}")
+        status = "FAIL"
+    component_status[f"Serial {line_number}"] = status
+
+def setup_can_interface(adb):
+    """Bring can0 up at 1 Mbit/s; done once, the mux only switches the line behind it."""
+    global can_configured
+    if can_configured:
+        return
+    result = adb.run("ifconfig can0 down; ip link set can0 type can bitrate 1000000; ifconfig can0 up; ifconfig can0 txqueuelen 1000")
+    if result.code != 0:
+        print(f"{Fore.RED}An error occurred while setting up can0: {result.output}{Style.RESET_ALL}")
+        return
+    can_configured = True
 
-def integrate_can_test(component_status, can_number, gpio_a, gpio_b):
-    adb_shell = adb_connection()
-    if adb_shell:
-        setup_can_interface(adb_shell)
-        status = test_can_line(adb_shell, can_number, gpio_a, gpio_b)
-        component_status[f"CAN {can_number}"] = status
-        adb_shell.terminate()
-    else:
-        component_status[f"CAN {can_number}"] = "FAIL"
+def test_can_line(adb, can_number, min_frames=CAN_MIN_FRAMES, timeout=CAN_TIMEOUT):
+    """PASS once min_frames valid frames arrive within timeout; returns (status, stats)."""
+    CAN_MUX.select(f"can{can_number}")
+    lines = adb.stream("candump -ta -e can0", timeout)
+    try:
+        return can_analyzer.analyze(lines, min_frames)
+    finally:
+        lines.close()
 
-def generate_test_result_json(component_status, qr_code, logs_dir, final_firmware_version):
+def integrate_can_test(component_status, can_number, measurements=None):
+    try:
+        setup_can_interface(ADB_CAN)
+        status, stats = test_can_line(ADB_CAN, can_number)
+        print(f"CAN {can_number}: {stats.frames} frames, {stats.frames_per_sec():.1f} frames/s, {len(stats.ids)} IDs, "
+              f"{stats.error_frames} error frames, {stats.bus_off} bus-off")
+        if measurements is not None:
+            measurements[f"CAN {can_number}"] = stats.as_dict()
+    except (AdbError, MuxError) as e:
+        print(f"{Fore.RED}An error occurred during the CAN {can_number} test: {e}{Style.RESET_ALL}")
+        status = "FAIL"
+    component_status[f"CAN {can_number}"] = status
+
+def generate_test_result_json(component_status, qr_code, logs_dir, final_firmware_version, measurements=None):
     test_results = {"qr_code": qr_code, "final_firmware_version": final_firmware_version, "test_results": []}
     for component, status in component_status.items():
         test_results["test_results"].append({"step_description": component, "step_status": status})
+    if measurements:
+        test_results["measurements"] = measurements
     
     json_path = os.path.join(logs_dir, "test_results.json")
     with open(json_path, "w") as json_file:
@@ -383,17 +443,29 @@ def generate_reports(json_path):
     except subprocess.CalledProcessError as e:
         print(f"{Fore.RED}An error occurred while executing the report generation script: {e}{Style.RESET_ALL}")
 
-def test_pwm_outputs(master):
+def prompt(text):
+    """input(), or in a fixture worker, a question on the shared console labelled with the fixture."""
+    if console is None:
+        return input(text)
+    lock, stdin_fd, console_out, name = console
+    with lock:
+        console_out.write(f"[{name}] {text}")
+        console_out.flush()
+        # byte at a time, so no worker buffers input meant for another one
+        line = b""
+        while not line.endswith(b"\n"):
+            char = os.read(stdin_fd, 1)
+            if not char:
+                break
+            line += char
+        return line.decode(errors="replace").rstrip("\r\n")
+
+def test_pwm_outputs(session):
     print(f"\n{Fore.CYAN}1. Running PWM AUX and MAIN Out Tests, Observe LEDs on Testjig...{Style.RESET_ALL}\n")
     def set_servo_function(servo, function):
-        master.mav.param_set_send(
-            master.target_system,
-            master.target_component,
-            f'SERVO{servo}_FUNCTION'.encode('utf-8'),
-            function,
-            mavutil.mavlink.MAV_PARAM_TYPE_INT32
-        )
-        time.sleep(1)
+        # returns as soon as the board echoes the new value
+        if session.set_param(f'SERVO{servo}_FUNCTION', function, mavutil.mavlink.MAV_PARAM_TYPE_INT32) is None:
+            print(f"{Fore.RED}No PARAM_VALUE for SERVO{servo}_FUNCTION.{Style.RESET_ALL}")
 
     def test_servo_output(servo_start, servo_end, description):
         for i in range(servo_start, servo_end + 1):
@@ -403,7 +475,7 @@ def test_pwm_outputs(master):
             if time.time() - start_time > 30:
                 print(f"{Fore.RED}No key pressed within 30 seconds for {description}. Moving on to next test.{Style.RESET_ALL}")
                 return False
-            response = input(f"{Fore.YELLOW}Press if {description} LEDs are glowing (y/n): {Style.RESET_ALL}").strip().lower()
+            response = prompt(f"{Fore.YELLOW}Press if {description} LEDs are glowing (y/n): {Style.RESET_ALL}").strip().lower()
             if response in ['y', 'n']:
                 break
             print("Invalid input. Please enter 'y' or 'n':")
@@ -424,16 +496,20 @@ def test_pwm_outputs(master):
     return results
 
 def test_radio_status(component_status):
-    mavproxy_process = connect_mavproxy(find_cube_orange_port())
+    session = get_session()
+    if session is None:
+        print(f"{Fore.RED}CubeOrangePlus not found.{Style.RESET_ALL}")
+        component_status["PPM and SBUSo"] = "FAIL"
+        return
 
     print(f"{Fore.CYAN}\n2. Testing PPM and SBUSo...{Style.RESET_ALL}\n")
-    input(f"{Fore.YELLOW}Hold the safety switch for 3 seconds until it starts Blinking Red, then press Enter.\nPlease don't press if already Blinking.\n {Style.RESET_ALL}")
+    # subscribe first so messages sent while the operator holds the switch are kept
+    with session.subscribe(STATUSTEXT) as subscription:
+        prompt(f"{Fore.YELLOW}Hold the safety switch for 3 seconds until it starts Blinking Red, then press Enter.\nPlease don't press if already Blinking.\n {Style.RESET_ALL}")
 
-    try:
         radio_status = "FAIL"
-        start_time = time.time()
-        while time.time() - start_time < 15:
-            line = mavproxy_process.stdout.readline().strip()
+        for msg in subscription.messages(15):
+            line = statustext_line(msg)
             if "Radio Connected" in line:
                 radio_status = "PASS"
                 break
@@ -441,11 +517,6 @@ def test_radio_status(component_status):
                 radio_status = "FAIL"
                 break
         component_status["PPM and SBUSo"] = radio_status
-    finally:
-        mavproxy_process.terminate()
-        keyboard = Controller()
-        keyboard.press('\n')
-        keyboard.release('\n')
     print_status({"PPM and SBUSo": component_status["PPM and SBUSo"]})
 
 def test_psense_cable(component_status, log_file_path):
@@ -457,114 +528,50 @@ def test_psense_cable(component_status, log_file_path):
     
     print(get_firmware_version())
 
-    cube_orange_port = find_cube_orange_port()
-    if cube_orange_port is None:
+    session = get_session()
+    if session is None:
         print(f"{Fore.RED}CubeOrangePlus not found.{Style.RESET_ALL}")
         return
     
     print(f"\n{Fore.CYAN}Testing PSENSE Cable{Style.RESET_ALL}\n")
-    mavproxy_process = connect_mavproxy(cube_orange_port)
-    
-    finished_event = threading.Event()
-    
-    thread = threading.Thread(target=read_output, args=(mavproxy_process, component_status, log_file_path, finished_event, parse_psense_output), daemon=True)
-    thread.start()
-    finished_event.wait(15)  # Timeout after 15 seconds
-    if not finished_event.is_set():
+    if not listen_statustext(session, component_status, log_file_path,
+                             lambda line, status: RULES.apply(line, status, ("PSENSE",))):
         print(f"{Fore.RED}No messages received for PSENSE within timeout.{Style.RESET_ALL}")
-        update_status("Psense Voltage", "NO MESSAGE", component_status)
-        update_status("Psense Current", "NO MESSAGE", component_status)
-        update_status("PSENSE Overall", "NO MESSAGE", component_status)
-    mavproxy_process.terminate()
-    keyboard = Controller()
-    keyboard.press('\n')
-    keyboard.release('\n')
-    print_status({"Psense Voltage": component_status.get("Psense Voltage", "NO MESSAGE"), "Psense Current": component_status.get("Psense Current", "NO MESSAGE"), "PSENSE Overall": component_status.get("PSENSE Overall", "NO MESSAGE")})
-
-def test_psense(component_status, log_file_path, retries=3):
+        for component in RULES.reported("PSENSE"):
+            component_status[component] = "NO MESSAGE"
+    print_status({c: component_status.get(c, "NO MESSAGE") for c in RULES.reported("PSENSE")})
+
+# Components reported by the Lua scripts over STATUSTEXT: psense.lua every 4 s,
+# I2C.lua/I2C2.lua every 2 s. They are all listened for in one window.
+TELEMETRY_GROUPS = ("PSENSE", "ADC", "I2C")
+
+def test_telemetry(component_status, log_file_path, groups=TELEMETRY_GROUPS, retries=3, timeout=10):
+    """Collect PSENSE, ADC and I2C verdicts, retrying only the groups still missing."""
+    pending = RULES.missing(component_status, groups)
     for attempt in range(retries):
-        cube_orange_port = find_cube_orange_port()
-        if cube_orange_port is None:
-            print(f"{Fore.RED}CubeOrangePlus not found.{Style.RESET_ALL}")
-            return
-        
-        print(f"\n{Fore.CYAN}5. Testing PSENSE (Attempt {attempt + 1}){Style.RESET_ALL}\n")
-        mavproxy_process = connect_mavproxy(cube_orange_port)
-        
-        finished_event = threading.Event()
-        
-        thread = threading.Thread(target=read_output, args=(mavproxy_process, component_status, log_file_path, finished_event, parse_psense_output), daemon=True)
-        thread.start()
-        finished_event.wait(20)  # Timeout after 20 seconds
-        mavproxy_process.terminate()
-        keyboard = Controller()
-        keyboard.press('\n')
-        keyboard.release('\n')
-        if finished_event.is_set():
+        if not pending:
             break
-        print(f"{Fore.RED}No messages received for PSENSE within timeout.{Style.RESET_ALL}")
-        update_status("Psense Voltage", "NO MESSAGE", component_status)
-        update_status("Psense Current", "NO MESSAGE", component_status)
-        update_status("PSENSE Overall", "NO MESSAGE", component_status)
-        if attempt < retries - 1:
-            print(f"{Fore.YELLOW}Retrying PSENSE test...{Style.RESET_ALL}")
-    print_status({"Psense Voltage": component_status.get("Psense Voltage", "NO MESSAGE"), "Psense Current": component_status.get("Psense Current", "NO MESSAGE"), "PSENSE Overall": component_status.get("PSENSE Overall", "NO MESSAGE")})
-
-def test_adc(component_status, log_file_path, retries=3):
-    for attempt in range(retries):
-        cube_orange_port = find_cube_orange_port()
-        if cube_orange_port is None:
+        session = get_session()
+        if session is None:
             print(f"{Fore.RED}CubeOrangePlus not found.{Style.RESET_ALL}")
-            return
-        
-        print(f"\n{Fore.CYAN}6. Testing ADC (Attempt {attempt + 1}){Style.RESET_ALL}\n")
-        mavproxy_process = connect_mavproxy(cube_orange_port)
-        
-        finished_event = threading.Event()
-        
-        thread = threading.Thread(target=read_output, args=(mavproxy_process, component_status, log_file_path, finished_event, parse_adc_output), daemon=True)
-        thread.start()
-        finished_event.wait(20)  # Timeout after 20 seconds
-        mavproxy_process.terminate()
-        keyboard = Controller()
-        keyboard.press('\n')
-        keyboard.release('\n')
-        if finished_event.is_set():
             break
-        print(f"{Fore.RED}No messages received for ADC within timeout.{Style.RESET_ALL}")
-        update_status("ADC", "NO MESSAGE", component_status)
-        if attempt < retries - 1:
-            print(f"{Fore.YELLOW}Retrying ADC test...{Style.RESET_ALL}")
-    print_status({"ADC": component_status.get("ADC", "NO MESSAGE")})
 
-def test_i2c(component_status, log_file_path, retries=3):
-    for attempt in range(retries):
-        cube_orange_port = find_cube_orange_port()
-        if cube_orange_port is None:
-            print(f"{Fore.RED}CubeOrangePlus not found.{Style.RESET_ALL}")
-            return
-        
-        print(f"\n{Fore.CYAN}7. Testing I2C (Attempt {attempt + 1}){Style.RESET_ALL}\n")
-        mavproxy_process = connect_mavproxy(cube_orange_port)
-        
-        finished_event = threading.Event()
-        
-        thread = threading.Thread(target=read_output, args=(mavproxy_process, component_status, log_file_path, finished_event, parse_i2c_output), daemon=True)
-        thread.start()
-        finished_event.wait(20)  # Timeout after 20 seconds
-        mavproxy_process.terminate()
-        keyboard = Controller()
-        keyboard.press('\n')
-        keyboard.release('\n')
-        if finished_event.is_set():
-            break
-        print(f"{Fore.RED}No messages received for I2C within timeout.{Style.RESET_ALL}")
-        update_status("I2C1 GPS1", "NO MESSAGE", component_status)
-        update_status("I2C0 GPS2", "NO MESSAGE", component_status)
-        update_status("I2C2 PORT", "NO MESSAGE", component_status)
-        if attempt < retries - 1:
-            print(f"{Fore.YELLOW}Retrying I2C test...{Style.RESET_ALL}")
-    print_status({"I2C1 GPS1": component_status.get("I2C1 GPS1", "NO MESSAGE"), "I2C0 GPS2": component_status.get("I2C0 GPS2", "NO MESSAGE"), "I2C2 PORT": component_status.get("I2C2 PORT", "NO MESSAGE")})
+        print(f"\n{Fore.CYAN}5. Testing {', '.join(pending)} (Attempt {attempt + 1}){Style.RESET_ALL}\n")
+        active = tuple(pending)
+        listen_statustext(session, component_status, log_file_path,
+                          lambda line, status: RULES.apply(line, status, active), timeout=timeout,
+                          done=lambda status: not RULES.missing(status, active),
+                          mode='w' if attempt == 0 else 'a')
+        pending = RULES.missing(component_status, groups)
+        if pending and attempt < retries - 1:
+            print(f"{Fore.YELLOW}No verdict yet for {', '.join(pending)}. Retrying...{Style.RESET_ALL}")
+
+    for group in pending:
+        print(f"{Fore.RED}No messages received for {group} within timeout.{Style.RESET_ALL}")
+        for component in RULES.reported(group):
+            component_status.setdefault(component, "NO MESSAGE")
+
+    print_status({c: component_status.get(c, "NO MESSAGE") for group in groups for c in RULES.reported(group)})
 
 def precheck():
     print(f"\n\n{Fore.CYAN}Precheck:{Style.RESET_ALL}")
@@ -572,7 +579,8 @@ def precheck():
 #    print(f"{Fore.YELLOW}2. SD Card with Lua Scripts is Loaded in Cube.{Style.RESET_ALL}")
     print(f"{Fore.YELLOW}2. Micro USB and Type-C USB is connected to Host Computer.{Style.RESET_ALL}")
     input(f"\n{Fore.CYAN}Press Enter to Continue.{Style.RESET_ALL}")
-    
+
+def wait_for_adb():
     print(f"\n{Fore.YELLOW}Waiting for adb connection...{Style.RESET_ALL}")
     try:
         result = subprocess.run(['adb', 'wait-for-device'], timeout=60, capture_output=True, text=True)
@@ -592,14 +600,29 @@ def main_menu():
     print(f"{Fore.YELLOW}3. Load Release Firmware{Style.RESET_ALL}")
     print(f"{Fore.YELLOW}4. Load Test Firmware{Style.RESET_ALL}")
     print(f"{Fore.YELLOW}5. Reboot Flight Controller{Style.RESET_ALL}")
+    print(f"{Fore.YELLOW}6. Test All Interfaces on Every Fixture{Style.RESET_ALL}")
 
     choice = ''
-    while choice not in ['1', '2', '3', '4', '5']:
-        choice = input(f"\n{Fore.CYAN}Enter your choice (1/2/3/4/5): {Style.RESET_ALL}").strip()
+    while choice not in ['1', '2', '3', '4', '5', '6']:
+        choice = input(f"\n{Fore.CYAN}Enter your choice (1/2/3/4/5/6): {Style.RESET_ALL}").strip()
     return choice
 
+def prepare_flight_computer():
+    """Wait for the flight computer, then open the first shell and push the probe before the lanes start."""
+    print(f"\n{Fore.YELLOW}Waiting for adb connection...{Style.RESET_ALL}")
+    ADB.wait_for_device(timeout=60)
+    # adb root restarts adbd, so it must happen before the other lanes open their shells
+    ADB.run("true")
+    push_probe(ADB)
+    print(f"{Fore.GREEN}ADB connection established. Devices are ready. Proceeding for test.{Style.RESET_ALL}")
+
+def print_schedule(schedule):
+    print(f"\nStage timing: {schedule['wall_time']:.1f} s wall clock, {schedule['sequential_time']:.1f} s if run one after another")
+    print(f"Critical path ({schedule['critical_path_time']:.1f} s): {' -> '.join(schedule['critical_path'])}")
+
 def run_all_tests(qr_code):
     component_status = {}
+    measurements = {}
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     folder_name = f"{qr_code}_{timestamp}"
     specific_folder_path = os.path.join(PRODUCTION_TEST_FOLDER, folder_name)
@@ -610,92 +633,152 @@ def run_all_tests(qr_code):
     print(firmware_version)
 
     if "dev-4.6.0" not in firmware_version:
-        load_firmware(FIRMWARE_TEST_PATH, "Test")
+        check_board_pairing(qr_code, load_firmware(FIRMWARE_TEST_PATH, "Test", specific_folder_path))
     
     print(get_firmware_version())
 
-    cube_orange_port = find_cube_orange_port()
-    if cube_orange_port is None:
+    session = get_session()
+    if session is None:
         print(f"{Fore.RED}CubeOrangePlus not found.{Style.RESET_ALL}")
-        return component_status, specific_folder_path, False
-
-    master = mavutil.mavlink_connection(cube_orange_port, baud=115200)
-    master.wait_heartbeat()
-    pwm_results = test_pwm_outputs(master)
-    component_status.update(pwm_results)
-    
-    test_radio_status(component_status)
-    print(f"\n{Fore.YELLOW}Waiting for adb connection...{Style.RESET_ALL}")
-    try:
-        result = subprocess.run(['adb', 'wait-for-device'], timeout=60, capture_output=True, text=True)
-        if result.returncode == 0:
-            print(f"{Fore.GREEN}ADB connection established. Devices are ready. Proceeding for test.{Style.RESET_ALL}")
-        else:
-            print(f"{Fore.RED}adb connection is not proper. Please check and then rerun the test.{Style.RESET_ALL}")
-            exit(1)
-    except subprocess.TimeoutExpired:
-        print(f"{Fore.RED}adb connection couldn't be estabilished. Please check the connection and try again.{Style.RESET_ALL}")
-        exit(1)
-    print(f"\n{Fore.CYAN}3. Starting Serial Tests through Flight Computer...{Style.RESET_ALL}\n")
-    integrate_serial_test(component_status, 1, [0, 0])
-    integrate_serial_2_test(component_status)
-    integrate_serial_test(component_status, 3, [0, 1])
-    integrate_serial_test(component_status, 4, [1, 0])
-    integrate_serial_test(component_status, 5, [1, 1])
+        return component_status, specific_folder_path, False, measurements
+
+    # every stage using the MAVLink session shares the port; one that closes or reopens it would hold it exclusively
+    stages = [
+        Stage("PWM", lambda results: results.update(test_pwm_outputs(session)), resources=[CONSOLE], shared=[MAVLINK_PORT]),
+        Stage("PPM and SBUSo", test_radio_status, resources=[CONSOLE], shared=[MAVLINK_PORT]),
+        Stage("ADB", lambda results: prepare_flight_computer()),
+        Stage("Serial 1", lambda results: integrate_serial_test(results, 1), resources=[TTYHS2_MUX], after=["ADB"]),
+        Stage("Serial 2", integrate_serial_2_test, resources=[TTYHS1], after=["ADB"]),
+        Stage("Serial 3", lambda results: integrate_serial_test(results, 3), resources=[TTYHS2_MUX], after=["ADB"]),
+        Stage("Serial 4", lambda results: integrate_serial_test(results, 4), resources=[TTYHS2_MUX], after=["ADB"]),
+        Stage("Serial 5", lambda results: integrate_serial_test(results, 5), resources=[TTYHS2_MUX], after=["ADB"]),
+        Stage("CAN 1", lambda results: integrate_can_test(results, 1, measurements), resources=[CAN_MUX_LINES], after=["ADB"]),
+        Stage("CAN 2", lambda results: integrate_can_test(results, 2, measurements), resources=[CAN_MUX_LINES], after=["ADB"]),
+        Stage("Telemetry", lambda results: test_telemetry(results, os.path.join(specific_folder_path, "mavproxy_telemetry_logs.txt")),
+              shared=[MAVLINK_PORT]),
+    ]
+    # each stage writes its own results; they are merged in stage order so the report order is stable
+    stage_status = {stage.name: {} for stage in stages}
+    schedule = run_stages([Stage(stage.name, functools.partial(stage.run, stage_status[stage.name]), stage.resources, stage.after, stage.shared)
+                           for stage in stages], console=CONSOLE)
+    for stage in stages:
+        component_status.update(stage_status[stage.name])
+    for name, error in schedule["errors"].items():
+        print(f"{Fore.RED}{name} failed: {error}{Style.RESET_ALL}")
+    for name in schedule["skipped"] + list(schedule["errors"]):
+        if name.startswith(("Serial", "CAN")):
+            component_status.setdefault(name, "FAIL")
+    measurements["schedule"] = schedule
+
+    print(f"\n{Fore.CYAN}3. Serial Tests through Flight Computer{Style.RESET_ALL}\n")
     print_status({f"Serial {i}": component_status[f"Serial {i}"] for i in range(1, 6)})
-
-    print(f"\n{Fore.CYAN}4. Starting CAN Tests through Flight Computer...{Style.RESET_ALL}\n")
-    integrate_can_test(component_status, 1, 1, 1)
-    integrate_can_test(component_status, 2, 0, 0)
+    print(f"\n{Fore.CYAN}4. CAN Tests through Flight Computer{Style.RESET_ALL}\n")
     print_status({f"CAN {i}": component_status[f"CAN {i}"] for i in range(1, 3)})
-    
-    test_psense(component_status, os.path.join(specific_folder_path, "mavproxy_psense_logs.txt"))
+    print_schedule(schedule)
+
+    return component_status, specific_folder_path, True, measurements
+
+def test_board(qr_code):
+    """Option 1 for one board: test, flash Release if everything passed, report. Returns the failed tests."""
+    component_status, specific_folder_path, success, measurements = run_all_tests(qr_code)
+
+    failed_tests = [component for component, status in component_status.items() if status != "PASS"]
+
+    if failed_tests:
+        print(f"{Fore.RED}One or more tests failed: {failed_tests}. Generating report and ending tests...{Style.RESET_ALL}")
+        json_path = generate_test_result_json(component_status, qr_code, specific_folder_path, "Test Dev-4.6.0", measurements)
+        generate_reports(json_path)
+    else:
+        check_board_pairing(qr_code, load_firmware(FIRMWARE_FINAL_PATH, "Release", specific_folder_path))
+        final_firmware_version = get_firmware_version()
+        print(final_firmware_version)
+        print(f"\n{Fore.CYAN}Testing Serial 2 B2B Connection with Main Board {Style.RESET_ALL}\n")
+
+        integrate_serial_2_test(component_status)
+        print_status({"Serial 2": component_status["Serial 2"]})
 
-    test_adc(component_status, os.path.join(specific_folder_path, "mavproxy_adc_logs.txt"))
+        print(f"\n{Fore.GREEN}Flight Controller Unit has Completed All the tests and is Ready to use.{Style.RESET_ALL}\n")
+        generate_test_result_json(component_status, qr_code, specific_folder_path, final_firmware_version, measurements)
 
-    test_i2c(component_status, os.path.join(specific_folder_path, "mavproxy_i2c_logs.txt"))
+        try:
+            json_file_path = os.path.join(specific_folder_path, "test_results.json")
+            subprocess.run(["python3", REPORT_SCRIPT_PATH, json_file_path, CUBE_IMAGE_PATH], check=True)
+            #print(f"{Fore.GREEN}Report generation script executed successfully.{Style.RESET_ALL}")
+        except subprocess.CalledProcessError as e:
+            print(f"{Fore.RED}An error occurred while executing the report generation script: {e}{Style.RESET_ALL}")
 
-    return component_status, specific_folder_path, True
+    # Display summary table
+    print("\nSummary of all test statuses:")
+    print_status(component_status)
+
+    return failed_tests
+
+def fixture_worker(fixture, lock, stdin_fd):
+    """Option 1 for the board on one fixture, in its own process; its output goes to a log file."""
+    global cube_port, console
+    cube_port = fixture.cube_port
+    for adb in (ADB, ADB_SERIAL_2, ADB_CAN):
+        adb.serial = fixture.adb_serial
+    console = (lock, stdin_fd, os.fdopen(os.dup(sys.stdout.fileno()), "w"), fixture.name)
+
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    log_path = os.path.join(PRODUCTION_TEST_FOLDER, f"fixture_{fixture.name}_{timestamp}.log")
+    log = open(log_path, "w", buffering=1)
+    # subprocesses and C code write to fds 1 and 2 directly, not through sys.stdout
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+    sys.stdout = sys.stderr = log
+
+    qr_code = prompt(f"{Fore.YELLOW}Scan QR code on the board: {Style.RESET_ALL}")
+    print(f"QR code scanned: {qr_code} on fixture {fixture.name} ({fixture.cube_port}, adb {fixture.adb_serial})")
+    failed_tests = test_board(qr_code)
+    with lock:
+        verdict = f"{Fore.RED}FAIL {failed_tests}" if failed_tests else f"{Fore.GREEN}PASS"
+        console[2].write(f"[{fixture.name}] {qr_code}: {verdict}{Style.RESET_ALL} (log {log_path})\n")
+        console[2].flush()
+    sys.exit(1 if failed_tests else 0)
+
+def run_fixtures():
+    if os.path.exists(FIXTURES_FILE):
+        station_fixtures, problems = fixtures.load(FIXTURES_FILE), []
+    else:
+        station_fixtures, problems = fixtures.discover()
+    for problem in problems:
+        print(f"{Fore.RED}{problem}{Style.RESET_ALL}")
+    if not station_fixtures:
+        print(f"{Fore.RED}No fixtures found. Connect each Cube and its flight computer to the same USB hub, or list them in {FIXTURES_FILE}.{Style.RESET_ALL}")
+        return
+    print(tabulate([[f.name, f.cube_port, f.adb_serial] for f in station_fixtures], headers=["Fixture", "Cube", "ADB serial"], tablefmt="grid"))
+
+    # fork keeps the terminal usable in the workers: each gets its own copy of stdin
+    ctx = multiprocessing.get_context("fork")
+    lock = ctx.Lock()
+    workers = []
+    for fixture in station_fixtures:
+        stdin_fd = os.dup(sys.stdin.fileno())
+        worker = ctx.Process(target=fixture_worker, args=(fixture, lock, stdin_fd), name=f"fixture {fixture.name}")
+        worker.start()
+        os.close(stdin_fd)
+        workers.append((fixture, worker))
+    for fixture, worker in workers:
+        worker.join()
+
+    print("\nSummary of all fixtures:")
+    print_status({f"Fixture {fixture.name}": "PASS" if worker.exitcode == 0 else "FAIL" for fixture, worker in workers})
 
 def main():
     precheck()
     choice = main_menu()
+    if choice != '6':
+        # an untargeted wait fails with several flight computers attached; fixture workers wait for their own
+        wait_for_adb()
 
     if choice == '1':
         #print(f"{Fore.YELLOW}Please Ensure SD Card with Lua Scripts Loaded in FCU.{Style.RESET_ALL}")
         qr_code = input(f"\n{Fore.YELLOW}Scan QR code on the board: {Style.RESET_ALL}")
         print(f"{Fore.GREEN}QR code scanned: {qr_code}{Style.RESET_ALL}\n")
-        component_status, specific_folder_path, success = run_all_tests(qr_code)
-
-        failed_tests = [component for component, status in component_status.items() if status != "PASS"]
+        test_board(qr_code)
 
-        if failed_tests:
-            print(f"{Fore.RED}One or more tests failed: {failed_tests}. Generating report and ending tests...{Style.RESET_ALL}")
-            json_path = generate_test_result_json(component_status, qr_code, specific_folder_path, "Test Dev-4.6.0")
-            generate_reports(json_path)
-        else:
-            load_firmware(FIRMWARE_FINAL_PATH, "Release")
-            final_firmware_version = get_firmware_version()
-            print(final_firmware_version)
-            print(f"\n{Fore.CYAN}Testing Serial 2 B2B Connection with Main Board {Style.RESET_ALL}\n")
-
-            integrate_serial_2_test(component_status)
-            print_status({"Serial 2": component_status["Serial 2"]})
-
-            print(f"\n{Fore.GREEN}Flight Controller Unit has Completed All the tests and is Ready to use.{Style.RESET_ALL}\n")
-            generate_test_result_json(component_status, qr_code, specific_folder_path, final_firmware_version)
-
-            try:
-                json_file_path = os.path.join(specific_folder_path, "test_results.json")
-                subprocess.run(["python3", REPORT_SCRIPT_PATH, json_file_path, CUBE_IMAGE_PATH], check=True)
-                #print(f"{Fore.GREEN}Report generation script executed successfully.{Style.RESET_ALL}")
-            except subprocess.CalledProcessError as e:
-                print(f"{Fore.RED}An error occurred while executing the report generation script: {e}{Style.RESET_ALL}")
-
-        # Display summary table
-        print("\nSummary of all test statuses:")
-        print_status(component_status)
-    
     elif choice == '2':
     #    print(f"{Fore.YELLOW}Please Ensure SD Card Loaded with Lua Scripts is Present in FCU.{Style.RESET_ALL}")
         component_status = {}
@@ -718,5 +801,8 @@ def main():
     elif choice == '5':
         reboot_flight_controller()
 
+    elif choice == '6':
+        run_fixtures()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+#
+# Minimal MAVLink HEARTBEAT probe, run on the flight computer over ADB
+#
+# Opens a serial port raw, scans the byte stream for a valid MAVLink v1 or v2
+# HEARTBEAT frame (CRC checked with the message's CRC_EXTRA) and exits 0 with
+# the time to the first frame, or 1 if none arrived before the timeout.
+# Standard library only, and no f-strings, so it runs on the device's python3
+# without anything installed.
+#
+
+import argparse
+import os
+import select
+import sys
+import termios
+import time
+import tty
+
+MAVLINK_V1_MAGIC = 0xFE
+MAVLINK_V2_MAGIC = 0xFD
+MAVLINK_IFLAG_SIGNED = 0x01
+HEARTBEAT_ID = 0
+HEARTBEAT_CRC_EXTRA = 50
+HEARTBEAT_LEN = 9
+
+
+def x25_crc(data, crc=0xFFFF):
+    for byte in data:
+        tmp = (byte ^ crc) & 0xFF
+        tmp = (tmp ^ (tmp << 4)) & 0xFF
+        crc = ((crc >> 8) ^ (tmp << 8) ^ (tmp << 3) ^ (tmp >> 4)) & 0xFFFF
+    return crc
+
+
+def parse_frame(buf):
+    """Parse the frame at the start of buf.
+
+    Returns (consumed, heartbeat) where heartbeat is (version, sysid, compid) for
+    a valid HEARTBEAT, consumed is 0 if more bytes are needed, and 1 if buf does
+    not start with a valid HEARTBEAT. Only one byte is dropped on a mismatch, so
+    a magic byte inside another message's payload can't hide a real frame.
+    """
+    if buf[0] == MAVLINK_V1_MAGIC:
+        header, version = 6, 1
+    elif buf[0] == MAVLINK_V2_MAGIC:
+        header, version = 10, 2
+    else:
+        return 1, None
+    if len(buf) < header:
+        return 0, None
+    length = buf[1]
+    if version == 1:
+        sysid, compid, msgid = buf[3], buf[4], buf[5]
+    else:
+        sysid, compid = buf[5], buf[6]
+        msgid = buf[7] | (buf[8] << 8) | (buf[9] << 16)
+    # v2 trims trailing zero bytes of the payload, so a HEARTBEAT can be shorter
+    if msgid != HEARTBEAT_ID or length > HEARTBEAT_LEN or (version == 1 and length != HEARTBEAT_LEN):
+        return 1, None
+    end = header + length + 2
+    if version == 2 and buf[2] & MAVLINK_IFLAG_SIGNED:
+        signature = 13
+    else:
+        signature = 0
+    if len(buf) < end + signature:
+        return 0, None
+    crc = x25_crc(bytes(buf[1:header + length]))
+    crc = x25_crc(bytes([HEARTBEAT_CRC_EXTRA]), crc)
+    if crc != (buf[end - 2] | (buf[end - 1] << 8)):
+        return 1, None
+    return end + signature, (version, sysid, compid)
+
+
+def open_raw(device, baud):
+    fd = os.open(device, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    tty.setraw(fd)
+    attrs = termios.tcgetattr(fd)
+    speed = getattr(termios, 'B%u' % baud)
+    attrs[4] = attrs[5] = speed
+    termios.tcsetattr(fd, termios.TCSANOW, attrs)
+    termios.tcflush(fd, termios.TCIFLUSH)
+    return fd
+
+
+def probe(fd, timeout):
+    start = time.time()
+    deadline = start + timeout
+    buf = bytearray()
+    received = 0
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None, received
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if not ready:
+            continue
+        chunk = os.read(fd, 4096)
+        received += len(chunk)
+        buf += chunk
+        while buf:
+            consumed, heartbeat = parse_frame(buf)
+            if consumed == 0:
+                break
+            if heartbeat is not None:
+                return heartbeat + (time.time() - start,), received
+            del buf[:consumed]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wait for a MAVLink HEARTBEAT on a serial port.")
+    parser.add_argument('device', help="serial port, e.g. /dev/ttyHS2")
+    parser.add_argument('--baud', type=int, default=921600, help="baud rate")
+    parser.add_argument('--timeout', type=float, default=5.0, help="seconds to wait for a HEARTBEAT")
+    args = parser.parse_args()
+
+    try:
+        fd = open_raw(args.device, args.baud)
+    except (OSError, AttributeError, termios.error) as e:
+        print("ERROR %s: %s" % (args.device, e))
+        sys.exit(2)
+    try:
+        heartbeat, received = probe(fd, args.timeout)
+    finally:
+        os.close(fd)
+
+    if heartbeat is None:
+        print("NO HEARTBEAT on %s after %.1f s (%u bytes)" % (args.device, args.timeout, received))
+        sys.exit(1)
+    version, sysid, compid, elapsed = heartbeat
+    print("HEARTBEAT v%u sysid %u compid %u on %s after %.1f ms" % (version, sysid, compid, args.device, elapsed * 1000.0))
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
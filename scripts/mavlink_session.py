@@ -0,0 +1,201 @@
+import queue
+import threading
+import time
+
+from pymavlink import mavutil
+
+# Messages the station cares about; everything else is only kept as "latest"
+HEARTBEAT = 'HEARTBEAT'
+STATUSTEXT = 'STATUSTEXT'
+AUTOPILOT_VERSION = 'AUTOPILOT_VERSION'
+PARAM_VALUE = 'PARAM_VALUE'
+SYSTEM_TIME = 'SYSTEM_TIME'
+SYS_STATUS = 'SYS_STATUS'
+
+# HEARTBEAT system_status values of an autopilot that finished initialising
+READY_STATES = (
+    mavutil.mavlink.MAV_STATE_STANDBY,
+    mavutil.mavlink.MAV_STATE_ACTIVE,
+    mavutil.mavlink.MAV_STATE_CRITICAL,
+    mavutil.mavlink.MAV_STATE_EMERGENCY,
+)
+
+
+class Subscription:
+    """Queue of the messages of some types received after it was created."""
+
+    def __init__(self, session, types):
+        self.session = session
+        self.types = types
+        self.queue = queue.Queue()
+
+    def get(self, timeout):
+        """Next message, or None if nothing arrives within timeout seconds."""
+        try:
+            return self.queue.get(timeout=max(0.0, timeout))
+        except queue.Empty:
+            return None
+
+    def messages(self, timeout):
+        """Yield messages as they arrive until timeout seconds have passed."""
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            msg = self.get(remaining)
+            if msg is not None:
+                yield msg
+
+    def close(self):
+        self.session._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MavlinkSession:
+    """One MAVLink connection to a flight controller, read by a background thread.
+
+    The reader thread owns all receiving; tests subscribe to the message
+    types they need instead of opening their own connection or MAVProxy.
+    """
+
+    def __init__(self, port, baud=115200):
+        self.port = port
+        self.master = mavutil.mavlink_connection(port, baud=baud)
+        self.closed = threading.Event()
+        self._lock = threading.Lock()
+        # pymavlink's encoder keeps a sequence number; stages send from their own threads
+        self._send_lock = threading.Lock()
+        self._subscriptions = []
+        self._latest = {}
+        self._thread = threading.Thread(target=self._reader, name=f"mavlink {port}", daemon=True)
+        self._thread.start()
+
+    def _reader(self):
+        while not self.closed.is_set():
+            try:
+                msg = self.master.recv_match(blocking=True, timeout=0.5)
+            except Exception:
+                # the board went away (reboot, unplug); the session is dead
+                self.closed.set()
+                break
+            if msg is None or msg.get_type() == 'BAD_DATA':
+                continue
+            msg_type = msg.get_type()
+            with self._lock:
+                self._latest[msg_type] = msg
+                subscriptions = [s for s in self._subscriptions if msg_type in s.types]
+            for subscription in subscriptions:
+                subscription.queue.put(msg)
+
+    def subscribe(self, *types):
+        subscription = Subscription(self, types)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def latest(self, msg_type):
+        with self._lock:
+            return self._latest.get(msg_type)
+
+    def wait_message(self, msg_type, timeout, condition=None):
+        """First msg_type message (matching condition) within timeout, else None."""
+        with self.subscribe(msg_type) as subscription:
+            for msg in subscription.messages(timeout):
+                if condition is None or condition(msg):
+                    return msg
+        return None
+
+    def wait_heartbeat(self, timeout=10):
+        if self.latest(HEARTBEAT) is not None:
+            return self.latest(HEARTBEAT)
+        return self.wait_message(HEARTBEAT, timeout)
+
+    def command_long(self, command, *params):
+        params = list(params) + [0] * (7 - len(params))
+        with self._send_lock:
+            self.master.mav.command_long_send(
+                self.master.target_system,
+                self.master.target_component,
+                command,
+                0,  # Confirmation
+                *params
+            )
+
+    def request_message(self, msg_type, timeout=10):
+        """Ask for one message with MAV_CMD_REQUEST_MESSAGE and wait for it."""
+        msg_id = getattr(mavutil.mavlink, f'MAVLINK_MSG_ID_{msg_type}')
+        with self.subscribe(msg_type) as subscription:
+            self.command_long(mavutil.mavlink.MAV_CMD_REQUEST_MESSAGE, msg_id)
+            return subscription.get(timeout)
+
+    def autopilot_version(self, timeout=10):
+        return self.request_message(AUTOPILOT_VERSION, timeout)
+
+    def uptime(self, timeout=2):
+        """Seconds since the board booted, from a requested SYSTEM_TIME, or None."""
+        msg = self.request_message(SYSTEM_TIME, timeout)
+        if msg is None:
+            return None
+        return msg.time_boot_ms / 1000.0
+
+    def wait_ready(self, timeout):
+        """First HEARTBEAT past initialisation or SYS_STATUS with every enabled sensor healthy, else None."""
+        latest = self.latest(HEARTBEAT)
+        if latest is not None and latest.system_status in READY_STATES:
+            return latest
+        with self.subscribe(HEARTBEAT, SYS_STATUS) as subscription:
+            for msg in subscription.messages(timeout):
+                if msg.get_type() == HEARTBEAT and msg.system_status in READY_STATES:
+                    return msg
+                if msg.get_type() == SYS_STATUS and sensors_healthy(msg):
+                    return msg
+        return None
+
+    def set_param(self, name, value, param_type=mavutil.mavlink.MAV_PARAM_TYPE_INT32, timeout=1.0):
+        """Set a parameter and wait for the PARAM_VALUE that confirms it."""
+        with self.subscribe(PARAM_VALUE) as subscription:
+            with self._send_lock:
+                self.master.mav.param_set_send(
+                    self.master.target_system,
+                    self.master.target_component,
+                    name.encode('utf-8'),
+                    value,
+                    param_type
+                )
+            for msg in subscription.messages(timeout):
+                if msg.param_id == name:
+                    return msg
+        return None
+
+    def reboot(self):
+        self.command_long(mavutil.mavlink.MAV_CMD_PREFLIGHT_REBOOT_SHUTDOWN, 1)
+
+    def close(self):
+        self.closed.set()
+        self._thread.join(timeout=2)
+        try:
+            self.master.close()
+        except Exception:
+            pass
+
+
+def statustext_line(msg):
+    """STATUSTEXT as MAVProxy prints it, which the test parsers expect."""
+    return f"AP: {msg.text}"
+
+
+def sensors_healthy(msg):
+    """Whether a SYS_STATUS reports every present and enabled sensor healthy."""
+    enabled = msg.onboard_control_sensors_present & msg.onboard_control_sensors_enabled
+    return msg.onboard_control_sensors_health & enabled == enabled
@@ -0,0 +1,192 @@
+import concurrent.futures
+import sys
+import threading
+import time
+
+
+class Stage:
+    """A test stage, the resources it holds exclusively or shares while running, and the stages it needs first.
+
+    A shared resource can be held by any number of stages at once, but not
+    while another stage holds it exclusively.
+    """
+
+    def __init__(self, name, run, resources=(), after=(), shared=()):
+        self.name = name
+        self.run = run
+        self.resources = tuple(resources)
+        self.after = tuple(after)
+        self.shared = tuple(shared)
+
+    def conflicts(self, other):
+        """Whether the two stages can't run at the same time because of what they hold."""
+        return bool(set(self.resources).intersection(other.resources + other.shared) or
+                    set(self.shared).intersection(other.resources))
+
+
+class ScheduleError(Exception):
+    """The stages don't form a DAG (unknown dependency, duplicate name or cycle)."""
+
+
+class StageOutput:
+    """sys.stdout stand-in that keeps concurrent stages from printing into the operator's prompts.
+
+    Stages run through live() print as usual; output of stages run through
+    buffered() is held until the stage ends, then written in one piece, or
+    once no live stage is running if one is.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._live = 0
+        self._pending = []
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is not None:
+            buffer.append(text)
+            return len(text)
+        with self._lock:
+            return self.stream.write(text)
+
+    def flush(self):
+        if getattr(self._local, 'buffer', None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def _emit(self, text):
+        with self._lock:
+            if self._live:
+                self._pending.append(text)
+                return
+            self.stream.write(text)
+            self.stream.flush()
+
+    def live(self, run):
+        def wrapper():
+            with self._lock:
+                self._live += 1
+            try:
+                return run()
+            finally:
+                with self._lock:
+                    self._live -= 1
+                    if not self._live:
+                        self.stream.write("".join(self._pending))
+                        self.stream.flush()
+                        self._pending = []
+        return wrapper
+
+    def buffered(self, run):
+        def wrapper():
+            self._local.buffer = []
+            try:
+                return run()
+            finally:
+                text = "".join(self._local.buffer)
+                self._local.buffer = None
+                if text:
+                    self._emit(text)
+        return wrapper
+
+
+def check_stages(stages):
+    names = [stage.name for stage in stages]
+    if len(set(names)) != len(names):
+        raise ScheduleError("duplicate stage names")
+    known = set(names)
+    for stage in stages:
+        missing = [name for name in stage.after if name not in known]
+        if missing:
+            raise ScheduleError(f"{stage.name}: unknown dependencies {missing}")
+    done = set()
+    remaining = list(stages)
+    while remaining:
+        ready = [stage for stage in remaining if all(name in done for name in stage.after)]
+        if not ready:
+            raise ScheduleError(f"dependency cycle among {[stage.name for stage in remaining]}")
+        done.update(stage.name for stage in ready)
+        remaining = [stage for stage in remaining if stage.name not in done]
+
+
+def run_stages(stages, console=None):
+    """Run stages on threads as soon as their dependencies are done and their resources are free.
+
+    Stages are started in list order when several are ready. A stage that raises
+    is reported as failed and everything depending on it is skipped. Returns a
+    report with per-stage timing and the critical path: the chain of stages that
+    each waited on the previous one, ending at the last stage to finish.
+
+    With console set to a resource name, only stages holding it print as they
+    go; the others' output is held back while one of them runs, see StageOutput.
+    """
+    check_stages(stages)
+    if console is not None:
+        output = StageOutput(sys.stdout)
+        stages = [Stage(stage.name, output.live(stage.run) if console in stage.resources else output.buffered(stage.run),
+                        stage.resources, stage.after, stage.shared) for stage in stages]
+        sys.stdout = output
+        try:
+            return run_stages(stages)
+        finally:
+            sys.stdout = output.stream
+
+    by_name = {stage.name: stage for stage in stages}
+    pending = list(stages)
+    running = {}
+    start, end, errors, skipped = {}, {}, {}, []
+    t0 = time.time()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(stages))) as executor:
+        while pending or running:
+            for stage in list(pending):
+                if any(name in errors or name in skipped for name in stage.after):
+                    pending.remove(stage)
+                    skipped.append(stage.name)
+                    continue
+                if all(name in end for name in stage.after) and not any(stage.conflicts(other) for other in running.values()):
+                    pending.remove(stage)
+                    start[stage.name] = time.time() - t0
+                    running[executor.submit(stage.run)] = stage
+            if not running:
+                continue
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                end[stage.name] = time.time() - t0
+                if future.exception() is not None:
+                    errors[stage.name] = repr(future.exception())
+
+    # each stage waited on the dependency or resource holder that finished last before it started
+    waited_on = {}
+    for name in start:
+        stage = by_name[name]
+        blockers = [other for other in end if other != name and end[other] <= start[name] and
+                    (other in stage.after or stage.conflicts(by_name[other]))]
+        if blockers:
+            waited_on[name] = max(blockers, key=lambda other: end[other])
+    path = []
+    if end:
+        name = max(end, key=lambda n: end[n])
+        while name is not None:
+            path.append(name)
+            name = waited_on.get(name)
+        path.reverse()
+
+    return {
+        "wall_time": round(max(end.values(), default=0.0), 2),
+        "sequential_time": round(sum(end[n] - start[n] for n in end), 2),
+        "critical_path": path,
+        "critical_path_time": round(end[path[-1]] - start[path[0]], 2) if path else 0.0,
+        "stages": {
+            n: {"start": round(start[n], 2), "duration": round(end[n] - start[n], 2),
+                "resources": list(by_name[n].resources), "shared": list(by_name[n].shared)}
+            for n in sorted(end, key=lambda n: start[n])
+        },
+        "errors": errors,
+        "skipped": skipped,
+    }
@@ -0,0 +1,123 @@
+import json
+import operator
+import re
+
+# Spec versions this loader understands
+SPEC_VERSIONS = (1,)
+
+# named groups and named backreferences in a rule's pattern
+NAMED_GROUP = re.compile(r'\(\?P([<=])(\w+)')
+
+NUMERIC_OPS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+
+class Rule:
+    """One component verdict: a line pattern and the check applied to its value."""
+
+    def __init__(self, component, group, pattern, check):
+        self.component = component
+        self.group = group
+        self.pattern = pattern
+        self.op = check['op']
+        self.limit = check.get('limit')
+        if self.op not in NUMERIC_OPS and self.op not in ('between', 'contains', 'not_contains'):
+            raise ValueError(f"{component}: unknown check op {self.op!r}")
+        if self.op == 'between' and len(self.limit) != 2:
+            raise ValueError(f"{component}: 'between' needs a [low, high] limit")
+        if re.compile(pattern).groupindex.get('value') is None:
+            raise ValueError(f"{component}: pattern needs a (?P<value>...) group")
+
+    def evaluate(self, value):
+        if self.op == 'contains':
+            passed = self.limit in value
+        elif self.op == 'not_contains':
+            passed = self.limit not in value
+        else:
+            try:
+                number = float(value)
+            except ValueError:
+                return "FAIL"
+            if self.op == 'between':
+                passed = self.limit[0] <= number <= self.limit[1]
+            else:
+                passed = NUMERIC_OPS[self.op](number, self.limit)
+        return "PASS" if passed else "FAIL"
+
+
+class RuleSet:
+    """All rules of a spec compiled into one alternation, so a line is matched once.
+
+    Each rule becomes a capturing group wrapping its pattern; the rule group closes
+    last, so m.lastindex identifies the rule that matched. Named groups inside a
+    rule are prefixed with the rule's index, so rules can reuse group names.
+    """
+
+    def __init__(self, spec):
+        if spec.get('version') not in SPEC_VERSIONS:
+            raise ValueError(f"unsupported telemetry rule spec version {spec.get('version')!r}")
+        self.version = spec['version']
+        self.rules = [Rule(r['component'], r['group'], r['pattern'], r['check']) for r in spec['rules']]
+        self.aggregates = spec.get('aggregates', [])
+        prefix = re.escape(spec.get('line_prefix', ''))
+        alternatives = []
+        for i, rule in enumerate(self.rules):
+            pattern = NAMED_GROUP.sub(lambda m: f'(?P{m.group(1)}r{i}_{m.group(2)}', rule.pattern)
+            alternatives.append(f'(?P<r{i}>{pattern})')
+        self.regex = re.compile(f"{prefix}(?:{'|'.join(alternatives)})")
+        self._by_index = {self.regex.groupindex[f'r{i}']: (rule, f'r{i}_value') for i, rule in enumerate(self.rules)}
+
+    def groups(self):
+        return list(dict.fromkeys(rule.group for rule in self.rules))
+
+    def components(self, group):
+        """Components of group that need a verdict from a line."""
+        return [rule.component for rule in self.rules if rule.group == group]
+
+    def reported(self, group):
+        """Components of group as shown in the status table, aggregates included."""
+        return self.components(group) + [a['component'] for a in self.aggregates if a['group'] == group]
+
+    def missing(self, component_status, groups):
+        return [g for g in groups if any(c not in component_status for c in self.components(g))]
+
+    def match(self, line):
+        """(rule, status) for the rule matching line, or None."""
+        m = self.regex.match(line)
+        if m is None:
+            return None
+        rule, value_group = self._by_index[m.lastindex]
+        return rule, rule.evaluate(m.group(value_group).strip())
+
+    def apply(self, line, component_status, groups=None):
+        """Record the verdict of line in component_status; returns the component or None."""
+        result = self.match(line)
+        if result is None:
+            return None
+        rule, status = result
+        if groups is not None and rule.group not in groups:
+            return None
+        component_status[rule.component] = status
+        for aggregate in self.aggregates:
+            if rule.component in aggregate['of'] and all(c in component_status for c in aggregate['of']):
+                passed = all(component_status[c] == "PASS" for c in aggregate['of'])
+                component_status[aggregate['component']] = "PASS" if passed else "FAIL"
+        return rule.component
+
+
+def load(path):
+    """Load a JSON (or, with PyYAML, YAML) rule spec and compile it."""
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    try:
+        return RuleSet(spec)
+    except (KeyError, TypeError, ValueError, re.error) as e:
+        raise ValueError(f"{path}: invalid telemetry rule spec: {e}") from e
@@ -0,0 +1,85 @@
+#
+# AdbSession's command framing, driven against a local sh standing in for
+# `adb shell`.
+#
+# Run with: python3 -m pytest test_adb_session.py
+#
+
+import os
+
+import pytest
+
+from adb_session import AdbError, AdbSession, AdbTimeout
+
+# adb stand-in: "adb [-s serial] shell" is a local sh, everything else succeeds
+FAKE_ADB = '''#!/bin/sh
+[ "$1" = "-s" ] && shift 2
+[ "$1" = "shell" ] && exec sh
+exit 0
+'''
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    adb = tmp_path / 'adb'
+    adb.write_text(FAKE_ADB)
+    adb.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    session = AdbSession(serial='FAKE', root=False, retries=1, retry_delay=0)
+    yield session
+    session.close()
+
+
+def test_output_and_exit_status(session):
+    assert session.run('echo one; echo two') == (0, 'one\ntwo')
+    assert session.run('false').code == 1
+    assert session.run('exit_code() { return 3; }; exit_code').code == 3
+    assert session.run('true') == (0, '')
+
+
+def test_output_without_trailing_newline(session):
+    assert session.run('printf abc', timeout=2) == (0, 'abc')
+    assert session.run('printf "abc\\ndef"; false', timeout=2) == (1, 'abc\ndef')
+    # the session is still in step afterwards
+    assert session.run('echo next') == (0, 'next')
+
+
+def test_stderr_is_captured(session):
+    assert session.run('echo oops >&2; exit_code() { return 2; }; exit_code') == (2, 'oops')
+
+
+def test_stdin_reader_cannot_eat_the_marker(session):
+    assert session.run('cat', timeout=2) == (0, '')
+    assert session.run('read line; echo "got [$line]"', timeout=2) == (0, 'got []')
+
+
+def test_timeout_closes_the_shell(session):
+    with pytest.raises(AdbTimeout):
+        session.run('sleep 5', timeout=0.2)
+    assert not session.alive
+    # the next command reconnects
+    assert session.run('echo back') == (0, 'back')
+
+
+def test_command_is_resent_only_if_the_shell_was_gone(session, tmp_path):
+    session.run('true')
+    session.process.kill()
+    session.process.wait()
+    # the write fails before the command reaches the shell: reconnect and send it
+    assert session.run('echo resent') == (0, 'resent')
+
+    # the shell dies under the command: it must not run a second time
+    counter = tmp_path / 'counter'
+    with pytest.raises(AdbError):
+        session.run(f'echo ran >> {counter}; kill -9 $$', timeout=2)
+    assert counter.read_text() == 'ran\n'
+
+
+def test_stream(session):
+    lines = []
+    for line in session.stream('for i in 1 2 3; do echo line $i; done; sleep 5', timeout=1):
+        lines.append(line)
+        if len(lines) == 3:
+            break
+    assert lines == ['line 1', 'line 2', 'line 3']
+    assert session.run('echo after') == (0, 'after')
@@ -0,0 +1,69 @@
+#
+# candump -ta -e parsing and the early CAN verdict.
+#
+# Run with: python3 -m pytest test_can_analyzer.py
+#
+
+import pytest
+
+from can_analyzer import CAN_ERR_BUSOFF, CanStats, analyze
+
+FRAME = " (1697012345.{:06d})  can0  {}   [{}]  {}"
+
+
+def frame(ts_us, can_id="1E01F4A2", data="01 02 03 04 05 06 07 08"):
+    return FRAME.format(ts_us, can_id, len(data.split()), data)
+
+
+def error_frame(can_id):
+    return f" (1697012345.000000)  can0  {can_id:08X}   [8]  00 00 00 00 00 00 00 00   ERRORFRAME"
+
+
+@pytest.mark.parametrize("line, kind", [
+    (frame(0), "frame"),
+    (frame(0, can_id="123"), "frame"),
+    (frame(0, data=""), "frame"),
+    (error_frame(0x20000004), "error"),
+    ("", None),
+    ("interface = can0, family = 29, type = 3, proto = 1", None),
+    (" (1697012345.000000)  can0  12345   [8]  00", None),
+])
+def test_feed(line, kind):
+    assert CanStats().feed(line) == kind
+
+
+def test_stats():
+    stats = CanStats()
+    for i, can_id in enumerate(["100", "101", "100", "1E01F4A2"]):
+        stats.feed(frame(i * 100000, can_id=can_id))
+    stats.feed(error_frame(CAN_ERR_BUSOFF))
+    stats.feed(error_frame(0x20000004))
+    assert stats.as_dict() == {"frames": 4, "frames_per_sec": 10.0, "unique_ids": 3, "error_frames": 2, "bus_off": 1}
+
+
+def test_rate_needs_two_frames():
+    stats = CanStats()
+    assert stats.frames_per_sec() == 0.0
+    stats.feed(frame(0))
+    assert stats.frames_per_sec() == 0.0
+    stats.feed(frame(0))
+    assert stats.frames_per_sec() == 0.0
+
+
+def test_analyze_stops_at_min_frames():
+    consumed = []
+
+    def lines():
+        for i in range(100):
+            consumed.append(i)
+            yield frame(i * 1000) if i % 2 else "noise"
+    verdict, stats = analyze(lines(), min_frames=5)
+    assert verdict == "PASS"
+    assert stats.frames == 5
+    assert len(consumed) == 10
+
+
+def test_analyze_fails_on_errors_only():
+    verdict, stats = analyze([error_frame(CAN_ERR_BUSOFF)] * 10 + [frame(0)], min_frames=5)
+    assert verdict == "FAIL"
+    assert (stats.frames, stats.error_frames, stats.bus_off) == (1, 10, 10)
@@ -0,0 +1,102 @@
+#
+# The on-device HEARTBEAT probe's frame parser, against frames encoded by
+# pymavlink.
+#
+# Run with: python3 -m pytest test_mavlink_probe.py
+#
+
+import os
+
+import pytest
+from pymavlink.dialects.v10 import ardupilotmega as mavlink1
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+from mavlink_probe import parse_frame, probe
+
+
+def heartbeat(version=2, sysid=1, compid=1, signed=False):
+    dialect = mavlink1 if version == 1 else mavlink2
+    mav = dialect.MAVLink(None, srcSystem=sysid, srcComponent=compid)
+    if signed:
+        mav.signing.secret_key = bytes(32)
+        mav.signing.link_id = 0
+        mav.signing.timestamp = 1
+        mav.signing.sign_outgoing = True
+    return bytearray(mav.heartbeat_encode(2, 3, 0, 0, 0).pack(mav))
+
+
+def sys_status():
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=1)
+    return bytearray(mav.sys_status_encode(0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0).pack(mav))
+
+
+def scan(buf):
+    """What probe() does with a buffer: the first HEARTBEAT, or None."""
+    buf = bytearray(buf)
+    while buf:
+        consumed, found = parse_frame(buf)
+        if consumed == 0:
+            return None
+        if found is not None:
+            return found
+        del buf[:consumed]
+    return None
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_heartbeat(version):
+    frame = heartbeat(version, sysid=42, compid=7)
+    assert parse_frame(frame) == (len(frame), (version, 42, 7))
+
+
+def test_signed_heartbeat():
+    frame = heartbeat(2, signed=True)
+    assert parse_frame(frame) == (len(frame), (2, 1, 1))
+    # the signature has to arrive too
+    assert parse_frame(frame[:-1]) == (0, None)
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_partial_frame_needs_more(version):
+    frame = heartbeat(version)
+    for end in range(1, len(frame)):
+        assert parse_frame(frame[:end]) == (0, None), end
+
+
+def test_rejects_bad_crc_and_other_messages():
+    frame = heartbeat()
+    frame[-1] ^= 0xFF
+    assert parse_frame(frame) == (1, None)
+    assert parse_frame(sys_status()) == (1, None)
+    assert parse_frame(bytearray(b'\x00' + bytes(heartbeat()))) == (1, None)
+
+
+def test_heartbeat_behind_garbage_and_magic_bytes():
+    # a magic byte in the noise and one inside another message's payload
+    noise = bytearray(b'\xfd\x09\x00\xfe\x01') + sys_status() + bytearray(b'\xfe')
+    assert scan(noise + heartbeat(1, sysid=3)) == (1, 3, 1)
+    corrupt = heartbeat(sysid=9)
+    corrupt[-2] ^= 0x01
+    assert scan(corrupt + heartbeat(sysid=5)) == (2, 5, 1)
+
+
+def test_probe_over_a_pipe():
+    read_fd, write_fd = os.pipe()
+    try:
+        os.write(write_fd, bytes(sys_status() + heartbeat(sysid=4)))
+        found, received = probe(read_fd, timeout=1.0)
+        assert found[:3] == (2, 4, 1)
+        assert received == len(sys_status()) + len(heartbeat())
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+def test_probe_times_out():
+    read_fd, write_fd = os.pipe()
+    try:
+        os.write(write_fd, bytes(sys_status()))
+        assert probe(read_fd, timeout=0.2) == (None, len(sys_status()))
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
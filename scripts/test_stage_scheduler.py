@@ -0,0 +1,110 @@
+#
+# Stage scheduling: DAG checks, dependency and resource ordering, skip
+# propagation, the critical path and held-back console output.
+#
+# Run with: python3 -m pytest test_stage_scheduler.py
+#
+
+import sys
+import threading
+import time
+
+import pytest
+
+from stage_scheduler import ScheduleError, Stage, check_stages, run_stages
+
+
+class Recorder:
+    """Stage bodies that sleep and record when they ran."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = {}
+
+    def stage(self, name, seconds=0.1, resources=(), after=(), shared=(), fail=False):
+        def run():
+            start = time.time()
+            time.sleep(seconds)
+            with self.lock:
+                self.spans[name] = (start, time.time())
+            if fail:
+                raise RuntimeError(f"{name} failed")
+        return Stage(name, run, resources, after, shared)
+
+    def overlap(self, a, b):
+        return self.spans[a][0] < self.spans[b][1] and self.spans[b][0] < self.spans[a][1]
+
+
+def nothing():
+    pass
+
+
+@pytest.mark.parametrize("stages, message", [
+    ([Stage("A", nothing), Stage("A", nothing)], "duplicate"),
+    ([Stage("A", nothing, after=["B"])], "unknown"),
+    ([Stage("A", nothing, after=["C"]), Stage("B", nothing, after=["A"]), Stage("C", nothing, after=["B"])], "cycle"),
+    ([Stage("A", nothing, after=["A"])], "cycle"),
+])
+def test_check_stages(stages, message):
+    with pytest.raises(ScheduleError, match=message):
+        check_stages(stages)
+
+
+def test_dependencies_run_first():
+    r = Recorder()
+    report = run_stages([r.stage("B", after=["A"]), r.stage("A"), r.stage("C", after=["A", "B"])])
+    assert r.spans["A"][1] <= r.spans["B"][0]
+    assert r.spans["B"][1] <= r.spans["C"][0]
+    assert report["critical_path"] == ["A", "B", "C"]
+    assert report["errors"] == {} and report["skipped"] == []
+
+
+def test_exclusive_resources_serialise_and_others_overlap():
+    r = Recorder()
+    report = run_stages([r.stage("A", resources=["mux"]), r.stage("B", resources=["mux"]), r.stage("C", resources=["can"])])
+    assert not r.overlap("A", "B")
+    assert r.overlap("A", "C")
+    # list order decides who gets the resource first
+    assert r.spans["A"][0] < r.spans["B"][0]
+    assert report["critical_path"] == ["A", "B"]
+    assert report["wall_time"] < report["sequential_time"]
+
+
+def test_shared_resources():
+    r = Recorder()
+    run_stages([r.stage("A", shared=["port"]), r.stage("B", shared=["port"]), r.stage("X", resources=["port"]),
+                r.stage("C", shared=["port"])])
+    assert r.overlap("A", "B")
+    assert not r.overlap("A", "X") and not r.overlap("B", "X") and not r.overlap("C", "X")
+
+
+def test_failure_skips_dependents():
+    r = Recorder()
+    report = run_stages([r.stage("A", fail=True), r.stage("B", after=["A"]), r.stage("C", after=["B"]), r.stage("D")])
+    assert list(report["errors"]) == ["A"]
+    assert "A failed" in report["errors"]["A"]
+    assert sorted(report["skipped"]) == ["B", "C"]
+    assert "D" in r.spans and "B" not in r.spans
+
+
+def test_console_output_is_held_back(capsys):
+    started = threading.Event()
+    finished = threading.Event()
+
+    def prompting():
+        print("question?")
+        started.set()
+        # the background stage finishes while the question is open
+        finished.wait(2)
+        time.sleep(0.05)
+        print("answered")
+
+    def background():
+        started.wait(2)
+        print("background result")
+        finished.set()
+
+    report = run_stages([Stage("prompt", prompting, ["console"]), Stage("bg", background)], console="console")
+    assert report["errors"] == {}
+    assert capsys.readouterr().out.splitlines() == ["question?", "answered", "background result"]
+    assert not hasattr(sys.stdout, '_pending')
@@ -0,0 +1,145 @@
+#
+# The telemetry rule compiler: rule dispatch through the combined regex,
+# the checks and the aggregates.
+#
+# Run with: python3 -m pytest test_telemetry_rules.py
+#
+
+import json
+import os
+
+import pytest
+
+import telemetry_rules
+from telemetry_rules import RuleSet
+
+SPEC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'telemetry_rules.json')
+
+
+def rule(component, pattern, op, limit=None, group="G"):
+    return {"component": component, "group": group, "pattern": pattern, "check": {"op": op, "limit": limit}}
+
+
+def ruleset(*rules, **spec):
+    return RuleSet(dict({"version": 1, "rules": list(rules)}, **spec))
+
+
+@pytest.fixture
+def station():
+    return telemetry_rules.load(SPEC_PATH)
+
+
+def test_station_spec(station):
+    assert station.groups() == ["PSENSE", "ADC", "I2C"]
+    assert station.reported("PSENSE") == ["Psense Voltage", "Psense Current", "PSENSE Overall"]
+    status = {}
+    assert station.apply("AP: Psense Voltage: 5.20 V", status) == "Psense Voltage"
+    assert station.apply("AP: Psense Current: 1.50 A", status) == "Psense Current"
+    assert station.apply("AP: Rangefinder Distance: 12.0 cm", status) == "ADC"
+    assert station.apply("AP: I2C1 GPS1: ERROR", status) == "I2C1 GPS1"
+    assert station.apply("AP: I2C2 PORT: Tested", status) == "I2C2 PORT"
+    assert status == {
+        "Psense Voltage": "PASS",
+        "Psense Current": "FAIL",
+        "PSENSE Overall": "FAIL",
+        "ADC": "PASS",
+        "I2C1 GPS1": "FAIL",
+        "I2C2 PORT": "PASS",
+    }
+    assert station.missing(status, ("PSENSE", "ADC", "I2C")) == ["I2C"]
+
+
+def test_lines_that_do_not_match(station):
+    status = {}
+    # no prefix, unknown message, the I2C2.lua device line that isn't a verdict
+    for line in ("Psense Voltage: 5.20 V", "AP: EKF3 IMU0 initialised", "AP: I2C2 PORT: Device 0x1e found"):
+        assert station.apply(line, status) is None
+    assert status == {}
+
+
+def test_groups_filter(station):
+    status = {}
+    assert station.apply("AP: Rangefinder Distance: 12.0 cm", status, groups=("PSENSE",)) is None
+    assert status == {}
+
+
+def test_rule_index_with_nested_named_groups():
+    rules = ruleset(
+        rule("A", r"A: (?P<value>(?P<int>\d+)\.(?P<frac>\d+)) (?P<unit>V|mV)", ">", 1.0),
+        # reuses the inner group names of the first rule
+        rule("B", r"B: (?P<value>(?P<int>\d+)(?:\.(?P<frac>\d+))?) (?P<unit>A)", "<", 5.0),
+        rule("C", r"C: ((x)|(y))+ (?P<value>(?P<word>\w+)) (?P=word)", "contains", "ok"),
+        rule("D", r"D: (?P<value>\d+)(?P<unit> cm)?", "between", [10, 20]),
+    )
+    cases = [
+        ("A: 5.25 V", "A", "PASS"),
+        ("A: 0.50 mV", "A", "FAIL"),
+        ("B: 3 A", "B", "PASS"),
+        ("B: 7.5 A", "B", "FAIL"),
+        ("C: xyx ok ok", "C", "PASS"),
+        ("C: y bad bad", "C", "FAIL"),
+        ("D: 15", "D", "PASS"),
+        ("D: 25 cm", "D", "FAIL"),
+    ]
+    for line, component, verdict in cases:
+        matched, status = rules.match(line)
+        assert (matched.component, status) == (component, verdict), line
+    # the backreference is renamed along with its group
+    assert rules.match("C: x ok no") is None
+
+
+@pytest.mark.parametrize("value, verdict", [("10", "PASS"), ("15.5", "PASS"), ("20", "PASS"), ("9.99", "FAIL"),
+                                            ("20.01", "FAIL"), ("nan", "FAIL"), ("abc", "FAIL")])
+def test_between(value, verdict):
+    rules = ruleset(rule("X", r"X: (?P<value>\S+)", "between", [10, 20]))
+    assert rules.match(f"X: {value}")[1] == verdict
+
+
+@pytest.mark.parametrize("op, limit, value, verdict", [
+    ("not_contains", "ERROR", "Tested", "PASS"),
+    ("not_contains", "ERROR", "ERROR 3", "FAIL"),
+    ("contains", "OK", "all OK", "PASS"),
+    ("contains", "OK", "ok", "FAIL"),
+    (">=", 5, "5", "PASS"),
+    ("<=", 5, "5.1", "FAIL"),
+])
+def test_checks(op, limit, value, verdict):
+    rules = ruleset(rule("X", r"X: (?P<value>.+)", op, limit))
+    assert rules.match(f"X: {value}")[1] == verdict
+
+
+def test_aggregate_waits_for_all_parts():
+    rules = ruleset(
+        rule("V", r"V (?P<value>\S+)", ">", 5.0),
+        rule("I", r"I (?P<value>\S+)", ">", 2.0),
+        aggregates=[{"component": "Overall", "group": "G", "of": ["V", "I"]}],
+    )
+    status = {}
+    rules.apply("V 6", status)
+    assert "Overall" not in status
+    rules.apply("I 3", status)
+    assert status["Overall"] == "PASS"
+    # a later failing reading updates the aggregate
+    rules.apply("V 4", status)
+    assert status["Overall"] == "FAIL"
+
+
+def test_line_prefix():
+    rules = ruleset(rule("X", r"X (?P<value>\d+)", ">", 1), line_prefix="AP: ")
+    assert rules.match("AP: X 2")[1] == "PASS"
+    assert rules.match("X 2") is None
+
+
+@pytest.mark.parametrize("spec", [
+    {"version": 2, "rules": []},
+    {"version": 1, "rules": [rule("X", r"X (?P<v>\d+)", ">", 1)]},
+    {"version": 1, "rules": [rule("X", r"X (?P<value>\d+)", "~", 1)]},
+    {"version": 1, "rules": [rule("X", r"X (?P<value>\d+)", "between", [1])]},
+    {"version": 1, "rules": [rule("X", r"X (?P<value>\d+", ">", 1)]},
+    {"version": 1, "rules": [{"component": "X"}]},
+])
+def test_invalid_specs(tmp_path, spec):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(spec))
+    with pytest.raises(ValueError):
+        telemetry_rules.load(str(path))